@@ -0,0 +1,212 @@
+"""Compare `EthOrder` and `Sweep` on integers (wei) against the Decimal classes they replaced
+
+`DecimalEthOrder` and `DecimalSweep` are pinned copies of the classes as they
+were before amounts moved to integers, as the baseline.  The fixed point side
+times the real `EthOrder` and `Sweep`, so this measures the code that ships.
+Both sides parse the same API orders and search the same pairs, and their
+revenues are checked to agree.
+
+`book` times what a scan pays for the representation: parsing both sides of a
+book of `--book-size` orders a side, then checking every buy and sell pair.
+Parsing happens once per order, but checking once per pair.
+
+    python benchmarks/fixedpoint.py [--pairs N] [--book-size N]
+"""
+import argparse
+import decimal
+from itertools import product
+import random
+import timeit
+
+import attr
+
+from cleansweep.constants import (
+    ETHER_TOKEN_ADDRESS,
+    ETHERDELTA_FEE_PROPORTION,
+    MAX_EXPOSURE_ETHER,
+    SWEEP_TXN_FEE_ETHER,
+    WEI_DECIMALS,
+)
+from cleansweep.records import (
+    EthOrder,
+    Sweep,
+    to_fixed,
+)
+
+TOKEN_ADDRESS = '0x8f3470a7388c05ee4e7af3d01d8c722b0ff52374'
+# Decimal and integer revenues differ by rounding to the wei, at most once per step
+REVENUE_TOLERANCE_WEI = 3
+REPEATS = 5
+
+
+@attr.s(frozen=True)
+class DecimalEthOrder:
+    """`EthOrder` as it was with Decimal amounts"""
+    id = attr.ib()
+    token_amount = attr.ib()
+    eth_amount = attr.ib()
+    price = attr.ib()
+    updated = attr.ib()
+    token_get_address = attr.ib()
+    token_give_address = attr.ib()
+
+    @token_get_address.validator
+    def one_token_is_eth(self, *args, **kwargs):
+        return (
+            (self.token_get_address == ETHER_TOKEN_ADDRESS) ^
+            (self.token_give_address == ETHER_TOKEN_ADDRESS)
+        )
+
+    @property
+    def token_address(self):
+        if self.token_get_address == ETHER_TOKEN_ADDRESS:
+            return self.token_give_address
+        return self.token_get_address
+
+    @classmethod
+    def from_api_order(cls, api_order):
+        return cls(
+            id=api_order['id'],
+            token_amount=decimal.Decimal(api_order['ethAvailableVolume']),
+            eth_amount=decimal.Decimal(api_order['ethAvailableVolumeBase']),
+            price=decimal.Decimal(api_order['price']),
+            updated=api_order['updated'],
+            token_get_address=api_order['tokenGet'],
+            token_give_address=api_order['tokenGive'],
+        )
+
+
+@attr.s(frozen=True)
+class DecimalSweep:
+    """`Sweep` as it was with Decimal amounts"""
+    buy = attr.ib()
+    sell = attr.ib()
+
+    @buy.validator
+    def _validate_order_tokens_match(self, *args, **kwargs):
+        return self.buy.token_address == self.sell.token_address
+
+    @property
+    def available_tokens(self):
+        return min(self.buy.token_amount, self.sell.token_amount)
+
+    @property
+    def amount_of_tokens_to_buy(self):
+        eth_for_all_available = self.available_tokens * self.sell.price
+        eth_spend = min(MAX_EXPOSURE_ETHER, eth_for_all_available)
+        return (eth_spend / eth_for_all_available) * self.available_tokens
+
+    @property
+    def fee_adjusted_sell_price(self):
+        return self.sell.price * (1 - ETHERDELTA_FEE_PROPORTION)
+
+    @property
+    def fee_adjusted_price_difference(self):
+        return self.buy.price - self.fee_adjusted_sell_price
+
+    @property
+    def revenue(self):
+        return self.amount_of_tokens_to_buy * self.fee_adjusted_price_difference - SWEEP_TXN_FEE_ETHER
+
+    @property
+    def is_profitable(self):
+        return self.revenue > decimal.Decimal('0')
+
+
+def random_pair(rng):
+    """Price and amount strings of a buy and a sell, as the API sends them"""
+    return tuple(
+        '{:.7f}'.format(rng.uniform(.0008, .0012)) if i % 2 == 0 else '{:.3f}'.format(rng.uniform(1, 5000))
+        for i in range(4)
+    )
+
+
+def api_order(order_id, price, amount, is_buy):
+    return {
+        'id': order_id,
+        'ethAvailableVolume': amount,
+        'ethAvailableVolumeBase': str(decimal.Decimal(amount) * decimal.Decimal(price)),
+        'price': price,
+        'updated': '2017-11-22T04:55:00.000Z',
+        'tokenGet': TOKEN_ADDRESS if is_buy else ETHER_TOKEN_ADDRESS,
+        'tokenGive': ETHER_TOKEN_ADDRESS if is_buy else TOKEN_ADDRESS,
+    }
+
+
+def api_orders_of(index, pair):
+    buy_price, buy_amount, sell_price, sell_amount = pair
+    return (
+        api_order('buy-{}'.format(index), buy_price, buy_amount, is_buy=True),
+        api_order('sell-{}'.format(index), sell_price, sell_amount, is_buy=False),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pairs', type=int, default=10000)
+    parser.add_argument('--book-size', type=int, default=100)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    api_pairs = [api_orders_of(i, random_pair(rng)) for i in range(args.pairs)]
+    book_buys = [buy for buy, _ in api_pairs[:args.book_size]]
+    book_sells = [sell for _, sell in api_pairs[:args.book_size]]
+
+    def parse(parse_order):
+        return [(parse_order(buy), parse_order(sell)) for buy, sell in api_pairs]
+
+    def search_book(parse_order, sweep_class):
+        buys = [parse_order(o) for o in book_buys]
+        sells = [parse_order(o) for o in book_sells]
+        return [s for s in (sweep_class(b, s) for b, s in product(buys, sells)) if s.is_profitable]
+
+    decimal_pairs = parse(DecimalEthOrder.from_api_order)
+    # `_parse_api_order` rather than `from_api_order`, so nothing comes from `order_cache`
+    fixed_pairs = parse(EthOrder._parse_api_order)
+    decimal_sweeps = [DecimalSweep(b, s) for b, s in decimal_pairs]
+    fixed_sweeps = [Sweep(b, s) for b, s in fixed_pairs]
+
+    for decimal_sweep, fixed_sweep in zip(decimal_sweeps, fixed_sweeps):
+        reference = decimal_sweep.revenue
+        assert decimal_sweep.is_profitable == fixed_sweep.is_profitable, (decimal_sweep, reference)
+        assert abs(to_fixed(reference, WEI_DECIMALS) - fixed_sweep.revenue) <= REVENUE_TOLERANCE_WEI, fixed_sweep
+
+    benchmarks = {
+        'parse': (
+            lambda: parse(DecimalEthOrder.from_api_order),
+            lambda: parse(EthOrder._parse_api_order),
+        ),
+        'sweep': (
+            lambda: [DecimalSweep(b, s) for b, s in decimal_pairs],
+            lambda: [Sweep(b, s) for b, s in fixed_pairs],
+        ),
+        'revenue': (
+            lambda: [s.revenue for s in decimal_sweeps],
+            lambda: [s.revenue for s in fixed_sweeps],
+        ),
+        'is_profitable': (
+            lambda: [s.is_profitable for s in decimal_sweeps],
+            lambda: [s.is_profitable for s in fixed_sweeps],
+        ),
+    }
+    print('{:<14} {:>16} {:>16} {:>8}'.format('pairs/sec', 'Decimal', 'fixed point', 'speedup'))
+    for name, (decimal_run, fixed_run) in benchmarks.items():
+        decimal_seconds = min(timeit.repeat(decimal_run, number=1, repeat=REPEATS))
+        fixed_seconds = min(timeit.repeat(fixed_run, number=1, repeat=REPEATS))
+        print('{:<14} {:>16,.0f} {:>16,.0f} {:>7.2f}x'.format(
+            name, args.pairs / decimal_seconds, args.pairs / fixed_seconds, decimal_seconds / fixed_seconds,
+        ))
+
+    decimal_found = search_book(DecimalEthOrder.from_api_order, DecimalSweep)
+    fixed_found = search_book(EthOrder._parse_api_order, Sweep)
+    assert [(s.buy.id, s.sell.id) for s in decimal_found] == [(s.buy.id, s.sell.id) for s in fixed_found]
+    decimal_seconds = min(timeit.repeat(
+        lambda: search_book(DecimalEthOrder.from_api_order, DecimalSweep), number=1, repeat=REPEATS))
+    fixed_seconds = min(timeit.repeat(lambda: search_book(EthOrder._parse_api_order, Sweep), number=1, repeat=REPEATS))
+    print('{:<14} {:>16,.0f} {:>16,.0f} {:>7.2f}x'.format(
+        'book', 1 / decimal_seconds, 1 / fixed_seconds, decimal_seconds / fixed_seconds,
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Benchmark the hot paths on synthetic inputs, and compare the results with a stored baseline
+
+For each benchmark this reports operations per second, latency percentiles and the
+peak memory allocated by one operation, and writes them all to a JSON file:
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --baseline results.json --output new.json
+
+With `--baseline`, any benchmark whose ops/sec dropped by more than `--tolerance`
+is reported, and the exit status is 1.  Inputs come from
+`cleansweep.simulator.SyntheticMarket`, so the same sizes always give the same inputs.
+"""
+import argparse
+from decimal import Decimal
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from cleansweep.constants import MARKET_ORDERS_KEY
+from cleansweep.records import (
+    EthOrder,
+    Sweep,
+    TokenSnapshot,
+    order_cache,
+)
+from cleansweep.simulator import SyntheticMarket
+
+# Orders per side of the books that orders are parsed and searched from
+BOOK_SIZES = (10, 100, 1000, 10000)
+# Tokens in the whole market `returnTicker`
+TICKER_COUNTS = (1000, 5000)
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def crossed_book(orders_per_side):
+    """The `orders` of one token whose book is crossed, so sweep search has work to do"""
+    market = SyntheticMarket(tokens=1, orders_per_side=orders_per_side, crossed_probability=1)
+    return next(iter(market.books.values()))
+
+
+def benchmarks():
+    """Yield `(name, operation)` for every benchmark, building its inputs first"""
+    for count in TICKER_COUNTS:
+        market = SyntheticMarket(tokens=count, orders_per_side=1).market()
+        frame = json.dumps(market)
+        decoded = json.loads(frame, parse_float=str)
+        yield 'json_loads_decimal/tickers={}'.format(count), lambda f=frame: json.loads(f, parse_float=Decimal)
+        yield 'json_loads_str/tickers={}'.format(count), lambda f=frame: json.loads(f, parse_float=str)
+        yield 'token_snapshot_from_market/tickers={}'.format(count), lambda m=decoded: TokenSnapshot.from_market(m)
+
+    for size in BOOK_SIZES:
+        orders = json.loads(json.dumps(crossed_book(size)), parse_float=str)
+        frame = json.dumps({MARKET_ORDERS_KEY: orders})
+        yield 'json_loads_decimal/orders={}'.format(size), lambda f=frame: json.loads(f, parse_float=Decimal)
+        yield 'from_get_market_orders/orders={}'.format(size), lambda o=orders: EthOrder.from_get_market_orders(o)
+        yield 'from_get_market_orders_uncached/orders={}'.format(size), lambda o=orders: (
+            order_cache.clear(), EthOrder.from_get_market_orders(o),
+        )
+        yield 'sweeps_from_orders/orders={}'.format(size), lambda o=orders: Sweep.sweeps_from_orders(o)
+
+
+def measure(operation, min_seconds, max_rounds):
+    """Time `operation` for at least `min_seconds` (and at least 5 rounds), then trace its memory once"""
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < max_rounds and (len(latencies) < 5 or time.perf_counter() - start < min_seconds):
+        operation_start = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - operation_start)
+
+    # Traced separately, since tracing slows every allocation down
+    tracemalloc.start()
+    operation()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'rounds': len(latencies),
+        'ops_per_sec': len(latencies) / sum(latencies),
+        'latency_p50': percentile(latencies, .5),
+        'latency_p90': percentile(latencies, .9),
+        'latency_p99': percentile(latencies, .99),
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return `(name, baseline ops/sec, ops/sec)` of every benchmark that got slower than `tolerance` allows"""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before and result['ops_per_sec'] < before['ops_per_sec'] * (1 - tolerance):
+            regressions.append((name, before['ops_per_sec'], result['ops_per_sec']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parsing, snapshotting and sweep search')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against results previously written with --output')
+    parser.add_argument('--tolerance', type=float, default=.1, help='Fraction of ops/sec a benchmark may lose')
+    parser.add_argument('--filter', default='', help='Only run benchmarks whose name contains this')
+    parser.add_argument('--min-seconds', type=float, default=.5, help='Time to spend timing each benchmark')
+    parser.add_argument('--max-rounds', type=int, default=10000)
+    args = parser.parse_args()
+
+    results = {}
+    for name, operation in benchmarks():
+        if args.filter not in name:
+            continue
+        results[name] = result = measure(operation, args.min_seconds, args.max_rounds)
+        print('{:<42} {:>12,.1f} ops/sec  p50 {:>9.6f}s  p99 {:>9.6f}s  peak {:>12,} B'.format(
+            name, result['ops_per_sec'], result['latency_p50'], result['latency_p99'], result['peak_memory_bytes'],
+        ))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'python': platform.python_version(), 'benchmarks': results}, output, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['benchmarks']
+        regressions = compare(results, baseline, args.tolerance)
+        for name, before, after in regressions:
+            print('REGRESSION {}: {:,.1f} -> {:,.1f} ops/sec ({:+.1%})'.format(name, before, after, after / before - 1))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,59 +12,273 @@
 import asyncio
 from decimal import Decimal
 import pprint
+import time
 
 from cleansweep.constants import (
     logger,
-    ETHERDELTA_REQUESTS_PER_MINUTE
+    ETHERDELTA_CONNECTIONS,
+    ETHERDELTA_REQUESTS_PER_MINUTE,
+    METRICS_WRITE_SECONDS,
+    PRICE_DECIMALS,
+    SEEN_SWEEPS_MAX_SIZE,
+    SEEN_SWEEPS_TTL_SECONDS,
+    TOKEN_DECIMALS,
+    WARM_START_FLUSH_SECONDS,
+    WEI_DECIMALS,
 )
-from cleansweep.clients.etherdelta import EtherDeltaClient
+from cleansweep import vectorized
+from cleansweep.cache import TTLCache
+from cleansweep.metrics import metrics
+from cleansweep.profiling import Profiler
 from cleansweep.records import (
     EthOrder,
-    Sweep,
+    SweepPlan,
     TokenSnapshot,
+    from_fixed,
+    order_cache,
 )
+from cleansweep.scheduler import (
+    TokenScheduler,
+    book_fingerprint,
+)
+from cleansweep.session import SupervisedSession
+from cleansweep.sharding import ShardedEvaluator
+from cleansweep.sinks import (
+    DROP_OLDEST,
+    JSONLinesSink,
+    sweep_record,
+    transport_for,
+)
+from cleansweep.warmstart import WarmStartStore
+
+# Fingerprints of sweeps that have already been reported
+seen_sweeps = TTLCache(maxsize=SEEN_SWEEPS_MAX_SIZE, ttl=SEEN_SWEEPS_TTL_SECONDS)
 
-seen_sweeps = set()
+def print_maximum_sweep(token, sweeps, plan=None, sink=None, age=None):
+    """Print the most profitable new sweep, and `plan` if sweeping several levels beats it
 
-def print_maximum_sweep(token, sweeps):
-    new_sweeps = set(sweeps) - seen_sweeps
+    With a `sink` (see `cleansweep.sinks`), a compact `sweep_record` is queued on
+    it instead, which never waits on the output.
+
+    `age` is how many seconds old the book is, if it may have changed since (e.g.
+    it was restored from a warm start file).  Its sweep is marked stale, and isn't
+    remembered as reported, so it's reported again once the book is fetched.
+    """
+    new_sweeps = [s for s in sweeps if s.fingerprint not in seen_sweeps]
     if not new_sweeps:
         logger.debug('No new sweeps for candidate token {}'.format(token.ticker))
         return
 
     max_sweep = max(new_sweeps, key=lambda s: s.revenue)
 
-    seen_sweeps.add(max_sweep)
+    if age is None:
+        seen_sweeps.set(max_sweep.fingerprint)
+    if plan is not None and (len(plan.fills) <= 1 or plan.revenue <= max_sweep.revenue):
+        plan = None
+
+    if sink is not None:
+        sink.put(sweep_record(token, max_sweep, plan=plan, age=age))
+        return
 
-    pprint.pprint({
+    output = {
         'ticker': token.ticker,
         'address': token.address,
         'risk_to_reward': max_sweep.risk_per_revenue,
-        'revenue': max_sweep.revenue,
-        'num_tokens': max_sweep.amount_of_tokens_to_buy,
-        'buy_price': max_sweep.buy.price,
-        'sell_price': max_sweep.sell.price,
-    })
-
-async def check_for_sweeps():
-    async with EtherDeltaClient.connect() as socket:
+        'revenue': from_fixed(max_sweep.revenue, WEI_DECIMALS),
+        'num_tokens': from_fixed(max_sweep.amount_of_tokens_to_buy, TOKEN_DECIMALS),
+        'buy_price': from_fixed(max_sweep.buy.price, PRICE_DECIMALS),
+        'sell_price': from_fixed(max_sweep.sell.price, PRICE_DECIMALS),
+    }
+    if age is not None:
+        output['stale_seconds'] = age
+    if plan is not None:
+        output.update({
+            'plan_risk_to_reward': plan.risk_per_revenue,
+            'plan_revenue': from_fixed(plan.revenue, WEI_DECIMALS),
+            'plan_fills': [
+                (
+                    from_fixed(f.amount_of_tokens_to_buy, TOKEN_DECIMALS),
+                    from_fixed(f.buy.price, PRICE_DECIMALS),
+                    from_fixed(f.sell.price, PRICE_DECIMALS),
+                )
+                for f in plan.fills
+            ],
+        })
+    pprint.pprint(output)
+
+def sweeps_from_book(book):
+    """Return the profitable single pair sweeps and the multi-level `SweepPlan` of a book"""
+    with metrics.time('sweep_search_seconds'):
+        buys, sells = book.buys, book.sells
+        return (
+            vectorized.sweeps_from_buys_and_sells(buys, sells),
+            SweepPlan.from_buys_and_sells(buys, sells),
+        )
+
+def best_revenue(sweeps, plan):
+    """Revenue in wei of the best of `sweeps` and `plan`"""
+    return max([s.revenue for s in sweeps] + [plan.revenue], default=0)
+
+def restore_state(saved, scheduler, order_books, sink):
+    """Pick up the candidate tokens and books of a `SavedState`, and report their sweeps straight away, as stale
+
+    The scheduler is told how old each was, so the tokens whose books are missing
+    or oldest are fetched first.  Returns the candidate tokens by address.
+    """
+    if not saved.tokens:
+        return {}
+    scheduler.update_candidates(saved.tokens, age=saved.market_age)
+    for token in saved.tokens:
+        saved_book = saved.books.get(token.address)
+        if saved_book is None:
+            continue
+        book = order_books.restore(token.address, saved_book.buys, saved_book.sells)
+        sweeps, plan = result = sweeps_from_book(book)
+        print_maximum_sweep(token, sweeps, plan=plan, sink=sink, age=saved_book.age)
+        scheduler.record_refresh(
+            token.address, book_fingerprint(book), best_revenue(sweeps, plan), result, age=saved_book.age,
+        )
+    logger.info('Restored {} candidates and {} books, saved {:.0f} seconds ago'.format(
+        len(saved.tokens), len(saved.books), saved.market_age,
+    ))
+    return {token.address: token for token in saved.tokens}
+
+async def check_for_sweeps(
+        recorder=None, metrics_path=None, workers=None, output='-', output_policy=DROP_OLDEST, state_path=None,
+        profile_path=None):
+    """Scan EtherDelta for sweeps, reconnecting whenever the connection fails
+
+    Params:
+        `recorder` - `FrameRecorder` to capture every frame received
+        `metrics_path` - file to write metrics to, in the Prometheus text format,
+            every `METRICS_WRITE_SECONDS`
+        `workers` - search books on this many worker processes, sharded by token.
+            Books are then only fetched, not kept up to date from pushed events
+        `output` - where to write sweeps as JSON lines: '-' for stdout,
+            'unix:<path>' for a UNIX socket, or a file path
+        `output_policy` - what to do when output can't keep up, one of
+            `cleansweep.sinks.POLICIES`
+        `state_path` - warm start file.  The candidates and books saved in it are
+            used straight away, and it's written to every `WARM_START_FLUSH_SECONDS`.
+            With `workers`, only the candidates are saved
+        `profile_path` - sample the scan's stacks and trace its allocations, writing
+            them to files starting with this.  See `Profiler`
+
+    A summary of the time spent in each stage is logged after every cycle.  The
+    candidate tokens, their schedule and their books are kept across reconnects.
+    """
+    scheduler = TokenScheduler()
+    session = SupervisedSession(size=ETHERDELTA_CONNECTIONS, recorder=recorder)
+    tokens_by_address = {}
+    metrics_written = time.monotonic()
+    evaluator = None
+    sink = JSONLinesSink(transport_for(output), policy=output_policy)
+    state = state_path and WarmStartStore(state_path)
+    state_flushed = time.monotonic()
+    profiler = profile_path and Profiler(profile_path)
+
+    def print_book_sweeps(book):
+        """Look for sweeps as soon as a pushed event changes a tracked book"""
+        token = tokens_by_address.get(book.token_address)
+        if token is not None:
+            sweeps, plan = sweeps_from_book(book)
+            print_maximum_sweep(token, sweeps, plan=plan, sink=sink)
+
+    session.order_books.listeners.append(print_book_sweeps)
+
+    async def scan(socket):
+        nonlocal tokens_by_address, metrics_written, state_flushed
         while True:
-            market = await socket.get_market()
-            sweep_candidates = (
-                token for token in TokenSnapshot.from_market(market)
-                if token.is_sweep_possible
-            )
-            sweep_candidates = sorted(sweep_candidates, key=lambda t: -t.buy_to_sell_ratio)
-
-            logger.info('Sweep candidates: {}'.format(
-                [(s.ticker, s.address, s.buy_to_sell_ratio) for s in sweep_candidates]
-            ))
+            # Only waits if output has fallen behind and the policy is to block
+            await sink.drain()
+            # What the previous cycle spent its time on
+            summary = metrics.summary_line()
+            if summary:
+                logger.info('Cycle: {}'.format(summary))
+            if profiler:
+                profiler.end_cycle()
+            if metrics_path and time.monotonic() - metrics_written >= METRICS_WRITE_SECONDS:
+                metrics.write_prometheus(metrics_path)
+                metrics_written = time.monotonic()
+            if state and time.monotonic() - state_flushed >= WARM_START_FLUSH_SECONDS:
+                state.flush_in_background()
+                state_flushed = time.monotonic()
+
+            if scheduler.is_market_due:
+                market = await socket.get_market()
+                sweep_candidates = (
+                    token for token in TokenSnapshot.from_market(market)
+                    if token.is_sweep_possible
+                )
+                sweep_candidates = sorted(sweep_candidates, key=lambda t: -t.buy_to_sell_ratio)
 
-            sweeps_by_token = {}
-            for token in sweep_candidates:
-                api_orders = await socket.get_orders_for_token(token_address=token.address)
-                sweeps = Sweep.sweeps_from_orders(api_orders)
-                print_maximum_sweep(token, sweeps)
+                logger.info('Sweep candidates: {}'.format(
+                    [(s.ticker, s.address, s.buy_to_sell_ratio) for s in sweep_candidates]
+                ))
+
+                # Stop tracking books of tokens that are no longer candidates
+                tokens_by_address = {token.address: token for token in sweep_candidates}
+                for book in list(socket.order_books):
+                    if book.token_address not in tokens_by_address:
+                        socket.order_books.discard(book.token_address)
+                changed = scheduler.update_candidates(sweep_candidates)
+                if state:
+                    state.save_market(sweep_candidates)
+                logger.debug('{} of {} candidates have a new bid or ask'.format(len(changed), len(sweep_candidates)))
+
+            # Only ask for as many books as the rate limit allows without waiting
+            batch = scheduler.next_batch(max(1, socket.rate_limiter.available))
+            if not batch:
+                wait = scheduler.seconds_until_due()
+                logger.debug('Seen sweeps cache: {}'.format(seen_sweeps.stats))
+                logger.debug('Order cache: {}'.format(order_cache.stats))
+                logger.debug('Response cache: {}'.format(socket.response_cache.stats))
+                logger.info('Nothing due, listening for order updates for {:.1f} seconds'.format(wait))
+                await socket.listen(wait)
+                continue
+
+            if evaluator is not None:
+                async def fetch_and_evaluate(token):
+                    # Decoded on the worker, not here
+                    text = await socket.get_market_text(token.address)
+                    return await evaluator.evaluate(token.address, text)
+
+                results = await asyncio.gather(*(fetch_and_evaluate(token) for token in batch))
+                for token, result in zip(batch, results):
+                    print_maximum_sweep(token, result.sweeps, plan=result.plan, sink=sink)
+                    scheduler.record_refresh(token.address, result.fingerprint, result.best_revenue)
+                continue
+
+            # Books kept current by pushed events aren't fetched again, only new and stale ones
+            books = await asyncio.gather(*(
+                socket.get_order_book(token_address=token.address) for token in batch
+            ))
+            for token, book in zip(batch, books):
+                # Reuse the sweeps found last time if the book hasn't changed since
+                fingerprint = book_fingerprint(book)
+                cached = scheduler.cached_result(token.address, fingerprint)
+                result = cached or sweeps_from_book(book)
+                sweeps, plan = result
+                print_maximum_sweep(token, sweeps, plan=plan, sink=sink)
+                scheduler.record_refresh(
+                    token.address, fingerprint, best_revenue(sweeps, plan), result, reused=cached is not None,
+                )
+                if state:
+                    state.save_book(book)
 
-            logger.info('Completed sweep, resting for 10 seconds')
-            await asyncio.sleep(10)
+    async with sink:
+        if state:
+            tokens_by_address = restore_state(state.load(), scheduler, session.order_books, sink)
+        if profiler:
+            profiler.start()
+        try:
+            if not workers:
+                await session.run(scan)
+                return
+            async with ShardedEvaluator(workers) as evaluator:
+                await session.run(scan)
+        finally:
+            if profiler:
+                profiler.stop()
+            if state:
+                await state.close()
@@ -0,0 +1,142 @@
+"""Backtest sweep detection over recorded market history, across a grid of cost models
+
+The order books in one or more captures (made with `cleansweep --record`) are
+searched for sweeps once per `CostModel` in a grid, e.g. of every combination of
+several maximum exposures, gas prices and fees:
+
+    cleansweep backtest capture.gz --max-exposure .5 1 2 --gas-price-gwei 1 4 20
+
+Work is split into tasks of one capture and a chunk of the grid, and run on a
+process pool.  Each task parses its capture's books once and then evaluates every
+model in its chunk against them, so parsing isn't repeated for every model.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+import itertools
+import os
+
+import attr
+
+from cleansweep.clients.lazyjson import LazyObject
+from cleansweep.clients.socketio import (
+    SocketIOClient,
+    split_frame,
+)
+from cleansweep.constants import (
+    ETHERDELTA_FEE_PROPORTION,
+    GAS_PRICE,
+    MARKET_EVENT_NAME,
+    MARKET_ORDERS_KEY,
+    MAX_EXPOSURE_ETHER,
+)
+from cleansweep.recording import read_frames
+from cleansweep.records import (
+    CostModel,
+    EthOrder,
+    OrderColumns,
+    Sweep,
+    SweepPlan,
+)
+
+GWEI = Decimal('.000000001')
+
+
+@attr.s(slots=True)
+class BacktestResult:
+    """Totals for one `CostModel` over every book it was evaluated against, with ETH amounts in wei"""
+    cost_model = attr.ib()
+    books = attr.ib(default=0)
+    # Books with at least one profitable sweep
+    profitable_books = attr.ib(default=0)
+    sweeps = attr.ib(default=0)
+    # Sum of the best single sweep's revenue in each book
+    revenue = attr.ib(default=0)
+    # Sum of the multi-level plan's revenue in each book
+    plan_revenue = attr.ib(default=0)
+
+    def add_book(self, buys, sells):
+        self.books += 1
+        sweeps = Sweep.sweeps_from_buys_and_sells(buys, sells, cost_model=self.cost_model)
+        if sweeps:
+            self.profitable_books += 1
+            self.sweeps += len(sweeps)
+            self.revenue += max(s.revenue for s in sweeps)
+            self.plan_revenue += SweepPlan.from_buys_and_sells(buys, sells, cost_model=self.cost_model).revenue
+
+    def merge(self, other):
+        """Add the totals of `other`, for the same cost model, to these"""
+        self.books += other.books
+        self.profitable_books += other.profitable_books
+        self.sweeps += other.sweeps
+        self.revenue += other.revenue
+        self.plan_revenue += other.plan_revenue
+
+
+def cost_model_grid(max_exposures=(MAX_EXPOSURE_ETHER,), gas_prices=(GAS_PRICE,),
+                    fee_proportions=(ETHERDELTA_FEE_PROPORTION,)):
+    """Return a `CostModel` for every combination of the given amounts, in ETH"""
+    return [
+        CostModel.from_ether(max_exposure, gas_price, fee_proportion)
+        for max_exposure, gas_price, fee_proportion
+        in itertools.product(max_exposures, gas_prices, fee_proportions)
+    ]
+
+
+def read_books(path):
+    """Yield `(buys, sells)` for every non-empty book in the `market` events of a capture"""
+    for _, frame in read_frames(path):
+        if not frame.startswith(SocketIOClient.SOCKET_IO_CONSTANT):
+            continue
+        event, arguments = split_frame(frame[len(SocketIOClient.SOCKET_IO_CONSTANT):])
+        if event != MARKET_EVENT_NAME or not arguments:
+            continue
+        market = LazyObject(arguments, parse_float=str)
+        if MARKET_ORDERS_KEY in market:
+            buys, sells = EthOrder.from_get_market_orders(market[MARKET_ORDERS_KEY])
+            if buys and sells:
+                yield OrderColumns(buys), OrderColumns(sells)
+
+
+def backtest_capture(path, cost_models):
+    """Evaluate every model in `cost_models` against the books in the capture at `path`"""
+    books = list(read_books(path))
+    results = []
+    for cost_model in cost_models:
+        result = BacktestResult(cost_model)
+        for buys, sells in books:
+            result.add_book(buys, sells)
+        results.append(result)
+    return results
+
+
+def backtest(paths, cost_models, workers=None):
+    """Evaluate every model in `cost_models` against every capture in `paths`
+
+    Params:
+        `workers` - processes to use, or `os.cpu_count()` if None.  With 1, no pool is made
+    Returns a `BacktestResult` for each cost model, in the same order.  With no
+    `paths` they're all empty, and with no `cost_models` there are none.
+    """
+    workers = workers or os.cpu_count() or 1
+    paths = list(paths)
+    cost_models = list(cost_models)
+    if not paths or not cost_models:
+        return [BacktestResult(cost_model) for cost_model in cost_models]
+    # Enough tasks to keep every worker busy, without splitting the grid more than needed
+    chunk_count = min(len(cost_models), max(1, -(-2 * workers // len(paths))))
+    chunk_size = -(-len(cost_models) // chunk_count)
+    starts = range(0, len(cost_models), chunk_size)
+    tasks = [(path, start) for path in paths for start in starts]
+    paths_and_chunks = [(path, cost_models[start:start + chunk_size]) for path, start in tasks]
+
+    if workers == 1:
+        task_results = [backtest_capture(path, chunk) for path, chunk in paths_and_chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            task_results = list(executor.map(backtest_capture, *zip(*paths_and_chunks)))
+
+    results = [BacktestResult(cost_model) for cost_model in cost_models]
+    for (_, start), chunk_results in zip(tasks, task_results):
+        for offset, result in enumerate(chunk_results):
+            results[start + offset].merge(result)
+    return results
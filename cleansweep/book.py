@@ -0,0 +1,204 @@
+"""Local per-token order books, seeded from `getMarket` and patched from pushed events"""
+import itertools
+
+from cleansweep.constants import (
+    logger,
+    MARKET_ORDERS_BUY_KEY,
+    MARKET_ORDERS_SELL_KEY,
+    ORDER_DELETED_KEY,
+    TRADE_TOKEN_ADDRESS_KEY,
+)
+from cleansweep.records import (
+    EthOrder,
+    OrderColumns,
+    OrderType,
+    order_cache,
+)
+
+
+class OrderBook:
+    """The open buys and sells of a single token, kept up to date in place.
+
+    The book is seeded once from the `orders` of a token's `getMarket` response,
+    and then patched from the `orders` frames the server pushes.  Orders are kept
+    by id, and sorted lazily the first time a side is read after a change.  Each
+    sorted side is an `OrderColumns`, so its columns are built at most once per change.
+
+    `trades` frames don't say which orders were filled, so a trade only marks the
+    book `stale`.  A stale book is still usable, but should be re-seeded.
+    """
+    def __init__(self, token_address):
+        self.token_address = token_address
+        self._buys_by_id = {}
+        self._sells_by_id = {}
+        self._buys = OrderColumns()
+        self._sells = OrderColumns()
+        self._is_sorted = True
+        # Incremented on every change, so consumers can cheaply tell if the book moved
+        self.version = 0
+        self.stale = True
+
+    def __len__(self):
+        return len(self._buys_by_id) + len(self._sells_by_id)
+
+    @property
+    def buys(self):
+        """Open buys, ordered from highest price to lowest"""
+        self._sort()
+        return self._buys
+
+    @property
+    def sells(self):
+        """Open sells, ordered from lowest price to highest"""
+        self._sort()
+        return self._sells
+
+    def _sort(self):
+        if self._is_sorted:
+            return
+        self._buys = OrderColumns(sorted(self._buys_by_id.values(), key=lambda o: o.price, reverse=True))
+        self._sells = OrderColumns(sorted(self._sells_by_id.values(), key=lambda o: o.price))
+        self._is_sorted = True
+
+    def order_ids(self):
+        """Ids of every order in the book"""
+        return itertools.chain(self._buys_by_id, self._sells_by_id)
+
+    def _side_for(self, order):
+        if order.order_type == OrderType.BUY:
+            return self._buys_by_id
+        return self._sells_by_id
+
+    def seed(self, orders):
+        """Replace the contents of the book with the `orders` of a `getMarket` response"""
+        buys, sells = EthOrder.from_get_market_orders(orders)
+        self._replace(buys, sells)
+        self.stale = False
+
+    def restore(self, buys, sells):
+        """Replace the contents of the book with sorted `EthOrder`s saved earlier
+
+        The book stays `stale`, since it may have changed since they were saved.
+        """
+        self._replace(buys, sells)
+        self.stale = True
+
+    def _replace(self, buys, sells):
+        buys_by_id = {o.id: o for o in buys}
+        sells_by_id = {o.id: o for o in sells}
+        # Orders that left the book won't be seen again
+        for order_id in self._buys_by_id.keys() - buys_by_id.keys():
+            order_cache.invalidate(order_id)
+        for order_id in self._sells_by_id.keys() - sells_by_id.keys():
+            order_cache.invalidate(order_id)
+        self._buys_by_id = buys_by_id
+        self._sells_by_id = sells_by_id
+        # `getMarket` already returns each side sorted
+        self._buys = OrderColumns.of(buys)
+        self._sells = OrderColumns.of(sells)
+        self._is_sorted = True
+        self.version += 1
+
+    def apply_order(self, order, deleted=False):
+        """Insert, replace or remove a single pushed `EthOrder`.  Returns True if the book changed"""
+        side = self._side_for(order)
+        if deleted or not order.token_amount:
+            order_cache.invalidate(order.id)
+            if side.pop(order.id, None) is None:
+                return False
+        else:
+            # Unchanged orders are usually the same object, from `order_cache`
+            existing = side.get(order.id)
+            if existing is order or existing == order:
+                return False
+            side[order.id] = order
+
+        self._is_sorted = False
+        self.version += 1
+        return True
+
+
+class OrderBooks:
+    """`OrderBook`s for every tracked token, keyed by token address
+
+    Routes the `orders` and `trades` frames pushed by the server to the book they
+    belong to.  Frames for tokens that aren't tracked are ignored.  `listeners` are
+    called with each book that a pushed frame changed.
+    """
+    def __init__(self):
+        self._books = {}
+        self.listeners = []
+
+    def __contains__(self, token_address):
+        return token_address in self._books
+
+    def __getitem__(self, token_address):
+        return self._books[token_address]
+
+    def __iter__(self):
+        return iter(self._books.values())
+
+    def __len__(self):
+        return len(self._books)
+
+    def get(self, token_address):
+        return self._books.get(token_address)
+
+    def seed(self, token_address, orders):
+        """Start tracking (or re-seed) the book for `token_address` from `getMarket` `orders`"""
+        book = self._books.get(token_address)
+        if book is None:
+            book = self._books[token_address] = OrderBook(token_address)
+        book.seed(orders)
+        return book
+
+    def restore(self, token_address, buys, sells):
+        """Start tracking the book for `token_address` from saved `EthOrder`s.  See `OrderBook.restore`"""
+        book = self._books.get(token_address)
+        if book is None:
+            book = self._books[token_address] = OrderBook(token_address)
+        book.restore(buys, sells)
+        return book
+
+    def discard(self, token_address):
+        """Stop tracking the book for `token_address`"""
+        book = self._books.pop(token_address, None)
+        if book is not None:
+            for order_id in book.order_ids():
+                order_cache.invalidate(order_id)
+
+    def mark_stale(self):
+        """Mark every book stale, e.g. after a reconnect may have missed pushed events"""
+        for book in self._books.values():
+            book.stale = True
+
+    def _notify(self, books):
+        for book in books:
+            for listener in self.listeners:
+                listener(book)
+
+    def on_orders(self, orders):
+        """Patch books from a pushed `orders` event, a dict of buys and sells.  Returns the books it changed"""
+        changed = {}
+        for api_order in orders.get(MARKET_ORDERS_BUY_KEY, []) + orders.get(MARKET_ORDERS_SELL_KEY, []):
+            # Most pushed orders are for other tokens, so they're never parsed or cached
+            book = self._books.get(EthOrder.token_address_of(api_order))
+            if book is None:
+                continue
+            order = EthOrder.from_api_order(api_order)
+            if book.apply_order(order, deleted=bool(api_order.get(ORDER_DELETED_KEY))):
+                changed[book.token_address] = book
+
+        logger.debug('Pushed orders changed {} books'.format(len(changed)))
+        self._notify(changed.values())
+        return list(changed.values())
+
+    def on_trades(self, trades):
+        """Mark books stale from a pushed `trades` event, a list of trades.  Returns the books marked"""
+        stale = []
+        for trade in trades:
+            book = self._books.get(trade.get(TRADE_TOKEN_ADDRESS_KEY))
+            if book is not None:
+                book.stale = True
+                stale.append(book)
+        return stale
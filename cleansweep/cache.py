@@ -0,0 +1,197 @@
+"""Bounded in-memory caches"""
+import asyncio
+from collections import OrderedDict
+import time
+
+from cleansweep.metrics import metrics
+
+
+class TTLCache:
+    """A mapping of at most `maxsize` entries, which each expire `ttl` seconds after being set
+
+    When full, setting a new key evicts the least recently used entry.  Expired
+    entries are dropped when they're next looked up.  `hits`, `misses`,
+    `evictions` and `expirations` count what happened to lookups and entries.
+    """
+    def __init__(self, maxsize, ttl, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        # key -> (expires_at, value), from least to most recently used
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key, default=None):
+        """Return the value for `key`, or `default` if it's missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value=True):
+        """Set `key` to `value`, restarting its time to live"""
+        self._entries[key] = (self._clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    @property
+    def hit_rate(self):
+        """Fraction of lookups that were hits, or 0 before any lookups"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def invalidate(self, key):
+        """Remove `key`, if it's present"""
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    @property
+    def stats(self):
+        """Counts of lookups and removed entries, e.g. for logging"""
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+class VersionedTTLCache(TTLCache):
+    """A `TTLCache` whose values are only returned when looked up with the version they were set with
+
+    For things like orders, which are identified by id but change over time.  A
+    lookup with a different version is a miss, also counted in `stale`.
+    """
+    def __init__(self, maxsize, ttl, clock=time.monotonic):
+        super(VersionedTTLCache, self).__init__(maxsize, ttl, clock=clock)
+        self.stale = 0
+
+    def get_version(self, key, version, default=None):
+        """Return the value for `key` if it was set with `version`, else `default`"""
+        entry = self.get(key, _MISSING)
+        if entry is _MISSING:
+            return default
+        cached_version, value = entry
+        if cached_version != version:
+            self.hits -= 1
+            self.misses += 1
+            self.stale += 1
+            return default
+        return value
+
+    def set_version(self, key, version, value):
+        self.set(key, (version, value))
+
+    @property
+    def stats(self):
+        return dict(super(VersionedTTLCache, self).stats, stale=self.stale, hit_rate=self.hit_rate)
+
+
+class SingleFlightCache:
+    """Caches what coroutines return by key for `ttl` seconds, and merges concurrent calls for the same key
+
+    `get` with a key that's cached returns the cached value.  Otherwise, if another
+    caller is already fetching that key, it waits for and returns that caller's
+    result (or error), rather than fetching again.  Counts go to the `<name>_hits`,
+    `<name>_misses` and `<name>_coalesced` metrics, as well as `stats`.
+    """
+    def __init__(self, maxsize, ttl, name='single_flight', clock=time.monotonic):
+        self.name = name
+        self.coalesced = 0
+        self._cache = TTLCache(maxsize, ttl, clock=clock)
+        # key -> future of the fetch in flight
+        self._in_flight = {}
+
+    @property
+    def ttl(self):
+        return self._cache.ttl
+
+    def __len__(self):
+        return len(self._cache)
+
+    async def get(self, key, fetch):
+        """Return the value of `key`, awaiting `fetch()` for it if it isn't cached or being fetched"""
+        while True:
+            value = self._cache.get(key, _MISSING)
+            if value is not _MISSING:
+                metrics.counter(self.name + '_hits', 'Requests answered from the cache').inc()
+                return value
+
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                break
+            self.coalesced += 1
+            metrics.counter(self.name + '_coalesced', 'Requests merged into one already in flight').inc()
+            try:
+                return await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                # The caller that was fetching was cancelled, rather than this one, so fetch again
+                if not in_flight.cancelled():
+                    raise
+
+        metrics.counter(self.name + '_misses', 'Requests that had to be made').inc()
+        in_flight = self._in_flight[key] = asyncio.get_event_loop().create_future()
+        # Mark errors retrieved, so there's no warning if no other caller was waiting
+        in_flight.add_done_callback(lambda future: future.cancelled() or future.exception())
+        try:
+            value = await fetch()
+        except asyncio.CancelledError:
+            in_flight.cancel()
+            raise
+        except Exception as e:
+            in_flight.set_exception(e)
+            raise
+        finally:
+            is_current = self._in_flight.get(key) is in_flight
+            if is_current:
+                del self._in_flight[key]
+
+        # Invalidated while in flight, so it may already be out of date
+        if is_current:
+            self._cache.set(key, value)
+        in_flight.set_result(value)
+        return value
+
+    def invalidate(self, key):
+        """Forget the cached value of `key`
+
+        A fetch already in flight still answers the callers waiting on it, but isn't
+        cached, and later callers fetch again.
+        """
+        self._cache.invalidate(key)
+        self._in_flight.pop(key, None)
+
+    def clear(self):
+        self._cache.clear()
+
+    @property
+    def stats(self):
+        return dict(self._cache.stats, coalesced=self.coalesced, in_flight=len(self._in_flight))
+
+
+_MISSING = object()
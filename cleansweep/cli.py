@@ -1,22 +1,113 @@
 import argparse
 import asyncio
+from decimal import Decimal
 import logging
 import pprint
-import time
 
 from cleansweep import check_for_sweeps
-from cleansweep.constants import logger
+from cleansweep.backtest import (
+    GWEI,
+    backtest,
+    cost_model_grid,
+)
+from cleansweep.constants import (
+    logger,
+    ETHERDELTA_FEE_PROPORTION,
+    GAS_PRICE,
+    MAX_EXPOSURE_ETHER,
+    WEI_DECIMALS,
+)
+from cleansweep.recording import (
+    FrameRecorder,
+    replay,
+)
+from cleansweep.records import from_fixed
+from cleansweep.sinks import (
+    DROP_OLDEST,
+    POLICIES,
+)
 
 def main():
-    """Runs the sweeper once and prints the output, optionally logging more"""
+    """Runs the sweeper and prints the output, optionally logging more
+
+    `cleansweep replay <file>` instead replays a capture made with `--record`, and
+    `cleansweep backtest <file>...` evaluates a grid of cost models against captures.
+    """
     parser = argparse.ArgumentParser()
     parser.add_argument('--verbose', help='Turn on debug logging', action='store_true')
+    parser.add_argument('--record', metavar='FILE', help='Append every frame received to a capture file')
+    parser.add_argument('--metrics', metavar='FILE', help='Periodically write metrics to a Prometheus text file')
+    parser.add_argument(
+        '--workers', type=int, default=None, help='Search order books on this many processes, sharded by token',
+    )
+    parser.add_argument(
+        '--output', metavar='TARGET', default='-',
+        help="Write sweeps as JSON lines to stdout ('-'), a file, or a UNIX socket ('unix:PATH')",
+    )
+    parser.add_argument(
+        '--output-policy', choices=POLICIES, default=DROP_OLDEST,
+        help='What to do when output falls behind: drop records, or hold scanning back',
+    )
+    parser.add_argument(
+        '--state', metavar='FILE', help='Start from the candidates and books saved in this file, and keep it updated',
+    )
+    parser.add_argument(
+        '--profile', metavar='PREFIX', nargs='?', const='cleansweep-profile',
+        help='Write sampled stacks to PREFIX.collapsed, and top allocation sites to PREFIX.allocations.jsonl',
+    )
+    subparsers = parser.add_subparsers(dest='command')
+    replay_parser = subparsers.add_parser('replay', help='Replay a capture through the sweep pipeline')
+    replay_parser.add_argument('file', help='Capture file made with --record')
+    replay_parser.add_argument(
+        '--speed', type=float, default=None,
+        help='Multiple of recorded time to replay at. As fast as possible if not given',
+    )
+    backtest_parser = subparsers.add_parser('backtest', help='Find sweeps in captures across a grid of cost models')
+    backtest_parser.add_argument('files', nargs='+', help='Capture files made with --record')
+    backtest_parser.add_argument(
+        '--max-exposure', type=Decimal, nargs='+', default=[MAX_EXPOSURE_ETHER], help='Most ETH to spend on a sweep',
+    )
+    backtest_parser.add_argument(
+        '--gas-price-gwei', type=Decimal, nargs='+', default=[GAS_PRICE / GWEI], help='Gas prices in gwei',
+    )
+    backtest_parser.add_argument(
+        '--fee', type=Decimal, nargs='+', default=[ETHERDELTA_FEE_PROPORTION], help='Exchange fee proportions',
+    )
+    backtest_parser.add_argument('--workers', type=int, default=None, help='Processes to use. One per CPU by default')
     args = parser.parse_args()
 
     if args.verbose:
         logger.setLevel(logging.DEBUG)
 
-    while True:
-        asyncio.get_event_loop().run_until_complete(check_for_sweeps())
+    if args.command == 'replay':
+        pprint.pprint(replay(args.file, speed=args.speed))
+        return
+
+    if args.command == 'backtest':
+        cost_models = cost_model_grid(
+            args.max_exposure, [g * GWEI for g in args.gas_price_gwei], args.fee,
+        )
+        results = backtest(args.files, cost_models, workers=args.workers)
+        for result in sorted(results, key=lambda r: r.revenue, reverse=True):
+            pprint.pprint({
+                'max_exposure': from_fixed(result.cost_model.max_exposure, WEI_DECIMALS),
+                'gas_price': from_fixed(result.cost_model.gas_price, WEI_DECIMALS),
+                'fee': Decimal(result.cost_model.fee_numerator) / result.cost_model.fee_denominator,
+                'books': result.books,
+                'profitable_books': result.profitable_books,
+                'sweeps': result.sweeps,
+                'revenue': from_fixed(result.revenue, WEI_DECIMALS),
+                'plan_revenue': from_fixed(result.plan_revenue, WEI_DECIMALS),
+            })
+        return
 
-        time.sleep(10)
+    recorder = args.record and FrameRecorder(args.record)
+    try:
+        asyncio.get_event_loop().run_until_complete(check_for_sweeps(
+            recorder=recorder, metrics_path=args.metrics, workers=args.workers,
+            output=args.output, output_policy=args.output_policy, state_path=args.state,
+            profile_path=args.profile,
+        ))
+    finally:
+        if recorder:
+            recorder.close()
@@ -1,100 +1,290 @@
 """Client to etherdelta.com socket API"""
-from decimal import Decimal
-from random import choice
+import asyncio
+import functools
+import json
+import random
+import re
 
-from ratelimiter import RateLimiter
 import websockets
 
+from cleansweep.book import OrderBooks
+from cleansweep.cache import SingleFlightCache
+from cleansweep.clients.lazyjson import LazyObject
+from cleansweep.clients.ratelimit import SlidingWindowLimiter
 from cleansweep.clients.socketio import SocketIOClient
 from cleansweep.constants import (
     logger,
+    EMPTY_MARKET_RETRY_SECONDS,
     ETHERDELTA_REQUESTS_PER_MINUTE,
+    ETHER_TOKEN_ADDRESS,
     ETHERDELTA_WS_URI,
     MARKET_EVENT_NAME,
-    MARKET_ORDERS_BUY_KEY,
     MARKET_ORDERS_KEY,
-    MARKET_ORDERS_SELL_KEY,
     MARKET_ORDERS_TOKEN_GET_KEY,
+    MARKET_ORDERS_TOKEN_GIVE_KEY,
     MARKET_TICKERS_KEY,
+    MAX_EMPTY_MARKET_RETRIES,
+    ORDERS_EVENT_NAME,
+    RESPONSE_CACHE_MAX_SIZE,
+    RESPONSE_CACHE_TTL_SECONDS,
+    TRADES_EVENT_NAME,
 )
-from cleansweep.records import EthOrder
+from cleansweep.metrics import metrics
 
-def safe_choice(seq):
-    """Choose a random element from a sequence or None if the sequence is empty"""
-    try:
-        return choice(seq)
-    except IndexError:
+# Find the first value of an order field in JSON text
+TOKEN_GET_PATTERN = re.compile(r'"{}"\s*:\s*"([^"]*)"'.format(MARKET_ORDERS_TOKEN_GET_KEY))
+TOKEN_GIVE_PATTERN = re.compile(r'"{}"\s*:\s*"([^"]*)"'.format(MARKET_ORDERS_TOKEN_GIVE_KEY))
+
+
+def market_token_address(text):
+    """Address of the token the text of a `getMarket` response is for, or None if it has no orders to tell by
+
+    Only the token addresses of the first order are read, without decoding the response.
+    Like `EthOrder.token_address`, that's whichever of them isn't ETH.
+    """
+    orders_start = text.find('"{}"'.format(MARKET_ORDERS_KEY))
+    if orders_start < 0:
         return None
+    token_get = TOKEN_GET_PATTERN.search(text, orders_start)
+    token_give = TOKEN_GIVE_PATTERN.search(text, orders_start)
+    if token_get is None or token_give is None:
+        return None
+    if token_get.group(1) == ETHER_TOKEN_ADDRESS:
+        return token_give.group(1)
+    return token_get.group(1)
+
+
+class EmptyResponseError(ValueError):
+    """The server kept answering `getMarket` without what was asked for"""
 
 
 class EtherDeltaClient(SocketIOClient):
     """Client to etherdelta.com socket API"""
     URI = ETHERDELTA_WS_URI
 
-    def __init__(self, *args, **kwargs):
-        """Initialize `EtherDeltaClient` with a rate limited send to respect API limit"""
+    def __init__(self, *args, rate_limiter=None, order_books=None, handles_pushed_events=True,
+                 response_cache=None, **kwargs):
+        """Initialize `EtherDeltaClient` with a rate limited send to respect API limit
+
+        Params:
+            `rate_limiter` - `SlidingWindowLimiter` shared with other connections, by default one
+                for just this connection
+            `order_books` - `OrderBooks` shared with other connections
+            `handles_pushed_events` - False to drop pushed events, e.g. when another
+                connection sharing `order_books` already handles them
+            `response_cache` - `SingleFlightCache` of `getMarket` responses shared with
+                other connections, by default one for just this connection
+        """
         super(EtherDeltaClient, self).__init__(*args, **kwargs)
         # Rate limit our `send` function to match ETHERDELTA requests
-        rl = RateLimiter(max_calls=ETHERDELTA_REQUESTS_PER_MINUTE, period=60)
-        self.send = rl(self.send)
+        self.rate_limiter = rate_limiter or SlidingWindowLimiter(ETHERDELTA_REQUESTS_PER_MINUTE, period=60)
+        # Books of tracked tokens, patched from the `orders` and `trades` events the server pushes
+        self.order_books = OrderBooks() if order_books is None else order_books
+        self.handles_pushed_events = handles_pushed_events
+        # Identical `getMarket` requests made at once, or within its TTL, share one response
+        if response_cache is None:
+            response_cache = SingleFlightCache(
+                RESPONSE_CACHE_MAX_SIZE, RESPONSE_CACHE_TTL_SECONDS, name='response_cache',
+            )
+        self.response_cache = response_cache
 
     @classmethod
-    def connect(cls, **kwargs):
+    def connect(cls, uri=None, rate_limiter=None, order_books=None, handles_pushed_events=True,
+                response_cache=None, **kwargs):
         """Equivalent to `websockets.connect`, with `uri` and client preconfigured for EtherDelta"""
         if 'create_protocol' in kwargs:
             raise ValueError('`create_protocol` is preset to {}'.format(cls))
 
-        return websockets.connect(cls.URI, create_protocol=cls, **kwargs)
+        create_protocol = functools.partial(
+            cls,
+            rate_limiter=rate_limiter,
+            order_books=order_books,
+            handles_pushed_events=handles_pushed_events,
+            response_cache=response_cache,
+        )
+        return websockets.connect(uri or cls.URI, create_protocol=create_protocol, **kwargs)
+
+    async def send(self, data, **event_params):
+        """Wait for the rate limiter, then send"""
+        await self.rate_limiter.acquire()
+        await super(EtherDeltaClient, self).send(data, **event_params)
 
     async def get_market(self, token_address=None, user_address=None):
-        """Call the `getMarket` API and return the response by polling the socket API"""
+        """Call the `getMarket` API and return the response by polling the socket API
+
+        Responses come from `response_cache` for `RESPONSE_CACHE_TTL_SECONDS`, and a
+        call made while an identical one is in flight waits for its response, on
+        whichever connection it was sent, rather than using up another request.
+        """
+        return await self.response_cache.get(
+            self._market_key(token_address, user_address),
+            functools.partial(self._request_market, token_address, user_address),
+        )
+
+    def invalidate_market(self, token_address=None, user_address=None):
+        """Make the next identical `get_market` call send a new request"""
+        self.response_cache.invalidate(self._market_key(token_address, user_address))
+
+    @staticmethod
+    def _market_key(token_address, user_address):
+        return ('getMarket', token_address, user_address)
+
+    async def _request_market(self, token_address, user_address):
+        """Send `getMarket` and return its response
+
+        `getMarket` responses don't say which request they answer.  When asking for a
+        token, responses whose orders are for a different token (e.g. to an earlier,
+        abandoned request) are skipped, and used to re-seed that token's book if it's tracked.
+
+        Empty responses are retried up to `MAX_EMPTY_MARKET_RETRIES` times, after a
+        jittered, doubling delay so a storm of them doesn't use up the rate limit.
+        Then `EmptyResponseError` is raised.
+        """
         kwargs = {}
         if token_address is not None:
             kwargs['token'] = token_address
         if user_address is not None:
             kwargs['user_address'] = user_address
 
-        await self.send('getMarket', **kwargs)
+        with metrics.time('get_market_seconds'):
+            for retry in range(MAX_EMPTY_MARKET_RETRIES + 1):
+                if retry:
+                    logger.debug('Retrying on empty "{}" event response'.format(MARKET_EVENT_NAME))
+                    metrics.counter('empty_market_retries', 'Empty getMarket responses retried').inc()
+                    await asyncio.sleep(random.uniform(0, EMPTY_MARKET_RETRY_SECONDS * 2 ** (retry - 1)))
+
+                await self.send('getMarket', **kwargs)
+                market = await self._recv_market(token_address)
+                if market:
+                    return market
+
+        raise EmptyResponseError('{} empty "{}" event responses in a row'.format(
+            MAX_EMPTY_MARKET_RETRIES + 1, MARKET_EVENT_NAME,
+        ))
 
+    async def _recv_market(self, token_address):
+        """Return the next `getMarket` response for `token_address`, which may be empty"""
         while True:
-            event, market = await self.recv(json_loads_kwargs={'parse_float': Decimal})
-            market_is_empty = not market
+            event, arguments = await self.recv_frame()
             if event != MARKET_EVENT_NAME:
-                logger.debug('Skipping non-market event response "{}"'.format(event))
+                self.handle_frame(event, arguments)
                 continue
 
+            # `returnTicker` and `orders` are only decoded when they're read
+            market = LazyObject(arguments, parse_float=str) if arguments else {}
             if not market:
-                logger.debug('Retrying on empty "{}" event response'.format(MARKET_EVENT_NAME))
-                return await self.get_market(token_address=token_address, user_address=user_address)
+                return market
+
+            response_token_address = token_address and market_token_address(arguments)
+            if response_token_address and response_token_address != token_address:
+                logger.debug('Skipping "{}" response for token {} while waiting for {}'.format(
+                    MARKET_EVENT_NAME, response_token_address, token_address,
+                ))
+                metrics.counter('token_mismatches', 'getMarket responses for a different token').inc()
+                if response_token_address in self.order_books:
+                    self.order_books.seed(response_token_address, market[MARKET_ORDERS_KEY])
+                continue
 
             return market
 
+    def handle_frame(self, event, arguments):
+        """Decode and route a pushed event, if anything is interested in it
+
+        Pushed orders and trades are only useful once a book is tracked, and other
+        events aren't used at all, so those are dropped without decoding them.
+        """
+        is_wanted = (
+            event in (ORDERS_EVENT_NAME, TRADES_EVENT_NAME) and
+            self.handles_pushed_events and
+            self.order_books and
+            arguments
+        )
+        if is_wanted:
+            with metrics.time('json_decode_seconds'):
+                payload = json.loads(arguments, parse_float=str)
+            self.handle_event(event, payload)
+        else:
+            logger.debug('Skipping non-market event response "{}"'.format(event))
+            metrics.counter('frames_dropped', 'Frames dropped without decoding').inc()
+
+    def handle_event(self, event, payload):
+        """Route a decoded event pushed by the server (i.e. not a `getMarket` response)"""
+        if event == ORDERS_EVENT_NAME:
+            books = self.order_books.on_orders(payload)
+        elif event == TRADES_EVENT_NAME:
+            books = self.order_books.on_trades(payload)
+        else:
+            logger.debug('Skipping non-market event response "{}"'.format(event))
+            return
+        # Cached responses for these books no longer match them
+        for book in books:
+            self.invalidate_market(book.token_address)
+
+    async def listen(self, timeout):
+        """Handle pushed events for `timeout` seconds, without sending any requests"""
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                event, arguments = await asyncio.wait_for(self.recv_frame(), remaining)
+            except asyncio.TimeoutError:
+                return
+
+            if event == MARKET_EVENT_NAME:
+                logger.debug('Skipping unrequested "{}" event response'.format(MARKET_EVENT_NAME))
+                metrics.counter('frames_dropped', 'Frames dropped without decoding').inc()
+                continue
+            self.handle_frame(event, arguments)
+
+    async def get_order_book(self, token_address, refresh=False):
+        """Return the local `OrderBook` for `token_address`
+
+        The book is only fetched with `getMarket` when it isn't tracked yet, a pushed
+        trade has made it stale, or `refresh` is True.  Otherwise it is kept current
+        by pushed events.
+        """
+        book = self.order_books.get(token_address)
+        if book is not None and book.stale:
+            # A cached response may be from before whatever made it stale
+            self.invalidate_market(token_address)
+        if book is None or book.stale or refresh:
+            token_orders = await self.get_orders_for_token(token_address=token_address)
+            book = self.order_books.seed(token_address, token_orders)
+        return book
+
     async def get_orders_for_token(self, token_address):
         """Get open orders for the token at `token_addres`
 
-        Returns the `MARKET_ORDERS_KEY` value of the `getMarket` API response.
+        Returns the `MARKET_ORDERS_KEY` value of the `getMarket` API response.  Like
+        empty responses, responses without orders are retried up to `MAX_EMPTY_MARKET_RETRIES` times.
         """
-        market = {}
-        while MARKET_ORDERS_KEY not in market:
-            market = await self.get_market(token_address=token_address)
+        market = await self._get_market_with_orders(token_address, lambda market: MARKET_ORDERS_KEY in market)
+        return market[MARKET_ORDERS_KEY]
 
-        token_orders = market[MARKET_ORDERS_KEY]
-        sample_api_order = safe_choice(
-            token_orders[MARKET_ORDERS_BUY_KEY] + token_orders[MARKET_ORDERS_SELL_KEY]
-        )
-        sample_order = sample_api_order and EthOrder.from_api_order(sample_api_order)
-        token_mismatch = (
-            sample_order and
-            sample_order.token_address != token_address
-        )
-        if token_mismatch:
-            raise ValueError(
-                'Received response for different token. Expected {}, Actual {}'.format(
-                    token_address,
-                    sample_order.token_address,
-                )
-            )
-        return token_orders
+    async def get_market_text(self, token_address):
+        """Like `get_orders_for_token`, but return the text of the whole `getMarket` response, undecoded
+
+        For handing the response to another process (see `cleansweep.sharding`), so
+        that only it decodes the orders.  Responses whose text doesn't mention
+        `MARKET_ORDERS_KEY` are retried.
+        """
+        market = await self._get_market_with_orders(token_address, lambda market: market.mentions(MARKET_ORDERS_KEY))
+        return market.text
+
+    async def _get_market_with_orders(self, token_address, has_orders):
+        with metrics.time('get_orders_for_token_seconds'):
+            for _ in range(MAX_EMPTY_MARKET_RETRIES + 1):
+                market = await self.get_market(token_address=token_address)
+                if has_orders(market):
+                    return market
+                self.invalidate_market(token_address)
+
+        raise EmptyResponseError('{} "{}" event responses without orders for {}'.format(
+            MAX_EMPTY_MARKET_RETRIES + 1, MARKET_EVENT_NAME, token_address,
+        ))
 
     async def get_token_summaries(self):
         """Retreive a mapping of tokens to a summary of order activity on EtherDelta.
@@ -0,0 +1,92 @@
+"""JSON objects whose members are only decoded when they are read"""
+from collections.abc import Mapping
+import json
+from json.decoder import (
+    WHITESPACE,
+    scanstring,
+)
+
+
+class LazyObject(Mapping):
+    """A read-only mapping over the text of a JSON object, decoding members on first access
+
+    Top level members are decoded in order, up to and including the one asked for,
+    and cached.  Members after it are never decoded if they're never read, so e.g.
+    a consumer that only reads `returnTicker` doesn't pay to decode the `orders`
+    that follow it.  Asking for a key that doesn't appear anywhere in the text
+    decodes nothing at all.
+    """
+    def __init__(self, text, parse_float=None):
+        self._text = text
+        self._decoder = json.JSONDecoder(parse_float=parse_float)
+        self._members = {}
+        # Where the next undecoded member starts, or None once every member is decoded
+        self._index = self._skip_whitespace(self._expect('{', self._skip_whitespace(0)))
+        if self._text.startswith('}', self._index):
+            self._index = None
+
+    def _skip_whitespace(self, index):
+        return WHITESPACE.match(self._text, index).end()
+
+    def _expect(self, char, index):
+        if not self._text.startswith(char, index):
+            raise json.JSONDecodeError('Expecting {!r}'.format(char), self._text, index)
+        return index + 1
+
+    def _decode_next(self):
+        """Decode the next member into `_members` and return its key"""
+        text, index = self._text, self._index
+        key, index = scanstring(text, self._expect('"', index))
+        index = self._skip_whitespace(self._expect(':', self._skip_whitespace(index)))
+        value, index = self._decoder.raw_decode(text, index)
+        self._members[key] = value
+
+        index = self._skip_whitespace(index)
+        if text.startswith('}', index):
+            self._index = None
+        else:
+            self._index = self._skip_whitespace(self._expect(',', index))
+        return key
+
+    def _decode_until(self, key):
+        while key not in self._members and self._index is not None:
+            self._decode_next()
+
+    @property
+    def text(self):
+        """The JSON text of the whole object"""
+        return self._text
+
+    def mentions(self, key):
+        """True if `key` appears as a string anywhere in the text, without decoding anything
+
+        Every member does, so False means `key` isn't one.  True doesn't mean it is,
+        since it may be e.g. a value or a key of a nested object.
+        """
+        return key in self._members or '"{}"'.format(key) in self._text
+
+    def __getitem__(self, key):
+        if key not in self._members and self.mentions(key):
+            self._decode_until(key)
+        return self._members[key]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        self._decode_until(None)
+        return iter(self._members)
+
+    def __len__(self):
+        self._decode_until(None)
+        return len(self._members)
+
+    def __bool__(self):
+        return bool(self._members) or self._index is not None
+
+    def __repr__(self):
+        return '{}({!r}...)'.format(type(self).__name__, self._text[:60])
@@ -0,0 +1,126 @@
+"""Several EtherDelta connections, used concurrently within one rate limit"""
+import asyncio
+
+from cleansweep.book import OrderBooks
+from cleansweep.cache import SingleFlightCache
+from cleansweep.clients.etherdelta import EtherDeltaClient
+from cleansweep.clients.ratelimit import SlidingWindowLimiter
+from cleansweep.constants import (
+    logger,
+    ETHERDELTA_REQUESTS_PER_MINUTE,
+    PING_INTERVAL_SECONDS,
+    PING_TIMEOUT_SECONDS,
+    RESPONSE_CACHE_MAX_SIZE,
+    RESPONSE_CACHE_TTL_SECONDS,
+)
+
+
+class EtherDeltaClientPool:
+    """A pool of `EtherDeltaClient` connections sharing one `SlidingWindowLimiter` and one `OrderBooks`
+
+    Each request is made on whichever connection is idle, so several tokens can be
+    fetched at once, e.g. with `asyncio.gather`.  Every connection waits on the same
+    limiter, so together they stay within `ETHERDELTA_REQUESTS_PER_MINUTE`, and scanning
+    is bound by that rather than by round trips.  Only the first connection handles
+    pushed events, since every connection is sent the same ones.
+
+    Every connection also shares a `SingleFlightCache` of `getMarket` responses, kept
+    for `response_ttl` seconds, so identical requests made at once on different
+    connections only use up one request.
+
+    Every connection runs `keepalive` every `ping_interval` seconds (unless it's None),
+    and is failed if a pong takes longer than `ping_timeout`.
+
+    Use it like `EtherDeltaClient.connect`:
+
+        async with EtherDeltaClientPool.connect(size=3) as pool:
+            book = await pool.get_order_book(token_address)
+    """
+    def __init__(self, size, rate_limiter=None, order_books=None, recorder=None,
+                 ping_interval=PING_INTERVAL_SECONDS, ping_timeout=PING_TIMEOUT_SECONDS,
+                 response_ttl=RESPONSE_CACHE_TTL_SECONDS, **connect_kwargs):
+        self.size = size
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        # Set as every connection's `recorder`, to capture the frames they receive
+        self.recorder = recorder
+        self.rate_limiter = rate_limiter or SlidingWindowLimiter(ETHERDELTA_REQUESTS_PER_MINUTE, period=60)
+        self.order_books = OrderBooks() if order_books is None else order_books
+        self.response_cache = SingleFlightCache(RESPONSE_CACHE_MAX_SIZE, response_ttl, name='response_cache')
+        self.clients = []
+        self._connect_kwargs = connect_kwargs
+        self._idle = None
+        self._keepalives = []
+
+    @classmethod
+    def connect(cls, size, **kwargs):
+        """Return a pool that opens `size` connections when entered with `async with`"""
+        return cls(size, **kwargs)
+
+    async def __aenter__(self):
+        self._idle = asyncio.Queue()
+        try:
+            for i in range(self.size):
+                client = await EtherDeltaClient.connect(
+                    rate_limiter=self.rate_limiter,
+                    order_books=self.order_books,
+                    handles_pushed_events=(i == 0),
+                    response_cache=self.response_cache,
+                    **self._connect_kwargs
+                )
+                client.recorder = self.recorder
+                if self.ping_interval is not None:
+                    self._keepalives.append(
+                        asyncio.ensure_future(client.keepalive(self.ping_interval, self.ping_timeout))
+                    )
+                self.clients.append(client)
+                self._idle.put_nowait(client)
+        except BaseException:
+            # Don't leave the connections that did open behind
+            await self.__aexit__(None, None, None)
+            raise
+        logger.debug('Opened {} EtherDelta connections'.format(len(self.clients)))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        for keepalive in self._keepalives:
+            keepalive.cancel()
+        await asyncio.gather(*(client.close() for client in self.clients))
+        self.clients = []
+        self._keepalives = []
+
+    async def _with_client(self, method_name, *args, **kwargs):
+        """Call `method_name` on the next idle connection"""
+        client = await self._idle.get()
+        try:
+            return await getattr(client, method_name)(*args, **kwargs)
+        finally:
+            self._idle.put_nowait(client)
+
+    async def get_market(self, token_address=None, user_address=None):
+        return await self._with_client('get_market', token_address=token_address, user_address=user_address)
+
+    async def get_orders_for_token(self, token_address):
+        return await self._with_client('get_orders_for_token', token_address=token_address)
+
+    async def get_market_text(self, token_address):
+        return await self._with_client('get_market_text', token_address=token_address)
+
+    async def get_order_book(self, token_address, refresh=False):
+        return await self._with_client('get_order_book', token_address=token_address, refresh=refresh)
+
+    async def get_token_summaries(self):
+        return await self._with_client('get_token_summaries')
+
+    def invalidate_market(self, token_address=None, user_address=None):
+        """Make the next identical `get_market` call, on any connection, send a new request"""
+        self.response_cache.invalidate(EtherDeltaClient._market_key(token_address, user_address))
+
+    async def listen(self, timeout):
+        """Handle pushed events on every connection for `timeout` seconds"""
+        clients = [self._idle.get_nowait() for _ in range(self._idle.qsize())]
+        try:
+            await asyncio.gather(*(client.listen(timeout) for client in clients))
+        finally:
+            for client in clients:
+                self._idle.put_nowait(client)
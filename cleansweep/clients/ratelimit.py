@@ -0,0 +1,67 @@
+"""Rate limiting for requests to the EtherDelta API"""
+import asyncio
+from collections import deque
+import time
+
+from cleansweep.metrics import metrics
+
+
+class SlidingWindowLimiter:
+    """Allow at most `rate` requests in any `period` seconds
+
+    The times of the last `rate` requests are kept, and a request waits until the
+    oldest of them is `period` seconds old, so no window of `period` seconds ever
+    holds more than `rate` requests (unlike a token bucket, whose full bucket plus
+    its refill allows nearly twice `rate` in the first period).
+
+    `acquire` waits asynchronously, without blocking the event loop, and waiters are
+    served in the order they arrived.  A single limiter can be shared by several
+    connections so that together they stay within the API's limit.  `waits` and
+    `wait_seconds` count how often and how long callers were held back.
+    """
+    def __init__(self, rate, period=60, clock=time.monotonic):
+        self.rate = rate
+        self.period = period
+        self._clock = clock
+        # Times of the requests made in the last `period` seconds, oldest first
+        self._sent = deque()
+        self._lock = None
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def _expire(self):
+        window_start = self._clock() - self.period
+        while self._sent and self._sent[0] <= window_start:
+            self._sent.popleft()
+
+    @property
+    def available(self):
+        """How many requests could be made right now without waiting"""
+        self._expire()
+        return self.rate - len(self._sent)
+
+    def try_acquire(self):
+        """Make a request if one is allowed, without waiting.  Returns True if it was"""
+        self._expire()
+        if len(self._sent) >= self.rate:
+            return False
+        self._sent.append(self._clock())
+        return True
+
+    async def acquire(self):
+        """Wait until a request is allowed, then count it"""
+        # Created lazily, so the limiter can be made outside of a running loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            self._expire()
+            while len(self._sent) >= self.rate:
+                delay = self._sent[0] + self.period - self._clock()
+                self.waits += 1
+                self.wait_seconds += delay
+                metrics.counter('rate_limit_waits', 'Requests held back by the rate limiter').inc()
+                metrics.histogram('rate_limit_wait_seconds').observe(delay)
+                await asyncio.sleep(delay)
+                self._expire()
+            self._sent.append(self._clock())
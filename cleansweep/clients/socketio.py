@@ -1,9 +1,13 @@
 """`websockets` and `socket.io` compatibility layer"""
 import asyncio
 import json
+import time
 
 import websockets
 
+from cleansweep.constants import logger
+from cleansweep.metrics import metrics
+
 
 class SocketIOClient(websockets.WebSocketClientProtocol):
     """WebSocketsClientProtocol implementation that automatically encodes/decodes for socket.io.
@@ -15,21 +19,39 @@ class SocketIOClient(websockets.WebSocketClientProtocol):
     The implementation is backwards compatible. `send` automatically implements json encoding
     and the constant prefixing, and `recv` automatically json decodes and strips the prefix.
     Interfaces are compatible with `WebSocketsClientProtocol`.
+
+    If `recorder` is set (e.g. to a `cleansweep.recording.FrameRecorder`), every raw
+    message received is passed to its `record` method.
     """
     SOCKET_IO_CONSTANT = '42'
+    recorder = None
 
-    async def keepalive(self, ping_interval=3):
+    async def keepalive(self, ping_interval=3, ping_timeout=None):
         """Periodically ping the server to prevent the connection from timing out.
 
         Params:
             `ping_interval`: number of seconds between each ping.
+            `ping_timeout`: seconds to wait for each pong, or None to not wait for them
 
         SocketIO kills client connections after a pre-configured timeout.  Pings by
         default occur every 3 seconds.  The snippet itself is copied from
         http://websockets.readthedocs.io/en/stable/cheatsheet.html#keeping-connections-open
+
+        If a pong takes longer than `ping_timeout`, the connection has stalled, and
+        is failed so that anything waiting on it raises `ConnectionClosed`.
         """
         while True:
-            await self.ping()
+            pong_waiter = await self.ping()
+            if ping_timeout is not None:
+                start = time.perf_counter()
+                try:
+                    await asyncio.wait_for(pong_waiter, ping_timeout)
+                except asyncio.TimeoutError:
+                    logger.warning('No pong in {} seconds, failing stalled connection'.format(ping_timeout))
+                    metrics.counter('stalls', 'Connections failed for not answering a ping').inc()
+                    self.fail_connection()
+                    return
+                metrics.histogram('ping_seconds').observe(time.perf_counter() - start)
             await asyncio.sleep(ping_interval)
 
     @asyncio.coroutine
@@ -43,14 +65,55 @@ class SocketIOClient(websockets.WebSocketClientProtocol):
             constant=self.SOCKET_IO_CONSTANT,
             payload=json.dumps(socket_io_payload),
         )
-        yield from super(SocketIOClient, self).send(data=socket_io_data)
+        with metrics.time('socket_send_seconds'):
+            yield from super(SocketIOClient, self).send(socket_io_data)
+
+    @asyncio.coroutine
+    def recv_frame(self):
+        """Return the event name and the undecoded JSON arguments of the next socket.io message
+
+        The event name is read from the start of the message, so callers can route or
+        drop a message without decoding it.  The arguments are '' if there are none.
+        """
+        message = yield from self._recv_socket_io_message()
+        return split_frame(message[len(self.SOCKET_IO_CONSTANT):])
 
     @asyncio.coroutine
     def recv(self, json_loads_kwargs=None):
         """Automatically strip the SOCKET_IO_CONSTANT and parse returned message to a python object"""
+        message = yield from self._recv_socket_io_message()
+        socket_io_message = message[len(self.SOCKET_IO_CONSTANT):]
+        return json.loads(socket_io_message, **(json_loads_kwargs or {}))
+
+    @asyncio.coroutine
+    def _recv_socket_io_message(self):
+        """Return the next message prefixed with SOCKET_IO_CONSTANT, recording every message
+
+        The time observed includes waiting for the server to send something.
+        """
         message = ''
-        while self.SOCKET_IO_CONSTANT not in message:
-            message = yield from super(SocketIOClient, self).recv()
+        with metrics.time('socket_recv_seconds'):
+            while not message.startswith(self.SOCKET_IO_CONSTANT):
+                message = yield from super(SocketIOClient, self).recv()
+                if self.recorder is not None:
+                    self.recorder.record(message)
+        return message
 
-        socket_io_message = message[len(self.SOCKET_IO_CONSTANT):]
-        return json.loads(socket_io_message, **json_loads_kwargs)
+
+def split_frame(socket_io_message):
+    """Split a socket.io message (e.g. '["market",{...}]') into its event name and raw arguments
+
+    Event names are plain strings, so the name ends at the next quote.
+    """
+    if not socket_io_message.startswith('["'):
+        raise ValueError('Expected a socket.io event: {}'.format(socket_io_message[:60]))
+
+    name_end = socket_io_message.index('"', 2)
+    event = socket_io_message[2:name_end]
+    arguments = socket_io_message[name_end + 1:].strip()
+    # Strip the separating comma and the closing bracket
+    if arguments.startswith(','):
+        arguments = arguments[1:-1].strip()
+    else:
+        arguments = ''
+    return event, arguments
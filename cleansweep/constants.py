@@ -13,15 +13,84 @@ SELL_GAS = 2885709
 GAS_PRICE = Decimal('.000000001')
 SWEEP_TXN_FEE_ETHER = (BUY_GAS + SELL_GAS) * GAS_PRICE
 
+# Sweep math is done on integers rather than Decimals.  ETH amounts are in wei, prices
+# are wei per whole token, and token amounts are in units of 10^-TOKEN_DECIMALS tokens
+WEI_DECIMALS = 18
+WEI_PER_ETHER = 10 ** WEI_DECIMALS
+PRICE_DECIMALS = WEI_DECIMALS
+TOKEN_DECIMALS = 18
+TOKEN_PRECISION = 10 ** TOKEN_DECIMALS
+GAS_PRICE_WEI = int(GAS_PRICE * WEI_PER_ETHER)
+SWEEP_TXN_FEE_WEI = (BUY_GAS + SELL_GAS) * GAS_PRICE_WEI
+
 # Max order book update time seen : 5 minutes
 
+# How many reported sweeps to remember, and for how long, so they're only reported once
+SEEN_SWEEPS_MAX_SIZE = 10000
+SEEN_SWEEPS_TTL_SECONDS = 60 * 60
+# How many parsed orders to keep, and for how long, so unchanged orders aren't parsed again
+ORDER_CACHE_MAX_SIZE = 100000
+ORDER_CACHE_TTL_SECONDS = 10 * 60
+
 ETHER_TOKEN_ADDRESS = '0x0000000000000000000000000000000000000000'
 
 # From https://www.reddit.com/r/EtherDelta/comments/6hrvwl/how_fees_work/
 # .3% of the ETH in the sale goes to EtherDelta
 ETHERDELTA_FEE_PROPORTION = Decimal('.003')
+ETHERDELTA_FEE_NUMERATOR, ETHERDELTA_FEE_DENOMINATOR = ETHERDELTA_FEE_PROPORTION.as_integer_ratio()
 # From https://github.com/etherdelta/etherdelta.github.io/blob/master/docs/API.md#user-content-rate-limit
 ETHERDELTA_REQUESTS_PER_MINUTE = 12
+# How many connections to fetch order books over at once. They share the requests above
+ETHERDELTA_CONNECTIONS = 3
+# How often to fetch the whole market, to find new candidate tokens
+MARKET_REFRESH_SECONDS = 30
+# Bounds on how often a candidate token's order book is fetched again
+MIN_TOKEN_REFRESH_SECONDS = 10
+MAX_TOKEN_REFRESH_SECONDS = 5 * 60
+# How long a token's sweeps are reused, and its book not fetched again, while its bid and ask don't change
+SWEEP_RESULT_TTL_SECONDS = 2 * MARKET_REFRESH_SECONDS
+# Retries of an empty `getMarket` response, and the delay before the first (which doubles each time)
+MAX_EMPTY_MARKET_RETRIES = 5
+EMPTY_MARKET_RETRY_SECONDS = .1
+# How long `getMarket` responses are reused for identical requests, and how many are kept
+RESPONSE_CACHE_TTL_SECONDS = 2
+RESPONSE_CACHE_MAX_SIZE = 1000
+# How often connections are pinged, and how long a pong can take before the connection is stalled
+PING_INTERVAL_SECONDS = 3
+PING_TIMEOUT_SECONDS = 10
+# Bounds of the jittered, doubling delay before reconnecting a dropped or stalled session
+MIN_RECONNECT_SECONDS = 1
+MAX_RECONNECT_SECONDS = 60
+# How often the warm start file given with `cleansweep --state` is written to, and the
+# oldest saved market or book used on startup
+WARM_START_FLUSH_SECONDS = 10
+WARM_START_MAX_AGE_SECONDS = MAX_TOKEN_REFRESH_SECONDS
+# How often frames captured with `cleansweep --record` are compressed and written
+RECORDING_FLUSH_SECONDS = 1
+# Rewrite the warm start file once it's this many times the size of its latest records
+WARM_START_COMPACT_RATIO = 4
+# Most profitable sweeps in each book sent back by a `cleansweep --workers` process.  Only
+# one is reported, but the next ones stand in for it if it already was
+SHARDED_TOP_SWEEPS = 10
+# Most sweep records queued for output, and most written at once
+SINK_QUEUE_SIZE = 1000
+SINK_BATCH_SIZE = 100
+# With the blocking output policy, most records queued past `SINK_QUEUE_SIZE` between drains
+SINK_BLOCK_OVERFLOW = SINK_QUEUE_SIZE
+# How often to write metrics to the file given with `cleansweep --metrics`
+METRICS_WRITE_SECONDS = 15
+# Prefix of every exported metric name
+METRICS_PREFIX = 'cleansweep_'
+# Upper bounds in seconds of the latency histogram buckets, from 100us to 30s
+METRICS_LATENCY_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+# With `cleansweep --profile`, how often the stack is sampled, how often allocations are
+# snapshotted, how many allocation sites are reported per snapshot, how many frames each
+# traced allocation keeps, and how often the collapsed stacks are written
+PROFILE_SAMPLE_SECONDS = .005
+PROFILE_SNAPSHOT_SECONDS = 60
+PROFILE_TOP_ALLOCATIONS = 10
+PROFILE_TRACEBACK_FRAMES = 16
+PROFILE_WRITE_SECONDS = 15
 ETHERDELTA_WS_URI = 'wss://socket.etherdelta.com/socket.io/?transport=websocket'
 
 # string of the 'getMarket' event response
@@ -30,7 +99,14 @@ MARKET_ORDERS_BUY_KEY = 'buys'
 MARKET_ORDERS_KEY = 'orders'
 MARKET_ORDERS_SELL_KEY = 'sells'
 MARKET_ORDERS_TOKEN_GET_KEY = 'tokenGet'
-MARKET_TICKERS_KEY = 'returnTickers'
+MARKET_ORDERS_TOKEN_GIVE_KEY = 'tokenGive'
+MARKET_TICKERS_KEY = 'returnTicker'
+# strings of the events the server pushes when orders change or trades happen
+ORDERS_EVENT_NAME = 'orders'
+ORDER_DELETED_KEY = 'deleted'
+TRADES_EVENT_NAME = 'trades'
+TRADE_TOKEN_ADDRESS_KEY = 'tokenAddr'
 
 # My maximum desired exposure (risk) in ETHER (~$400)
 MAX_EXPOSURE_ETHER = Decimal('.5')
+MAX_EXPOSURE_WEI = int(MAX_EXPOSURE_ETHER * WEI_PER_ETHER)
@@ -0,0 +1,157 @@
+"""Counters and fixed-bucket latency histograms for each stage of a scan
+
+Stages are timed with the shared `metrics` registry:
+
+    with metrics.time('get_market_seconds'):
+        ...
+    metrics.counter('frames_dropped').inc()
+
+`MetricsRegistry.to_prometheus_text` renders everything in the Prometheus text
+format (e.g. for the node exporter's textfile collector), and `summary_line`
+summarises what happened since it was last called, e.g. once per scan cycle.
+"""
+import bisect
+import os
+import time
+
+from cleansweep.constants import (
+    METRICS_LATENCY_BUCKETS,
+    METRICS_PREFIX,
+)
+
+
+class Counter:
+    """A count that only goes up"""
+    __slots__ = ('name', 'help', 'value')
+
+    def __init__(self, name, help=''):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    """Counts of observed values in fixed buckets, with their sum
+
+    `buckets` are the sorted upper bounds of each bucket.  Values above the last
+    bound only count towards the implicit `+Inf` bucket.
+    """
+    __slots__ = ('name', 'help', 'buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, name, help='', buckets=METRICS_LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # Counts per bucket, not cumulative, with the last for values above every bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class _Timer:
+    """Context manager that observes the seconds spent in it on a `Histogram`"""
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class MetricsRegistry:
+    """The counters and histograms of one process, created the first time they're used"""
+    def __init__(self, prefix=METRICS_PREFIX):
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        # Counts and sums as of the last `summary_line`
+        self._last_summary = {}
+
+    def counter(self, name, help=''):
+        counter = self.counters.get(name)
+        if counter is None:
+            counter = self.counters[name] = Counter(name, help)
+        return counter
+
+    def histogram(self, name, help='', buckets=METRICS_LATENCY_BUCKETS):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(name, help, buckets)
+        return histogram
+
+    def time(self, name):
+        """Return a context manager that observes how long its block takes on histogram `name`"""
+        return _Timer(self.histogram(name))
+
+    def clear(self):
+        self.counters.clear()
+        self.histograms.clear()
+        self._last_summary.clear()
+
+    def to_prometheus_text(self):
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        for name, counter in sorted(self.counters.items()):
+            full_name = '{}{}_total'.format(self.prefix, name)
+            if counter.help:
+                lines.append('# HELP {} {}'.format(full_name, counter.help))
+            lines.append('# TYPE {} counter'.format(full_name))
+            lines.append('{} {}'.format(full_name, counter.value))
+        for name, histogram in sorted(self.histograms.items()):
+            full_name = self.prefix + name
+            if histogram.help:
+                lines.append('# HELP {} {}'.format(full_name, histogram.help))
+            lines.append('# TYPE {} histogram'.format(full_name))
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append('{}_bucket{{le="{}"}} {}'.format(full_name, bound, cumulative))
+            lines.append('{}_bucket{{le="+Inf"}} {}'.format(full_name, histogram.count))
+            lines.append('{}_sum {}'.format(full_name, histogram.sum))
+            lines.append('{}_count {}'.format(full_name, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Write `to_prometheus_text` to `path`, replacing it at once so readers never see half a file"""
+        temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporary_path, 'w') as metrics_file:
+            metrics_file.write(self.to_prometheus_text())
+        os.replace(temporary_path, path)
+
+    def summary_line(self):
+        """One line of the count and mean milliseconds of each stage, and of each counter, since the last call
+
+        Stages and counters that didn't change are left out.
+        """
+        parts = []
+        for name, histogram in sorted(self.histograms.items()):
+            last_count, last_sum = self._last_summary.get(name, (0, 0.0))
+            count = histogram.count - last_count
+            if count:
+                mean_ms = (histogram.sum - last_sum) / count * 1000
+                parts.append('{}={}x{:.2f}ms'.format(name, count, mean_ms))
+            self._last_summary[name] = (histogram.count, histogram.sum)
+        for name, counter in sorted(self.counters.items()):
+            key = ('counter', name)
+            count = counter.value - self._last_summary.get(key, 0)
+            if count:
+                parts.append('{}={}'.format(name, count))
+            self._last_summary[key] = counter.value
+        return ' '.join(parts)
+
+
+# The registry every stage of the scan reports to
+metrics = MetricsRegistry()
@@ -0,0 +1,186 @@
+"""Profile a live scan: where its time goes, from stack samples, and what its code allocates
+
+`Profiler` samples the stack of the thread running the event loop from another
+thread every `PROFILE_SAMPLE_SECONDS`, and keeps a count of each distinct stack.
+A loop waiting on its sockets is sampled inside `select`, so socket waits show
+up next to JSON decoding, `Decimal` and attrs construction.  The counts are
+written in the collapsed format flamegraph tools read, one stack per line:
+
+    base_events.py:run_forever;...;records.py:from_api_order 42
+
+`tracemalloc` traces allocations too.  At the end of the first cycle after every
+`PROFILE_SNAPSHOT_SECONDS`, the memory still allocated is attributed to the
+innermost frame in `records.py` or `clients/` that allocated it (or called what
+did), and the `PROFILE_TOP_ALLOCATIONS` sites that grew most since the last
+snapshot are logged and appended as a JSON line.
+
+Only the process running the loop is profiled, not `--workers` processes.
+"""
+import collections
+import fnmatch
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import attr
+
+from cleansweep.constants import (
+    logger,
+    PROFILE_SAMPLE_SECONDS,
+    PROFILE_SNAPSHOT_SECONDS,
+    PROFILE_TOP_ALLOCATIONS,
+    PROFILE_TRACEBACK_FRAMES,
+    PROFILE_WRITE_SECONDS,
+)
+
+# Allocations are attributed to frames in files matching these
+ALLOCATION_PATTERNS = ('*/cleansweep/records.py', '*/cleansweep/clients/*')
+
+
+def collapse_stack(frame):
+    """`frame`'s stack in the collapsed format, from the outermost call to `frame`"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+@attr.s(frozen=True, slots=True)
+class AllocationSite:
+    """Memory allocated from one line, and still allocated, when a snapshot was taken"""
+    # "<file>:<line>"
+    site = attr.ib()
+    size = attr.ib()
+    count = attr.ib()
+    # Change in `size` since the previous snapshot
+    size_diff = attr.ib()
+
+
+def allocation_sites(snapshot, patterns=ALLOCATION_PATTERNS):
+    """Return `{site: (size, count)}` of the traces in `snapshot`
+
+    Each trace counts towards its innermost frame in a file matching `patterns`.
+    Traces with no such frame are left out.
+    """
+    # Most traces share a traceback with many others, so each distinct one is only
+    # looked at once, and each file is only matched against `patterns` once
+    is_matched = {}
+    sites = collections.defaultdict(lambda: [0, 0])
+    for statistic in snapshot.statistics('traceback'):
+        # Frames go from the oldest call to the most recent
+        for frame in reversed(statistic.traceback):
+            filename = frame.filename
+            if filename not in is_matched:
+                is_matched[filename] = any(fnmatch.fnmatch(filename, pattern) for pattern in patterns)
+            if is_matched[filename]:
+                totals = sites['{}:{}'.format(os.path.basename(filename), frame.lineno)]
+                totals[0] += statistic.size
+                totals[1] += statistic.count
+                break
+    return {site: tuple(totals) for site, totals in sites.items()}
+
+
+class Profiler:
+    """Samples the stacks of the thread that starts it, and traces its allocations
+
+    `start` it (or use it with `with`), and call `end_cycle` once per scan cycle.
+    Results are in `<path>.collapsed`, rewritten every `PROFILE_WRITE_SECONDS` and
+    on stopping, and `<path>.allocations.jsonl`, appended to every `snapshot_interval`.
+    """
+    def __init__(self, path, interval=PROFILE_SAMPLE_SECONDS, top=PROFILE_TOP_ALLOCATIONS,
+                 frames=PROFILE_TRACEBACK_FRAMES, snapshot_interval=PROFILE_SNAPSHOT_SECONDS,
+                 clock=time.monotonic):
+        self.collapsed_path = path + '.collapsed'
+        self.allocations_path = path + '.allocations.jsonl'
+        self.interval = interval
+        self.snapshot_interval = snapshot_interval
+        self.top = top
+        self.frames = frames
+        self.stacks = collections.Counter()
+        self.cycles = 0
+        self._clock = clock
+        self._thread_id = None
+        self._sampler = None
+        self._stopped = threading.Event()
+        self._sites = {}
+        self._written = None
+        self._snapshotted = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """Start sampling the calling thread, and tracing allocations"""
+        self._thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._sampler = threading.Thread(target=self._sample_forever, name='cleansweep-profiler', daemon=True)
+        self._sampler.start()
+        tracemalloc.start(self.frames)
+        self._written = self._snapshotted = self._clock()
+
+    def stop(self):
+        """Stop sampling and tracing, and write the collapsed stacks"""
+        self._stopped.set()
+        self._sampler.join()
+        tracemalloc.stop()
+        self.write_collapsed()
+
+    def _sample_forever(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self.stacks[collapse_stack(frame)] += 1
+
+    def end_cycle(self):
+        """Count a cycle, and if a snapshot is due, log and record the allocation sites that grew most
+
+        Returns those sites, or None if no snapshot was due.
+        """
+        self.cycles += 1
+        if self._clock() - self._written >= PROFILE_WRITE_SECONDS:
+            self.write_collapsed()
+        if self._clock() - self._snapshotted < self.snapshot_interval:
+            return None
+
+        sites = allocation_sites(tracemalloc.take_snapshot())
+        self._snapshotted = self._clock()
+        top = sorted(
+            (
+                AllocationSite(site, size, count, size - self._sites.get(site, (0, 0))[0])
+                for site, (size, count) in sites.items()
+            ),
+            key=lambda s: s.size_diff,
+            reverse=True,
+        )[:self.top]
+        self._sites = sites
+
+        logger.info('Top allocation sites: {}'.format(', '.join(
+            '{} {:+,} B ({:,} B in {:,} blocks)'.format(s.site, s.size_diff, s.size, s.count) for s in top
+        )))
+        with open(self.allocations_path, 'a') as allocations:
+            allocations.write(json.dumps({
+                'time': time.time(),
+                'cycle': self.cycles,
+                'sites': [attr.asdict(s) for s in top],
+            }) + '\n')
+        return top
+
+    def write_collapsed(self):
+        """Write the stack counts so far to `collapsed_path`, replacing it at once"""
+        # Copied first, since the sampler may add stacks while they're written
+        stacks = sorted(self.stacks.copy().items())
+        temporary_path = '{}.{}.tmp'.format(self.collapsed_path, os.getpid())
+        with open(temporary_path, 'w') as collapsed:
+            for stack, count in stacks:
+                collapsed.write('{} {}\n'.format(stack, count))
+        os.replace(temporary_path, self.collapsed_path)
+        self._written = self._clock()
@@ -0,0 +1,171 @@
+"""Record raw socket frames to a capture file, and replay them through the sweep pipeline
+
+A capture is a gzip file of records, each a header line of a monotonic
+timestamp and the length in bytes of the frame, separated by a tab, then the
+raw UTF-8 frame and a newline.  Frames are read by their length, so they may
+contain anything, newlines included.  Frames are written every
+`RECORDING_FLUSH_SECONDS` as a complete gzip member, so captures can be
+appended to across restarts and still read as one file, and a crash only loses
+the frames since the last write.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import time
+import zlib
+
+from cleansweep.clients.lazyjson import LazyObject
+from cleansweep.clients.socketio import (
+    SocketIOClient,
+    split_frame,
+)
+from cleansweep.constants import (
+    logger,
+    MARKET_EVENT_NAME,
+    MARKET_ORDERS_KEY,
+    RECORDING_FLUSH_SECONDS,
+)
+from cleansweep.records import (
+    Sweep,
+    TokenSnapshot,
+)
+
+
+class FrameRecorder:
+    """Appends every frame passed to `record` to the capture at `path`
+
+    Recording only queues the frame.  Every `RECORDING_FLUSH_SECONDS` the queued
+    frames are encoded, compressed and written on a thread, so the event loop never
+    waits on zlib or the disk.
+    """
+    def __init__(self, path, clock=time.monotonic):
+        self.path = path
+        self._clock = clock
+        self._file = open(path, 'ab')
+        # One thread, so members are written in the order they were queued
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._pending = []
+        self._flushed = clock()
+        self._writing = None
+        self.frames = 0
+
+    def record(self, frame):
+        now = self._clock()
+        self._pending.append((now, frame))
+        self.frames += 1
+        if now - self._flushed >= RECORDING_FLUSH_SECONDS:
+            self.flush_in_background()
+
+    def flush_in_background(self):
+        """Start writing the frames queued since the last flush on a thread.  Returns its future"""
+        pending, self._pending = self._pending, []
+        self._flushed = self._clock()
+        self._writing = self._writer.submit(self._write, pending)
+        return self._writing
+
+    def flush(self):
+        """Write the frames queued so far, and wait until they're written"""
+        self.flush_in_background().result()
+
+    def _write(self, pending):
+        if not pending:
+            return
+        # A complete member each time, so the file is readable up to the last write
+        compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+        records = []
+        for timestamp, frame in pending:
+            data = frame.encode('utf-8')
+            records.append(b'%.6f\t%d\n%s\n' % (timestamp, len(data), data))
+        try:
+            self._file.write(compressor.compress(b''.join(records)) + compressor.flush())
+            self._file.flush()
+        except OSError as e:
+            logger.warning('Could not write {} frames to {}: {!r}'.format(len(pending), self.path, e))
+
+    def close(self):
+        self.flush_in_background()
+        self._writer.shutdown(wait=True)
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_frames(path):
+    """Yield `(timestamp, frame)` for every frame in the capture at `path`"""
+    with gzip.open(path, 'rb') as capture:
+        for header in capture:
+            timestamp, length = header.split(b'\t')
+            frame = capture.read(int(length))
+            # The newline after the frame, which is only there to keep captures readable with zcat
+            capture.read(1)
+            yield float(timestamp), frame.decode('utf-8')
+
+
+def process_frame(frame):
+    """Run one raw frame through the pipeline the live bot uses.  Returns the number of sweeps found
+
+    Like `EtherDeltaClient.get_market`, only non-empty `market` events are used, and
+    their members are only decoded as they're read.
+    """
+    if not frame.startswith(SocketIOClient.SOCKET_IO_CONSTANT):
+        return 0
+    event, arguments = split_frame(frame[len(SocketIOClient.SOCKET_IO_CONSTANT):])
+    if event != MARKET_EVENT_NAME or not arguments:
+        return 0
+
+    market = LazyObject(arguments, parse_float=str)
+    if MARKET_ORDERS_KEY in market:
+        return len(Sweep.sweeps_from_orders(market[MARKET_ORDERS_KEY]))
+    if 'returnTicker' in market:
+        TokenSnapshot.from_market(market)
+    return 0
+
+
+def replay(path, speed=None, clock=time.monotonic, sleep=time.sleep):
+    """Feed the capture at `path` through `process_frame`, and return timing statistics
+
+    Params:
+        `speed` - play back at this multiple of recorded time, or as fast as possible if None
+    Returns a dict of how many frames and sweeps there were, how long processing
+    took, and how far processing fell behind the (sped up) recorded time.
+    """
+    frames = sweeps = 0
+    processing_seconds = max_lag = 0.0
+    recorded_start = previous_timestamp = None
+    recorded_elapsed = offset = 0.0
+    start = clock()
+    for timestamp, frame in read_frames(path):
+        if recorded_start is None:
+            recorded_start = previous_timestamp = timestamp
+        # Sessions appended later may have a monotonic clock that started over
+        if timestamp < previous_timestamp:
+            offset += previous_timestamp - timestamp
+        previous_timestamp = timestamp
+        recorded_elapsed = timestamp + offset - recorded_start
+
+        if speed is not None:
+            wait = start + recorded_elapsed / speed - clock()
+            if wait > 0:
+                sleep(wait)
+
+        frame_start = clock()
+        sweeps += process_frame(frame)
+        frame_end = clock()
+        processing_seconds += frame_end - frame_start
+        frames += 1
+        if speed is not None:
+            max_lag = max(max_lag, frame_end - (start + recorded_elapsed / speed))
+
+    stats = {
+        'frames': frames,
+        'sweeps': sweeps,
+        'recorded_seconds': recorded_elapsed,
+        'wall_seconds': clock() - start,
+        'processing_seconds': processing_seconds,
+        'max_lag_seconds': max_lag,
+    }
+    logger.debug('Replayed {}: {}'.format(path, stats))
+    return stats
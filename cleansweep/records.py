@@ -2,37 +2,84 @@
 import decimal
 import enum
 from itertools import (
-    product,
+    islice,
     takewhile,
 )
+import sys
 
 import attr
 
+from cleansweep.cache import VersionedTTLCache
 from cleansweep.constants import (
+    BUY_GAS,
     ETHER_TOKEN_ADDRESS,
-    ETHERDELTA_FEE_PROPORTION,
+    ETHERDELTA_FEE_DENOMINATOR,
+    ETHERDELTA_FEE_NUMERATOR,
+    GAS_PRICE_WEI,
     MARKET_ORDERS_BUY_KEY,
     MARKET_ORDERS_SELL_KEY,
-    MAX_EXPOSURE_ETHER,
-    SWEEP_TXN_FEE_ETHER,
+    MAX_EXPOSURE_WEI,
+    ORDER_CACHE_MAX_SIZE,
+    ORDER_CACHE_TTL_SECONDS,
+    PRICE_DECIMALS,
+    SELL_GAS,
+    TOKEN_DECIMALS,
+    TOKEN_PRECISION,
+    WEI_DECIMALS,
+    WEI_PER_ETHER,
 )
+from cleansweep.metrics import metrics
 
-def none_or_decimal(value):
-    """Return None if value is None, else create a Decimal from the value"""
+# Parsed `EthOrder`s by id, versioned by when they were updated and their available volume
+order_cache = VersionedTTLCache(maxsize=ORDER_CACHE_MAX_SIZE, ttl=ORDER_CACHE_TTL_SECONDS)
+
+# 10 ** i, for scaling by up to `WEI_DECIMALS` places without working out the power
+POWERS_OF_TEN = tuple(10 ** i for i in range(WEI_DECIMALS + 1))
+# The columns of an `OrderColumns`, in the order it builds them
+ORDER_COLUMNS = ('ids', 'prices', 'token_amounts', 'updated')
+
+
+def to_fixed(value, decimals):
+    """Convert a decimal number, or its string, to an int in units of 10^-`decimals`
+
+    Digits past `decimals` are truncated.  Plain decimal strings (what the API sends)
+    are converted without creating a Decimal.
+    """
+    if isinstance(value, int):
+        return value * 10 ** decimals
+
+    text = value if value.__class__ is str else str(value)
+    whole, _, fraction = text.partition('.')
+    places = len(fraction)
+    try:
+        if places <= decimals < len(POWERS_OF_TEN):
+            # Parsed as it is, then scaled, which is quicker than padding the string
+            return int(whole + fraction) * POWERS_OF_TEN[decimals - places]
+        return int(whole + fraction[:decimals].ljust(decimals, '0'))
+    except ValueError:
+        # Exponents (1e-05) and the like
+        return int(decimal.Decimal(text).scaleb(decimals))
+
+def from_fixed(value, decimals):
+    """Convert an int in units of 10^-`decimals` to a Decimal, e.g. for display"""
+    return decimal.Decimal(value).scaleb(-decimals)
+
+def none_or_fixed(value, decimals):
+    """Return None if value is None, else convert the value with `to_fixed`"""
     if value is None:
         return None
-    return decimal.Decimal(value)
+    return to_fixed(value, decimals)
 
-@attr.s(frozen=True)
+@attr.s(frozen=True, slots=True)
 class TokenSnapshot:
     """Summary information about a particular token on EtherDelta (e.g. ETH)"""
     # Ticker symbol of token, e.g. ETH
     ticker = attr.ib()
     # The address of the token's contract
     address = attr.ib()
-    # Current highest price of an extant buy order
+    # Current highest price of an extant buy order, in wei per token
     buy = attr.ib()
-    # Lowest price of extant sell order
+    # Lowest price of extant sell order, in wei per token
     sell = attr.ib()
 
     @property
@@ -43,7 +90,7 @@ class TokenSnapshot:
         The actual profitability depends on estimated transaction fees, and quantity
         of tokens that can be transacted, which is why it is calculated separately.
         """
-        return self.buy_to_sell_ratio > decimal.Decimal('1')
+        return self.buy is not None and self.sell is not None and self.buy > self.sell
 
     @property
     def buy_to_sell_ratio(self):
@@ -54,17 +101,14 @@ class TokenSnapshot:
         """
         # Sometimes there is no buy or sells. Just throwing something against the wall, ratio of 0 seems safe
         if self.buy is None or self.sell is None:
-            return decimal.Decimal('0')
+            return 0.0
 
-        try:
-            return self.buy / self.sell
-        except decimal.DivisionByZero:
+        if self.sell == 0:
             # If bid is zero, infinity is a mathematically correct and useful answer
-            # It gives a correct indication that the ratio is high
-            return decimal.Decimal('Infinity')
-        except decimal.InvalidOperation:
-            # This occurs when 0 / 0, but could also occur elsewhere. Return 0 to be safe
-            return decimal.Decimal('0')
+            # It gives a correct indication that the ratio is high. 0 / 0 is 0 to be safe
+            return float('inf') if self.buy else 0.0
+
+        return self.buy / self.sell
 
     @classmethod
     def from_market(cls, market):
@@ -73,18 +117,19 @@ class TokenSnapshot:
             raise ValueError("'returnTicker' not found in `market`: {}".format(market))
 
         # Use dict for numeric values
-        return [
-            cls(
-                # Comes back "ETH_XXX"
-                ticker=ticker.replace('ETH_', ''),
-                address=token_snapshot['tokenAddr'],
-                # None if are no buy orders
-                buy=none_or_decimal(token_snapshot['bid']),
-                # None if are no sell orders
-                sell=none_or_decimal(token_snapshot['ask']),
-            )
-            for ticker, token_snapshot in market['returnTicker'].items()
-        ]
+        with metrics.time('token_snapshot_from_market_seconds'):
+            return [
+                cls(
+                    # Comes back "ETH_XXX"
+                    ticker=ticker.replace('ETH_', ''),
+                    address=token_snapshot['tokenAddr'],
+                    # None if are no buy orders
+                    buy=none_or_fixed(token_snapshot['bid'], PRICE_DECIMALS),
+                    # None if are no sell orders
+                    sell=none_or_fixed(token_snapshot['ask'], PRICE_DECIMALS),
+                )
+                for ticker, token_snapshot in market['returnTicker'].items()
+            ]
 
 
 class OrderType(enum.Enum):
@@ -92,16 +137,20 @@ class OrderType(enum.Enum):
     SELL = enum.auto()
     UNKNOWN = enum.auto()
 
-@attr.s(frozen=True)
+@attr.s(frozen=True, slots=True)
 class EthOrder:
-    """Represents an order in the "Order Book" trading an ERC-20 token for ETH"""
+    """Represents an order in the "Order Book" trading an ERC-20 token for ETH
+
+    Orders are slotted, and their `order_type` and `token_address` are worked out
+    once when they are created, since the sweep code reads them constantly.
+    """
     # Unique id of the order
     id = attr.ib()
-    # Amount of non-ETH token being offered or asked for
+    # Amount of non-ETH token being offered or asked for, in 10^-TOKEN_DECIMALS tokens
     token_amount = attr.ib()
-    # Amount of ETH being offered or asked for
+    # Amount of ETH being offered or asked for, in wei
     eth_amount = attr.ib()
-    # Price in ETH
+    # Price in wei per token
     price = attr.ib()
     # Last time this Order was updated
     updated = attr.ib()
@@ -109,6 +158,10 @@ class EthOrder:
     token_get_address = attr.ib()
     # Token being provided
     token_give_address = attr.ib()
+    # The OrderType of the order
+    order_type = attr.ib(init=False, repr=False, eq=False)
+    # Address of the non-ETH token in the trade
+    token_address = attr.ib(init=False, repr=False, eq=False)
 
     @token_get_address.validator
     def one_token_is_eth(self, *args, **kwargs):
@@ -119,35 +172,52 @@ class EthOrder:
             (self.token_give_address == ETHER_TOKEN_ADDRESS)
         )
 
-    @property
-    def token_address(self):
-        """Address of the non-ETH token in the trade"""
-        if self.order_type == OrderType.SELL:
-            return self.token_give_address
-        else:
-            return self.token_get_address
-
-    @property
-    def order_type(self):
-        """The OrderType of the order"""
+    def __attrs_post_init__(self):
+        # Frozen, so set the derived fields the way attrs does
         # If you're expecting ETH, then you're selling
         if self.token_get_address == ETHER_TOKEN_ADDRESS:
-            return OrderType.SELL
+            object.__setattr__(self, 'order_type', OrderType.SELL)
+            object.__setattr__(self, 'token_address', self.token_give_address)
         else:
             # and otherwise you're expecting to give ETH, and you're buying
-            return OrderType.BUY
+            object.__setattr__(self, 'order_type', OrderType.BUY)
+            object.__setattr__(self, 'token_address', self.token_get_address)
+
+    @staticmethod
+    def token_address_of(api_order):
+        """The address of the non-ETH token of an order returned by the EtherDelta API, without parsing it"""
+        if api_order['tokenGet'] == ETHER_TOKEN_ADDRESS:
+            return api_order['tokenGive']
+        return api_order['tokenGet']
 
     @classmethod
     def from_api_order(cls, api_order):
-        """Create an EthOrder from an order returned by the EtherDelta API"""
+        """Create an EthOrder from an order returned by the EtherDelta API
+
+        An order that hasn't changed since it was last seen is returned from
+        `order_cache`, as the same object, rather than parsed again.
+        """
+        order_id = api_order['id']
+        # The available volume changes with the maker's balance, even if the order doesn't
+        version = (api_order['updated'], api_order['ethAvailableVolume'])
+        order = order_cache.get_version(order_id, version)
+        if order is None:
+            order = cls._parse_api_order(api_order)
+            order_cache.set_version(order_id, version, order)
+        return order
+
+    @classmethod
+    def _parse_api_order(cls, api_order):
+        # Positional, in field order, since every order in every book comes through here
         return cls(
-            id=api_order['id'],
-            token_amount=decimal.Decimal(api_order['ethAvailableVolume']),
-            eth_amount=decimal.Decimal(api_order['ethAvailableVolumeBase']),
-            price=decimal.Decimal(api_order['price']),
-            updated=api_order['updated'],
-            token_get_address=api_order['tokenGet'],
-            token_give_address=api_order['tokenGive'],
+            api_order['id'],
+            to_fixed(api_order['ethAvailableVolume'], TOKEN_DECIMALS),
+            to_fixed(api_order['ethAvailableVolumeBase'], PRICE_DECIMALS),
+            to_fixed(api_order['price'], PRICE_DECIMALS),
+            api_order['updated'],
+            # Interned, since there are only a few hundred tokens across every order
+            sys.intern(api_order['tokenGet']),
+            sys.intern(api_order['tokenGive']),
         )
 
     @classmethod
@@ -159,16 +229,100 @@ class EthOrder:
         return buys, sells
 
 
-@attr.s(frozen=True)
+class OrderColumns(tuple):
+    """One sorted side of a book: a tuple of `EthOrder`, with its fields stored as columns
+
+    `ids`, `prices`, `token_amounts` and `updated` are parallel tuples, for code that
+    scans a whole side (e.g. to fingerprint it or build arrays).  A side never changes
+    once built, since a change to the book builds a new one, so the columns are built
+    in one pass the first time any of them is read and then kept with the side.
+    """
+    @property
+    def ids(self):
+        return self._column('ids')
+
+    @property
+    def prices(self):
+        return self._column('prices')
+
+    @property
+    def token_amounts(self):
+        return self._column('token_amounts')
+
+    @property
+    def updated(self):
+        return self._column('updated')
+
+    def _column(self, name):
+        columns = self.__dict__
+        if not columns:
+            rows = [(o.id, o.price, o.token_amount, o.updated) for o in self]
+            columns.update(zip(ORDER_COLUMNS, zip(*rows)) if rows else dict.fromkeys(ORDER_COLUMNS, ()))
+        return columns[name]
+
+    def __reduce__(self):
+        # The columns are rebuilt on reading, rather than sent along with the orders
+        return (self.__class__, (tuple(self),))
+
+    @classmethod
+    def of(cls, orders):
+        """Return `orders` if they are already `OrderColumns`, else build them"""
+        if isinstance(orders, cls):
+            return orders
+        return cls(orders)
+
+
+@attr.s(frozen=True, slots=True)
+class CostModel:
+    """The costs and limits that decide if a sweep is profitable, with ETH amounts in wei
+
+    Defaults are the module constants.  Pass a different model to `Sweep` (e.g. to
+    backtest other gas prices) rather than changing the constants.
+    """
+    # Most ETH to spend on a sweep
+    max_exposure = attr.ib(default=MAX_EXPOSURE_WEI)
+    gas_price = attr.ib(default=GAS_PRICE_WEI)
+    buy_gas = attr.ib(default=BUY_GAS)
+    sell_gas = attr.ib(default=SELL_GAS)
+    # EtherDelta's fee, as a fraction of the ETH in the sale
+    fee_numerator = attr.ib(default=ETHERDELTA_FEE_NUMERATOR)
+    fee_denominator = attr.ib(default=ETHERDELTA_FEE_DENOMINATOR)
+
+    @classmethod
+    def from_ether(cls, max_exposure_ether, gas_price_ether, fee_proportion, **kwargs):
+        """Create a `CostModel` from Decimal amounts of ETH, like the module constants"""
+        fee_numerator, fee_denominator = decimal.Decimal(fee_proportion).as_integer_ratio()
+        return cls(
+            max_exposure=int(decimal.Decimal(max_exposure_ether) * WEI_PER_ETHER),
+            gas_price=int(decimal.Decimal(gas_price_ether) * WEI_PER_ETHER),
+            fee_numerator=fee_numerator,
+            fee_denominator=fee_denominator,
+            **kwargs
+        )
+
+    @property
+    def txn_fee(self):
+        """Gas cost in wei of the pair of transactions in a sweep"""
+        return (self.buy_gas + self.sell_gas) * self.gas_price
+
+
+DEFAULT_COST_MODEL = CostModel()
+
+
+@attr.s(frozen=True, slots=True)
 class Sweep:
     """A pair of open buy/sell orders that we instantly trade to try and make a profit.
 
     The main method here is `is_profitable`, which tells if a sweep would be profitable.
     You can also read the raw amount from `revenue`.
 
+    All amounts are integers: ETH in wei, and tokens in 10^-TOKEN_DECIMALS tokens.
+    Costs and limits come from `cost_model`.
+
     """
     buy = attr.ib()
     sell = attr.ib()
+    cost_model = attr.ib(default=DEFAULT_COST_MODEL, kw_only=True, repr=False)
 
     @buy.validator
     def _validate_order_tokens_match(self, *args, **kwargs):
@@ -176,39 +330,103 @@ class Sweep:
         return self.buy.token_address == self.sell.token_address
 
     @classmethod
-    def sweeps_from_orders(cls, orders):
+    def sweeps_from_orders(cls, orders, cost_model=DEFAULT_COST_MODEL):
         """Returns a list of profitable `Sweep` objects from the `getMarket` orders API response
 
         Params:
             `orders` - MARKET_ORDERS_KEY from the `getMarket` orders response. This has a
             dictionary with two entries: a list of buys and a list of sells
+        """
+        with metrics.time('sweeps_from_orders_seconds'):
+            buys, sells = EthOrder.from_get_market_orders(orders)
+            return cls.sweeps_from_buys_and_sells(buys, sells, cost_model=cost_model)
+
+    @classmethod
+    def sweeps_from_buys_and_sells(cls, buys, sells, cost_model=DEFAULT_COST_MODEL):
+        """Returns a list of profitable `Sweep` objects from sorted lists of `EthOrder`
+
+        Params:
+            `buys` - buy orders, ordered from highest price to lowest
+            `sells` - sell orders, ordered from lowest price to highest
         Notes:
-            To avoid comparing every buy to every sell, this only pairs buys
-            that are offering more than the lowest sell price, and sells before
-            the first sell above the highest buy price. If there are no buys/sells,
-            no pairs are generated.
+            Rather than comparing every buy to every sell, this walks both sorted
+            sides.  Only buys offering more than the lowest sell price, and sells
+            before the first sell above the highest buy price, are paired.
+
+            Orders that couldn't cover the transaction fee even in their best case
+            are dropped first: a sell against the highest buy, for as many tokens
+            as the largest crossed buy has, and a buy against the lowest sell, for
+            as many tokens as the largest sell has.  So a book whose orders are all
+            too small to sweep is rejected without pairing anything.
+
+            Each buy is then only paired with sells while the pair could still be
+            profitable.  Sells are walked from lowest price to highest, so the
+            fee adjusted price difference only shrinks, and so does the most
+            tokens we'd buy (the maximum exposure buys fewer of a pricier token).
+            Once the best case revenue for a sell is not positive, no later sell
+            can be profitable for that buy.  Because buys are walked from highest
+            price to lowest, the last sell with a positive price difference only
+            moves towards the front, so that bound is found in a single pass.
+
+            Pairs are returned in the same order as comparing every buy to every sell.
         """
-        buys, sells = EthOrder.from_get_market_orders(orders)
         # No pairings if there isn't anything to match
         if not buys or not sells:
             return []
 
-        # Sells are ordered from lowest ask to highest
-        lowest_sell = sells[0]
-
-        def is_sell_below_highest_buy(sell):
-            """True if sell.price is below the highest buy's price (e.g. could be sold for profit)"""
-            # Buys are ordered from highest offer to lowest
-            highest_buy = buys[0]
-            return sell.price < highest_buy.price
+        # Prices are compared scaled by the fee's denominator, so nothing is rounded
+        fee_denominator = cost_model.fee_denominator
+        fee_adjustment = fee_denominator - cost_model.fee_numerator
+        max_exposure = cost_model.max_exposure * TOKEN_PRECISION
+        txn_fee = cost_model.txn_fee * TOKEN_PRECISION * fee_denominator
+
+        def best_case_covers_fee(buy_price, sell_price, tokens):
+            if sell_price > 0:
+                tokens = min(tokens, max_exposure // sell_price)
+            return tokens * (buy_price * fee_denominator - sell_price * fee_adjustment) > txn_fee
+
+        # Buys are ordered from highest offer to lowest, sells from lowest ask to highest
+        highest_buy_price = buys[0].price
+        lowest_sell_price = sells[0].price
+        crossed_buys = list(takewhile(lambda b: b.price > lowest_sell_price, buys))
+        crossed_sells = list(takewhile(lambda s: s.price < highest_buy_price, sells))
+        if not crossed_buys or not crossed_sells:
+            return []
+        most_buy_tokens = max(b.token_amount for b in crossed_buys)
+        most_sell_tokens = max(s.token_amount for s in crossed_sells)
+        sweepable_buys = [
+            b for b in crossed_buys
+            if best_case_covers_fee(b.price, lowest_sell_price, min(b.token_amount, most_sell_tokens))
+        ]
+        sweepable_sells = [
+            s for s in crossed_sells
+            if best_case_covers_fee(highest_buy_price, s.price, min(s.token_amount, most_buy_tokens))
+        ]
+        fee_adjusted_sell_prices = [s.price * fee_adjustment for s in sweepable_sells]
+
+        sweeps = []
+        # Sells at and after `end` have no positive price difference with the current buy
+        end = len(sweepable_sells)
+        for buy in sweepable_buys:
+            scaled_buy_price = buy.price * fee_denominator
+            while end and fee_adjusted_sell_prices[end - 1] >= scaled_buy_price:
+                end -= 1
+
+            for sell, fee_adjusted_sell_price in islice(zip(sweepable_sells, fee_adjusted_sell_prices), end):
+                sweep = cls(buy, sell, cost_model=cost_model)
+                if sweep.is_profitable:
+                    sweeps.append(sweep)
+                elif sell.price > 0:
+                    best_case_tokens = min(max_exposure // sell.price, buy.token_amount)
+                    if best_case_tokens * (scaled_buy_price - fee_adjusted_sell_price) <= txn_fee:
+                        break
+
+        return sweeps
 
-        sweepable_buys = (b for b in buys if b.price > lowest_sell.price)
-        sweepable_sells = takewhile(is_sell_below_highest_buy, sells)
-        possible_sweeps = (
-            cls(b, s) for (b, s) in
-            product(sweepable_buys, sweepable_sells)
-        )
-        return [s for s in possible_sweeps if s.is_profitable]
+    @property
+    def fingerprint(self):
+        """A small hashable key that identifies the pair of orders in their current state"""
+        return (self.buy.id, self.sell.id, self.buy.updated, self.sell.updated)
 
     @property
     def available_tokens(self):
@@ -225,39 +443,166 @@ class Sweep:
 
     @property
     def buy_total(self):
-        """Total eth that will be spent on the buy"""
-        return self.amount_of_tokens_to_buy * self.buy.price
+        """Total wei that will be spent on the buy"""
+        return self.amount_of_tokens_to_buy * self.buy.price // TOKEN_PRECISION
 
     @property
     def amount_of_tokens_to_buy(self):
         """Return the amount of tokens we're able/willing to to purchase
 
         This returns the maximum number of tokens purchasable for up to the price of
-        `constants.MAX_EXPOSURE_ETHER`.
+        the cost model's `max_exposure`.
         """
-        eth_for_all_available = self.available_tokens * self.sell.price
-        # Only spend up to `MAX_EXPOSURE_ETHER`
-        eth_spend = min(MAX_EXPOSURE_ETHER, eth_for_all_available)
-        # If `eth_spend` is `eth_for_all_available`, we buy all available, otherwise
-        # only buy up to our limit.
-        return (eth_spend / eth_for_all_available) * self.available_tokens
+        available_tokens = self.available_tokens
+        max_exposure = self.cost_model.max_exposure * TOKEN_PRECISION
+        # Only spend up to `max_exposure`. Both sides are scaled by `TOKEN_PRECISION`
+        if available_tokens * self.sell.price <= max_exposure:
+            return available_tokens
+        return max_exposure // self.sell.price
 
     @property
     def fee_adjusted_sell_price(self):
-        """Sell price considering EtherDelta's fee"""
-        return self.sell.price * (1 - ETHERDELTA_FEE_PROPORTION)
+        """Sell price considering EtherDelta's fee, rounded down to the wei"""
+        return self._scaled_fee_adjusted_sell_price // self.cost_model.fee_denominator
 
     @property
     def fee_adjusted_price_difference(self):
         """Difference between the buy and sell price, considering EtherDelta's fee"""
-        return self.buy.price - self.fee_adjusted_sell_price
+        return self._scaled_fee_adjusted_price_difference // self.cost_model.fee_denominator
+
+    @property
+    def _scaled_fee_adjusted_sell_price(self):
+        return self.sell.price * (self.cost_model.fee_denominator - self.cost_model.fee_numerator)
+
+    @property
+    def _scaled_fee_adjusted_price_difference(self):
+        return self.buy.price * self.cost_model.fee_denominator - self._scaled_fee_adjusted_sell_price
+
+    @property
+    def _scaled_gross_revenue(self):
+        """Revenue before transaction fees, scaled by `TOKEN_PRECISION` and the fee denominator"""
+        return self.amount_of_tokens_to_buy * self._scaled_fee_adjusted_price_difference
+
+    @property
+    def revenue(self):
+        """The amount of revenue (negative or positive) in wei that would be generated by executing this sweep"""
+        scale = TOKEN_PRECISION * self.cost_model.fee_denominator
+        return self._scaled_gross_revenue // scale - self.cost_model.txn_fee
+
+    @property
+    def is_profitable(self):
+        """Returns True if the `buy`/`sell` pair can be swept for a profit
+
+        Exactly when `revenue`, which is rounded down to the wei, is positive.
+        """
+        scale = TOKEN_PRECISION * self.cost_model.fee_denominator
+        # `revenue > 0`, without dividing: the gross revenue rounds down to more than the fee
+        return self._scaled_gross_revenue >= (self.cost_model.txn_fee + 1) * scale
+
+
+@attr.s(frozen=True, slots=True)
+class Fill(Sweep):
+    """A `Sweep` of a set `amount` of tokens, rather than as many as the pair allows"""
+    amount = attr.ib()
+
+    @property
+    def amount_of_tokens_to_buy(self):
+        return self.amount
+
+
+@attr.s(frozen=True, slots=True)
+class SweepPlan:
+    """Fills across several crossed buy and sell orders of one token, swept together.
+
+    The plan has the same `buy_total`, `revenue` and `risk_per_revenue` as a `Sweep`,
+    summed over its `fills`.  Each fill is a pair of transactions, and so is charged
+    the cost model's `txn_fee`.
+    """
+    fills = attr.ib(converter=tuple)
+
+    @classmethod
+    def from_buys_and_sells(cls, buys, sells, cost_model=DEFAULT_COST_MODEL):
+        """Return the `SweepPlan` that greedily fills the most profitable levels first
+
+        Params:
+            `buys` - buy orders, ordered from highest price to lowest
+            `sells` - sell orders, ordered from lowest price to highest
+            `cost_model` - `CostModel`, whose `max_exposure` is the most wei to spend
+                on all of the fills together
+        Notes:
+            This matches the highest buy with the lowest sell, like an exchange
+            would, so the fee adjusted price difference of each fill is no larger
+            than the one before it and the ETH budget goes to the best levels first.
+            A fill that doesn't earn back its transaction fee is skipped by moving
+            past whichever of its orders has fewer tokens left.  Every order is
+            visited at most once, so this is linear in the size of the book.
+
+            This is a greedy heuristic, not the revenue maximising plan: a choice is
+            never revisited, so e.g. spending the budget on one small, barely
+            profitable level may leave too little for a larger one after it.  Every
+            fill does earn more than its own transaction fee, so adding a fill never
+            lowers the plan's revenue.
+        """
+        fills = []
+        budget = cost_model.max_exposure
+        fee_numerator, fee_denominator = cost_model.fee_numerator, cost_model.fee_denominator
+        buy_index, sell_index = 0, 0
+        buy_left = buys[0].token_amount if buys else 0
+        sell_left = sells[0].token_amount if sells else 0
+        while buy_index < len(buys) and sell_index < len(sells) and budget > 0:
+            buy, sell = buys[buy_index], sells[sell_index]
+            fee_adjusted_sell_price = sell.price * (fee_denominator - fee_numerator)
+            if buy.price * fee_denominator <= fee_adjusted_sell_price:
+                break
+
+            amount = min(buy_left, sell_left)
+            is_budget_limited = sell.price > 0 and amount * sell.price >= budget * TOKEN_PRECISION
+            if is_budget_limited:
+                amount = budget * TOKEN_PRECISION // sell.price
+
+            fill = Fill(buy, sell, amount, cost_model=cost_model)
+            if fill.is_profitable:
+                fills.append(fill)
+                # Round the spend up, so the fills never add up to more than the maximum exposure
+                budget -= -(-amount * sell.price // TOKEN_PRECISION)
+                buy_left -= amount
+                sell_left -= amount
+            elif is_budget_limited:
+                # Later fills would have a smaller price difference on no more tokens
+                break
+
+            if buy_left <= sell_left:
+                buy_index += 1
+                if buy_index < len(buys):
+                    buy_left = buys[buy_index].token_amount
+            else:
+                sell_index += 1
+                if sell_index < len(sells):
+                    sell_left = sells[sell_index].token_amount
+
+        return cls(fills)
+
+    @property
+    def amount_of_tokens_to_buy(self):
+        """Total amount of tokens bought across all fills"""
+        return sum(f.amount_of_tokens_to_buy for f in self.fills)
+
+    @property
+    def buy_total(self):
+        """Total wei that will be spent on the buys"""
+        return sum(f.buy_total for f in self.fills)
 
     @property
     def revenue(self):
-        """The amount of revenue (negative or positive) that would be generated by executing this sweep"""
-        return self.amount_of_tokens_to_buy * self.fee_adjusted_price_difference - SWEEP_TXN_FEE_ETHER
+        """The amount of revenue in wei generated by executing every fill"""
+        return sum(f.revenue for f in self.fills)
+
+    @property
+    def risk_per_revenue(self):
+        """Returns the ratio of risk (ETH spent on buys) to revenue"""
+        return self.buy_total / self.revenue
 
     @property
     def is_profitable(self):
-        """Returns True if the `buy`/`sell` pair can be swept for a profit"""
-        return self.revenue > decimal.Decimal('0')
+        """Returns True if the plan has any fills, which are each profitable"""
+        return bool(self.fills)
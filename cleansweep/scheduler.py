@@ -0,0 +1,213 @@
+"""Decide which tokens' order books to spend the limited request budget on"""
+import hashlib
+import itertools
+import time
+
+import attr
+
+from cleansweep.constants import (
+    MARKET_REFRESH_SECONDS,
+    MAX_TOKEN_REFRESH_SECONDS,
+    MIN_TOKEN_REFRESH_SECONDS,
+    SWEEP_RESULT_TTL_SECONDS,
+    WEI_PER_ETHER,
+)
+from cleansweep.metrics import metrics
+
+
+def book_fingerprint(book):
+    """Digest of the orders in a book, when they were updated and their amounts, to tell if it changed
+
+    Amounts are included since a partial fill, or a change in the maker's balance,
+    changes an order's available volume without changing when it was updated.
+    Unlike `hash`, this is the same in every process, so worker processes can work it out.
+    """
+    fields = itertools.chain(
+        book.buys.ids, book.buys.updated, map(str, book.buys.token_amounts), ['|'],
+        book.sells.ids, book.sells.updated, map(str, book.sells.token_amounts),
+    )
+    return hashlib.blake2b('\n'.join(fields).encode(), digest_size=8).digest()
+
+
+def diff_snapshots(previous, tokens):
+    """Return the tokens in `tokens` that are new, or whose `buy` or `sell` differ from `previous`
+
+    Params:
+        `previous` - the last `TokenSnapshot` of each token, by address
+    """
+    changed = []
+    for token in tokens:
+        last = previous.get(token.address)
+        if last is None or last.buy != token.buy or last.sell != token.sell:
+            changed.append(token)
+    return changed
+
+
+@attr.s(slots=True)
+class TokenSchedule:
+    """What the scheduler knows about one candidate token"""
+    token = attr.ib()
+    # Seconds to wait between refreshes, adapted to how often the book changes
+    interval = attr.ib(default=MIN_TOKEN_REFRESH_SECONDS)
+    # Revenue in wei of the best sweep (or plan) in the last fetched book
+    expected_revenue = attr.ib(default=0)
+    # Moving average of how often a refresh found the book had changed, from 0 to 1
+    change_rate = attr.ib(default=1.0)
+    last_refreshed = attr.ib(default=None)
+    last_fingerprint = attr.ib(default=None)
+    # True if the token's bid or ask changed since its book was last fetched
+    top_changed = attr.ib(default=True)
+    # Whatever the caller found in the last fetched book (e.g. its sweeps), and when
+    cached_result = attr.ib(default=None)
+    cached_at = attr.ib(default=None)
+
+    def due_at(self):
+        """When the book should next be fetched, or None if it never has been
+
+        A changed bid or ask makes the book due after `MIN_TOKEN_REFRESH_SECONDS`.
+        Otherwise the last result is reused until it's `SWEEP_RESULT_TTL_SECONDS` old,
+        or older still if the book has been found unchanged (`interval`).
+        """
+        if self.last_refreshed is None:
+            return None
+        if self.top_changed:
+            return self.last_refreshed + MIN_TOKEN_REFRESH_SECONDS
+        return self.last_refreshed + max(self.interval, SWEEP_RESULT_TTL_SECONDS)
+
+    def priority(self):
+        """How valuable this token's book is to refresh, regardless of when it was last refreshed"""
+        ratio = self.token.buy_to_sell_ratio
+        crossed_by = min(ratio - 1, 1) if ratio > 1 else 0
+        return crossed_by + self.expected_revenue / WEI_PER_ETHER + self.change_rate
+
+    def score(self, now):
+        """`priority`, weighted by how many intervals have passed since the last refresh"""
+        if self.last_refreshed is None:
+            return float('inf')
+        return self.priority() * (now - self.last_refreshed) / self.interval
+
+
+class TokenScheduler:
+    """Scores candidate tokens, and hands out the most valuable ones that are due a refresh
+
+    A token's score combines its buy to sell ratio, the revenue found in its last
+    book, how often its book actually changes between refreshes, and how long it
+    has been since the last refresh.  Each token's refresh interval halves when a
+    refresh finds its book changed, and doubles when it didn't, between
+    `MIN_TOKEN_REFRESH_SECONDS` and `MAX_TOKEN_REFRESH_SECONDS`.  Tokens that have
+    never been fetched come first.
+
+    Each market refresh is diffed against the last one, and only tokens whose bid or
+    ask changed are due again soon.  The rest reuse their cached result (see
+    `TokenSchedule.due_at`), which saves most `getMarket` calls on a quiet market.
+    """
+    # Weight of the latest refresh in `TokenSchedule.change_rate`
+    CHANGE_RATE_WEIGHT = .3
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._schedules = {}
+        self._market_refreshed = None
+
+    def __len__(self):
+        return len(self._schedules)
+
+    def __contains__(self, token_address):
+        return token_address in self._schedules
+
+    @property
+    def is_market_due(self):
+        """True if the whole market (and so the set of candidates) should be fetched again"""
+        return (
+            self._market_refreshed is None or
+            self._clock() - self._market_refreshed >= MARKET_REFRESH_SECONDS
+        )
+
+    def update_candidates(self, tokens, age=0):
+        """Replace the candidate tokens with `tokens`, keeping what's known about existing ones
+
+        Returns the tokens that are new or whose bid or ask changed since the last update.
+        `age` is how many seconds ago the market was fetched, e.g. for tokens saved
+        by an earlier run.
+        """
+        self._market_refreshed = self._clock() - age
+        changed = diff_snapshots({a: s.token for a, s in self._schedules.items()}, tokens)
+        for token in changed:
+            schedule = self._schedules.get(token.address)
+            if schedule is not None:
+                schedule.top_changed = True
+
+        schedules = {}
+        for token in tokens:
+            schedule = self._schedules.get(token.address) or TokenSchedule(token)
+            schedule.token = token
+            schedules[token.address] = schedule
+        self._schedules = schedules
+        return changed
+
+    def cached_result(self, token_address, fingerprint):
+        """The `result` recorded for a token's book if the book hasn't changed since, and it hasn't expired
+
+        Params:
+            `fingerprint` - the `book_fingerprint` of the token's current book
+        """
+        schedule = self._schedules.get(token_address)
+        is_fresh = (
+            schedule is not None and
+            schedule.cached_result is not None and
+            self._clock() - schedule.cached_at < SWEEP_RESULT_TTL_SECONDS and
+            fingerprint == schedule.last_fingerprint
+        )
+        if is_fresh:
+            metrics.counter('sweep_cache_hits', 'Cached sweep results reused').inc()
+            return schedule.cached_result
+        metrics.counter('sweep_cache_misses', 'Sweep results that had to be worked out').inc()
+        return None
+
+    def record_refresh(self, token_address, fingerprint, revenue, result=None, age=0, reused=False):
+        """Record that a token's book was just fetched, the best revenue found in it, and optionally the `result`
+
+        Params:
+            `fingerprint` - the `book_fingerprint` of the fetched book
+            `age` - how many seconds ago the book was fetched, e.g. for a book saved
+                by an earlier run
+            `reused` - True if `result` came from `cached_result`, so it keeps its age
+        `result` (e.g. the sweeps found) is returned by `cached_result` until the book
+        changes or `SWEEP_RESULT_TTL_SECONDS` pass.
+        """
+        schedule = self._schedules.get(token_address)
+        if schedule is None:
+            return
+
+        changed = fingerprint != schedule.last_fingerprint
+        weight = self.CHANGE_RATE_WEIGHT
+        schedule.change_rate = (1 - weight) * schedule.change_rate + weight * changed
+        if schedule.last_refreshed is not None:
+            interval = schedule.interval / 2 if changed else schedule.interval * 2
+            schedule.interval = max(MIN_TOKEN_REFRESH_SECONDS, min(MAX_TOKEN_REFRESH_SECONDS, interval))
+        schedule.expected_revenue = max(revenue, 0)
+        schedule.last_refreshed = self._clock() - age
+        schedule.last_fingerprint = fingerprint
+        schedule.top_changed = False
+        # A reused result keeps its age, so it still expires
+        if not reused:
+            schedule.cached_result = result
+            schedule.cached_at = schedule.last_refreshed
+
+    def next_batch(self, size):
+        """The (up to) `size` highest scoring tokens that are due a refresh"""
+        now = self._clock()
+        due = [s for s in self._schedules.values() if s.last_refreshed is None or now >= s.due_at()]
+        due.sort(key=lambda s: s.score(now), reverse=True)
+        return [s.token for s in due[:size]]
+
+    def seconds_until_due(self):
+        """Seconds until the next token or the whole market is due a refresh"""
+        now = self._clock()
+        due_times = [
+            s.due_at() - now if s.last_refreshed is not None else 0
+            for s in self._schedules.values()
+        ]
+        if self._market_refreshed is not None:
+            due_times.append(self._market_refreshed + MARKET_REFRESH_SECONDS - now)
+        return max(0, min(due_times, default=0))
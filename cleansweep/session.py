@@ -0,0 +1,85 @@
+"""A long lived EtherDelta session that reconnects, keeping its state, when the connection fails"""
+import asyncio
+import random
+import time
+
+import websockets
+
+from cleansweep.book import OrderBooks
+from cleansweep.clients.etherdelta import EmptyResponseError
+from cleansweep.clients.pool import EtherDeltaClientPool
+from cleansweep.clients.ratelimit import SlidingWindowLimiter
+from cleansweep.constants import (
+    logger,
+    ETHERDELTA_CONNECTIONS,
+    ETHERDELTA_REQUESTS_PER_MINUTE,
+    MAX_RECONNECT_SECONDS,
+    MIN_RECONNECT_SECONDS,
+)
+from cleansweep.metrics import metrics
+
+# Failures that a fresh connection can recover from
+RECONNECT_ERRORS = (
+    websockets.ConnectionClosed, websockets.InvalidHandshake, OSError, asyncio.TimeoutError, EmptyResponseError,
+)
+
+
+class SupervisedSession:
+    """Runs a scan on an `EtherDeltaClientPool`, reconnecting whenever the connection fails
+
+    The pool's connections each run `keepalive`, so a stalled connection is failed
+    rather than waited on forever.  When the scan raises one of `RECONNECT_ERRORS`,
+    a new pool is connected after a jittered delay that doubles with each failure in
+    a row, between `MIN_RECONNECT_SECONDS` and `MAX_RECONNECT_SECONDS`.
+
+    The rate limiter and order books outlive each pool, so a reconnect doesn't reset
+    the request budget or throw away tracked books.  Books are marked stale on
+    reconnecting, since pushed events may have been missed in between.
+
+        session = SupervisedSession()
+        await session.run(scan)  # `scan` is called with each new pool
+    """
+    def __init__(self, size=ETHERDELTA_CONNECTIONS, rate_limiter=None, order_books=None, recorder=None,
+                 clock=time.monotonic, sleep=asyncio.sleep, **connect_kwargs):
+        self.size = size
+        self.rate_limiter = rate_limiter or SlidingWindowLimiter(ETHERDELTA_REQUESTS_PER_MINUTE, period=60)
+        self.order_books = OrderBooks() if order_books is None else order_books
+        self.recorder = recorder
+        # How many times a pool has been connected
+        self.connections = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._connect_kwargs = connect_kwargs
+
+    def backoff(self, failures):
+        """Seconds to wait before reconnecting after `failures` failures in a row"""
+        ceiling = min(MAX_RECONNECT_SECONDS, MIN_RECONNECT_SECONDS * 2 ** (failures - 1))
+        return random.uniform(MIN_RECONNECT_SECONDS, max(MIN_RECONNECT_SECONDS, ceiling))
+
+    async def run(self, scan):
+        """Await `scan(pool)` on a connected pool, reconnecting until it returns, and return its result"""
+        failures = 0
+        while True:
+            connected = None
+            try:
+                async with EtherDeltaClientPool.connect(
+                    self.size,
+                    rate_limiter=self.rate_limiter,
+                    order_books=self.order_books,
+                    recorder=self.recorder,
+                    **self._connect_kwargs
+                ) as pool:
+                    connected = self._clock()
+                    self.connections += 1
+                    if self.connections > 1:
+                        self.order_books.mark_stale()
+                    return await scan(pool)
+            except RECONNECT_ERRORS as e:
+                # A session that lasted a while isn't part of a run of failures
+                if connected is not None and self._clock() - connected >= MAX_RECONNECT_SECONDS:
+                    failures = 0
+                failures += 1
+                delay = self.backoff(failures)
+                metrics.counter('reconnects', 'Sessions reconnected after a failure').inc()
+                logger.warning('Session failed ({!r}), reconnecting in {:.1f} seconds'.format(e, delay))
+                await self._sleep(delay)
@@ -0,0 +1,117 @@
+"""Search order books for sweeps on worker processes, sharded by token address
+
+The event loop that owns the connections hands the undecoded text of each
+`getMarket` response to a worker, so socket reads never wait on JSON decoding,
+parsing or sweep math.  Each token always goes to the same worker, which keeps
+that token's book (and so the orders in its `order_cache`) from one fetch to the next.
+
+Only what gets reported comes back: the `SHARDED_TOP_SWEEPS` most profitable
+sweeps and the plan's fills, with each order as a tuple of its fields.
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+import zlib
+
+import attr
+
+from cleansweep import vectorized
+from cleansweep.book import OrderBooks
+from cleansweep.clients.lazyjson import LazyObject
+from cleansweep.constants import (
+    MARKET_ORDERS_BUY_KEY,
+    MARKET_ORDERS_KEY,
+    MARKET_ORDERS_SELL_KEY,
+    SHARDED_TOP_SWEEPS,
+)
+from cleansweep.records import (
+    EthOrder,
+    Fill,
+    Sweep,
+    SweepPlan,
+)
+from cleansweep.scheduler import book_fingerprint
+
+# The books of the tokens sharded to this worker process
+_worker_books = OrderBooks()
+
+
+def order_fields(order):
+    """An `EthOrder` as a tuple of its fields, which `EthOrder(*fields)` makes again"""
+    return (
+        order.id, order.token_amount, order.eth_amount, order.price, order.updated,
+        order.token_get_address, order.token_give_address,
+    )
+
+
+@attr.s(frozen=True, slots=True)
+class BookResult:
+    """What a worker found in one token's book, small enough to send back cheaply"""
+    token_address = attr.ib()
+    # `book_fingerprint` of the book
+    fingerprint = attr.ib()
+    # Revenue in wei of the best of all the book's sweeps and its plan
+    best_revenue = attr.ib()
+    # `order_fields` of the buy and sell of the most profitable sweeps, best first
+    top_sweeps = attr.ib()
+    # `order_fields` of the buy and sell of each of the plan's fills, and its amount
+    plan_fills = attr.ib()
+
+    @property
+    def sweeps(self):
+        """The `top_sweeps` as `Sweep`s"""
+        return [Sweep(EthOrder(*buy), EthOrder(*sell)) for buy, sell in self.top_sweeps]
+
+    @property
+    def plan(self):
+        """The `SweepPlan` of `plan_fills`"""
+        return SweepPlan(Fill(EthOrder(*buy), EthOrder(*sell), amount) for buy, sell, amount in self.plan_fills)
+
+
+def evaluate_market(token_address, text):
+    """Seed the token's book from the text of a `getMarket` response and search it.  Runs on a worker"""
+    orders = LazyObject(text, parse_float=str).get(MARKET_ORDERS_KEY) or {}
+    book = _worker_books.seed(token_address, {
+        MARKET_ORDERS_BUY_KEY: orders.get(MARKET_ORDERS_BUY_KEY, []),
+        MARKET_ORDERS_SELL_KEY: orders.get(MARKET_ORDERS_SELL_KEY, []),
+    })
+    buys, sells = book.buys, book.sells
+    sweeps = vectorized.sweeps_from_buys_and_sells(buys, sells)
+    plan = SweepPlan.from_buys_and_sells(buys, sells)
+    top_sweeps = heapq.nlargest(SHARDED_TOP_SWEEPS, sweeps, key=lambda s: s.revenue)
+    return BookResult(
+        token_address=token_address,
+        fingerprint=book_fingerprint(book),
+        best_revenue=max([s.revenue for s in top_sweeps] + [plan.revenue]),
+        top_sweeps=[(order_fields(s.buy), order_fields(s.sell)) for s in top_sweeps],
+        plan_fills=[(order_fields(f.buy), order_fields(f.sell), f.amount) for f in plan.fills],
+    )
+
+
+def shard_for(token_address, shards):
+    """The shard a token always goes to, the same in every process"""
+    return zlib.crc32(token_address.encode()) % shards
+
+
+class ShardedEvaluator:
+    """`shards` single process pools, each searching the books of the tokens sharded to it
+
+    Use it with `async with`, which shuts the processes down on leaving.
+    """
+    def __init__(self, shards):
+        self.shards = shards
+        self._executors = []
+
+    async def __aenter__(self):
+        self._executors = [ProcessPoolExecutor(max_workers=1) for _ in range(self.shards)]
+        return self
+
+    async def __aexit__(self, *exc_info):
+        for executor in self._executors:
+            executor.shutdown(wait=False)
+        self._executors = []
+
+    async def evaluate(self, token_address, text):
+        """Return the `BookResult` of the `getMarket` response `text`, worked out on the token's shard"""
+        executor = self._executors[shard_for(token_address, self.shards)]
+        return await asyncio.get_event_loop().run_in_executor(executor, evaluate_market, token_address, text)
@@ -0,0 +1,281 @@
+"""A local stand-in for the EtherDelta socket API, for load testing without a network
+
+`SyntheticMarket` generates tokens and order books shaped like EtherDelta's, and
+`StandInServer` serves them over a websocket with the same `42[...]` socket.io
+framing, optionally adding latency, empty responses, noise events and pushed
+`orders` updates.  Running this module measures the whole client pipeline against it:
+
+    python -m cleansweep.simulator --tokens 200 --orders 1000 --latency .05
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import time
+
+import websockets
+
+from cleansweep.clients.pool import EtherDeltaClientPool
+from cleansweep.clients.ratelimit import SlidingWindowLimiter
+from cleansweep.clients.socketio import split_frame
+from cleansweep.constants import (
+    ETHER_TOKEN_ADDRESS,
+    MARKET_EVENT_NAME,
+    MARKET_ORDERS_BUY_KEY,
+    MARKET_ORDERS_KEY,
+    MARKET_ORDERS_SELL_KEY,
+    ORDERS_EVENT_NAME,
+)
+from cleansweep.records import (
+    Sweep,
+    TokenSnapshot,
+)
+
+SOCKET_IO_CONSTANT = '42'
+# When the orders of a `SyntheticMarket` are updated, one second apart in the order they're made
+SYNTHETIC_EPOCH = datetime.datetime(2017, 11, 22, 4, 55)
+
+
+def socket_io_message(event, payload):
+    return '{}{}'.format(SOCKET_IO_CONSTANT, json.dumps([event, payload]))
+
+
+class SyntheticMarket:
+    """Random tokens, each with a book of `orders_per_side` buys and sells
+
+    A token's book is crossed (its highest buy is above its lowest sell) with
+    probability `crossed_probability`.  The same `seed` always makes the same market.
+    """
+    def __init__(self, tokens=100, orders_per_side=100, crossed_probability=.1, seed=0):
+        self._rng = random.Random(seed)
+        self._ids = 0
+        self.books = {}
+        self.tickers = {}
+        for i in range(tokens):
+            address = '0x{:040x}'.format(self._rng.getrandbits(160))
+            self.tickers['ETH_T{}'.format(i)] = address
+            self.books[address] = self._random_book(
+                address, orders_per_side, self._rng.random() < crossed_probability,
+            )
+
+    def _random_order(self, token_address, is_buy, price):
+        self._ids += 1
+        amount = round(self._rng.uniform(1, 5000), 3)
+        return {
+            'id': '{:064x}_{}'.format(self._ids, 'buy' if is_buy else 'sell'),
+            'amount': str(amount if is_buy else -amount),
+            'price': '{:.9f}'.format(price),
+            'tokenGet': token_address if is_buy else ETHER_TOKEN_ADDRESS,
+            'tokenGive': ETHER_TOKEN_ADDRESS if is_buy else token_address,
+            'ethAvailableVolume': '{:.3f}'.format(amount),
+            'ethAvailableVolumeBase': '{:.9f}'.format(amount * price),
+            'updated': (SYNTHETIC_EPOCH + datetime.timedelta(seconds=self._ids)).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+        }
+
+    def _random_book(self, token_address, orders_per_side, is_crossed):
+        mid = self._rng.uniform(.0001, .01)
+        # A crossed book's buys reach up into its sells
+        overlap = self._rng.uniform(.01, .05) if is_crossed else -.01
+        buys = sorted(
+            (self._random_order(token_address, True, mid * self._rng.uniform(.8, 1 + overlap))
+             for _ in range(orders_per_side)),
+            key=lambda o: -float(o['price']),
+        )
+        sells = sorted(
+            (self._random_order(token_address, False, mid * self._rng.uniform(1, 1.2))
+             for _ in range(orders_per_side)),
+            key=lambda o: float(o['price']),
+        )
+        return {MARKET_ORDERS_BUY_KEY: buys, MARKET_ORDERS_SELL_KEY: sells}
+
+    def return_ticker(self):
+        """The `returnTicker` of a whole market `getMarket` response"""
+        ticker = {}
+        for name, address in self.tickers.items():
+            book = self.books[address]
+            buys, sells = book[MARKET_ORDERS_BUY_KEY], book[MARKET_ORDERS_SELL_KEY]
+            ticker[name] = {
+                'tokenAddr': address,
+                'bid': float(buys[0]['price']) if buys else None,
+                'ask': float(sells[0]['price']) if sells else None,
+                'baseVolume': 0,
+                'quoteVolume': 0,
+            }
+        return ticker
+
+    def market(self, token_address=None):
+        """A `getMarket` response, with the orders of `token_address` if it's given"""
+        market = {'returnTicker': self.return_ticker()}
+        if token_address in self.books:
+            market[MARKET_ORDERS_KEY] = self.books[token_address]
+        return market
+
+    def random_update(self):
+        """Replace a random order of a random token, and return the pushed `orders` payload"""
+        address = self._rng.choice(list(self.books))
+        book = self.books[address]
+        is_buy = self._rng.random() < .5
+        side = book[MARKET_ORDERS_BUY_KEY if is_buy else MARKET_ORDERS_SELL_KEY]
+        if not side:
+            return {MARKET_ORDERS_BUY_KEY: [], MARKET_ORDERS_SELL_KEY: []}
+
+        index = self._rng.randrange(len(side))
+        old = dict(side[index], deleted=True)
+        new = self._random_order(address, is_buy, float(side[index]['price']))
+        side[index] = new
+        key = MARKET_ORDERS_BUY_KEY if is_buy else MARKET_ORDERS_SELL_KEY
+        return {
+            MARKET_ORDERS_BUY_KEY: [], MARKET_ORDERS_SELL_KEY: [],
+            key: [old, new],
+        }
+
+
+class StandInServer:
+    """A websocket server that answers `getMarket` from a `SyntheticMarket`
+
+    Params:
+        `latency` - seconds to wait before each response
+        `empty_probability` - chance of answering with an empty `market` event
+        `noise_probability` - chance of sending an unrelated event before each response
+        `push_rate` - pushed `orders` updates per second, to every connection.  Setting
+            it to 0 while running stops the updates
+
+    Use it with `async with`, and connect clients to its `uri`.
+    """
+    def __init__(self, market, latency=0, empty_probability=0, noise_probability=0, push_rate=0,
+                 host='127.0.0.1', port=0, seed=0):
+        self.market = market
+        self.latency = latency
+        self.empty_probability = empty_probability
+        self.noise_probability = noise_probability
+        self.push_rate = push_rate
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._server = None
+        self._connections = set()
+        self._pusher = None
+
+    @property
+    def uri(self):
+        return 'ws://{}:{}/socket.io/?transport=websocket'.format(self.host, self.port)
+
+    async def __aenter__(self):
+        self._server = await websockets.serve(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.push_rate:
+            self._pusher = asyncio.ensure_future(self._push_updates())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self._pusher is not None:
+            self._pusher.cancel()
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _push_updates(self):
+        while self.push_rate:
+            await asyncio.sleep(1 / self.push_rate)
+            message = socket_io_message(ORDERS_EVENT_NAME, self.market.random_update())
+            for websocket in list(self._connections):
+                asyncio.ensure_future(websocket.send(message))
+
+    async def _handle(self, websocket, path=None):
+        self._connections.add(websocket)
+        try:
+            # What a socket.io server sends on connecting, neither of which is an event
+            await websocket.send('0{"sid":"stand-in","pingInterval":25000,"pingTimeout":60000}')
+            await websocket.send('40')
+            async for message in websocket:
+                if message.startswith(SOCKET_IO_CONSTANT):
+                    event, arguments = split_frame(message[len(SOCKET_IO_CONSTANT):])
+                    if event == 'getMarket':
+                        await self._respond(websocket, json.loads(arguments or '{}'))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self._connections.discard(websocket)
+
+    async def _respond(self, websocket, params):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._rng.random() < self.noise_probability:
+            await websocket.send(socket_io_message('funds', {}))
+        if self._rng.random() < self.empty_probability:
+            await websocket.send(socket_io_message(MARKET_EVENT_NAME, {}))
+            return
+        await websocket.send(socket_io_message(MARKET_EVENT_NAME, self.market.market(params.get('token'))))
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def measure_pipeline(server, connections=1):
+    """Fetch the market and every token's book from `server`, timing each step"""
+    # No rate limit, so the pipeline itself is what's measured
+    rate_limiter = SlidingWindowLimiter(rate=10 ** 9, period=1)
+    latencies = []
+    sweep_count = 0
+    async with EtherDeltaClientPool.connect(
+        size=connections, uri=server.uri, rate_limiter=rate_limiter, max_size=None,
+    ) as pool:
+        start = time.perf_counter()
+        market = await pool.get_market()
+        tokens = TokenSnapshot.from_market(market)
+
+        async def fetch(token):
+            nonlocal sweep_count
+            requested = time.perf_counter()
+            orders = await pool.get_orders_for_token(token.address)
+            sweep_count += len(Sweep.sweeps_from_orders(orders))
+            latencies.append(time.perf_counter() - requested)
+
+        await asyncio.gather(*(fetch(token) for token in tokens))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'tokens': len(tokens),
+        'requests': server.requests,
+        'seconds': elapsed,
+        'books_per_second': len(tokens) / elapsed,
+        'latency_p50': percentile(latencies, .5),
+        'latency_p99': percentile(latencies, .99),
+        'sweeps': sweep_count,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the client pipeline against a local stand-in server')
+    parser.add_argument('--tokens', type=int, default=100)
+    parser.add_argument('--orders', type=int, default=100, help='Orders per side of each book')
+    parser.add_argument('--crossed', type=float, default=.1, help='Probability a book is crossed')
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--empty', type=float, default=0, help='Probability of an empty response')
+    parser.add_argument('--noise', type=float, default=0, help='Probability of a noise event per response')
+    parser.add_argument('--push-rate', type=float, default=0, help='Pushed order updates per second')
+    parser.add_argument('--connections', type=int, default=1)
+    args = parser.parse_args()
+
+    market = SyntheticMarket(tokens=args.tokens, orders_per_side=args.orders, crossed_probability=args.crossed)
+
+    async def run():
+        async with StandInServer(
+            market, latency=args.latency, empty_probability=args.empty,
+            noise_probability=args.noise, push_rate=args.push_rate,
+        ) as server:
+            return await measure_pipeline(server, connections=args.connections)
+
+    results = asyncio.get_event_loop().run_until_complete(run())
+    for name, value in results.items():
+        print('{:<18} {}'.format(name, round(value, 4) if isinstance(value, float) else value))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""Write sweep records as JSON lines from a background task, so slow output never stalls scanning
+
+A sink takes compact records (see `sweep_record`) with `put`, which never blocks,
+and a background task writes them in batches to a transport: a stream such as
+stdout, a file, or a UNIX socket.  The queue is bounded, and what happens when
+it's full is the sink's `policy`:
+
+    `DROP_OLDEST` - discard the oldest queued record to make room
+    `DROP_NEWEST` - discard the record being put
+    `BLOCK` - keep the record, and make `drain` wait until the queue has room.
+        The scan loop awaits `drain` between cycles, so output speed holds it back.
+        Records put between drains (e.g. by listeners for pushed events) can go
+        past `maxsize`, but only by `overflow`: after that they're dropped, and
+        counted in `overflowed` and the `sink_overflow` metric
+"""
+import asyncio
+import collections
+import json
+import sys
+import time
+
+from cleansweep.constants import (
+    logger,
+    SINK_BATCH_SIZE,
+    SINK_BLOCK_OVERFLOW,
+    SINK_QUEUE_SIZE,
+)
+from cleansweep.metrics import metrics
+
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+BLOCK = 'block'
+POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+# Prefix of `transport_for` targets that are UNIX sockets
+UNIX_SOCKET_PREFIX = 'unix:'
+
+
+def sweep_record(token, sweep, plan=None, age=None):
+    """A compact, JSON serializable record of `sweep` (and `plan`), with amounts as integers
+
+    ETH amounts are in wei, prices in wei per token, and token amounts in
+    10^-TOKEN_DECIMALS tokens.  `stale` is True if the sweep was found in a book
+    that may have changed since, `age` seconds ago (e.g. one restored from a warm
+    start file), rather than in a book that was just fetched.
+    """
+    record = {
+        'time': time.time(),
+        'ticker': token.ticker,
+        'address': token.address,
+        'buy_id': sweep.buy.id,
+        'sell_id': sweep.sell.id,
+        'revenue': sweep.revenue,
+        'num_tokens': sweep.amount_of_tokens_to_buy,
+        'buy_price': sweep.buy.price,
+        'sell_price': sweep.sell.price,
+        'risk_to_reward': sweep.risk_per_revenue,
+        'stale': age is not None,
+        'age': age or 0,
+    }
+    if plan is not None:
+        record['plan_revenue'] = plan.revenue
+        record['plan_fills'] = [
+            [f.buy.id, f.sell.id, f.amount_of_tokens_to_buy, f.buy.price, f.sell.price] for f in plan.fills
+        ]
+    return record
+
+
+class StreamTransport:
+    """Writes to a blocking stream (e.g. stdout) on a thread, so a slow reader doesn't block the loop"""
+    def __init__(self, stream):
+        self.stream = stream
+
+    def _write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+
+    async def write(self, data):
+        await asyncio.get_event_loop().run_in_executor(None, self._write, data)
+
+    async def close(self):
+        pass
+
+
+class FileTransport(StreamTransport):
+    """Appends to the file at `path`"""
+    def __init__(self, path):
+        super(FileTransport, self).__init__(open(path, 'a'))
+
+    async def close(self):
+        self.stream.close()
+
+
+class UnixSocketTransport:
+    """Writes to the UNIX socket at `path`, connecting on the first write"""
+    def __init__(self, path):
+        self.path = path
+        self._writer = None
+
+    async def write(self, data):
+        if self._writer is None:
+            _, self._writer = await asyncio.open_unix_connection(self.path)
+        try:
+            self._writer.write(data.encode())
+            await self._writer.drain()
+        except OSError:
+            # Connect again on the next write
+            self._writer.close()
+            self._writer = None
+            raise
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def transport_for(target):
+    """The transport for `target`: '-' for stdout, 'unix:<path>' for a UNIX socket, else a file path"""
+    if target == '-':
+        return StreamTransport(sys.stdout)
+    if target.startswith(UNIX_SOCKET_PREFIX):
+        return UnixSocketTransport(target[len(UNIX_SOCKET_PREFIX):])
+    return FileTransport(target)
+
+
+class JSONLinesSink:
+    """Queues records, and writes them to `transport` as JSON lines from a background task
+
+    Use it with `async with`, which starts the writer, and on leaving writes what's
+    still queued.  `written` and `dropped` count records, including any that
+    couldn't be written.
+    """
+    def __init__(self, transport, maxsize=SINK_QUEUE_SIZE, policy=DROP_OLDEST, batch_size=SINK_BATCH_SIZE,
+                 overflow=SINK_BLOCK_OVERFLOW):
+        if policy not in POLICIES:
+            raise ValueError('Unknown policy {!r}, expected one of {}'.format(policy, POLICIES))
+        self.transport = transport
+        self.maxsize = maxsize
+        self.policy = policy
+        self.batch_size = batch_size
+        self.overflow = overflow
+        self.written = 0
+        self.dropped = 0
+        # Records dropped with the `BLOCK` policy, since `drain` wasn't awaited in time
+        self.overflowed = 0
+        self._queue = collections.deque()
+        self._writer = None
+        self._closing = False
+        # Created in `__aenter__`, in the loop that uses them
+        self._has_records = None
+        self._has_room = None
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, record):
+        """Queue `record` without waiting.  Returns False if a record was dropped to make room"""
+        dropped = False
+        if len(self._queue) >= self.maxsize + self.overflow and self.policy == BLOCK:
+            self.overflowed += 1
+            metrics.counter('sink_overflow', 'Records dropped by a blocking sink filled between drains').inc()
+            self._count_dropped(1)
+            return False
+        if len(self._queue) >= self.maxsize and self.policy != BLOCK:
+            dropped = True
+            self._count_dropped(1)
+            if self.policy == DROP_NEWEST:
+                return False
+            self._queue.popleft()
+        self._queue.append(record)
+        if self._has_records is not None:
+            self._has_records.set()
+            if len(self._queue) >= self.maxsize:
+                self._has_room.clear()
+        return not dropped
+
+    def _count_dropped(self, count):
+        self.dropped += count
+        metrics.counter('sink_dropped', 'Records dropped because the sink was full or writing failed').inc(count)
+
+    async def drain(self):
+        """Wait until the queue has room.  Only ever waits with the `BLOCK` policy"""
+        if self.policy == BLOCK and self._has_room is not None:
+            await self._has_room.wait()
+
+    async def __aenter__(self):
+        self._has_records = asyncio.Event()
+        self._has_room = asyncio.Event()
+        self._has_room.set()
+        if self._queue:
+            self._has_records.set()
+        self._writer = asyncio.ensure_future(self._write_forever())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._closing = True
+        self._has_records.set()
+        try:
+            await self._writer
+        finally:
+            await self.transport.close()
+
+    async def _write_batch(self):
+        batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+        if len(self._queue) < self.maxsize:
+            self._has_room.set()
+        try:
+            await self.transport.write(''.join(json.dumps(record) + '\n' for record in batch))
+        except (OSError, ValueError) as e:
+            logger.warning('Could not write {} sweep records: {!r}'.format(len(batch), e))
+            self._count_dropped(len(batch))
+            return
+        self.written += len(batch)
+
+    async def _write_forever(self):
+        while True:
+            await self._has_records.wait()
+            while self._queue:
+                await self._write_batch()
+            if self._closing:
+                return
+            self._has_records.clear()
@@ -0,0 +1,84 @@
+"""Screen many buy/sell pairs at once with NumPy, then confirm them exactly with `Sweep`
+
+Screening is done on float64 copies of the orders' integer amounts, in wei.
+
+NumPy is optional (`pip install cleansweep[fast]`).  Without it, or for books too
+small to be worth building arrays for, this falls back to
+`Sweep.sweeps_from_buys_and_sells`.
+"""
+from itertools import takewhile
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from cleansweep.constants import TOKEN_PRECISION
+from cleansweep.records import (
+    DEFAULT_COST_MODEL,
+    OrderColumns,
+    Sweep,
+)
+
+# Pairs whose float revenue is above `-SCREEN_MARGIN_WEI` are re-checked exactly.
+# float64 revenue is off by far less than this, so no profitable pair is screened out.
+SCREEN_MARGIN_WEI = 1e9
+# Fewer pairs than this are cheaper to check one at a time
+MIN_VECTORIZED_PAIRS = 1024
+# Most pairs evaluated in one pass, to bound memory on very large books
+MAX_PAIRS_PER_CHUNK = 1 << 20
+
+
+def screen_pairs(buys, sells, margin=SCREEN_MARGIN_WEI, cost_model=DEFAULT_COST_MODEL):
+    """Yield `(buy, sell)` pairs whose float64 revenue is above `-margin`, in buy then sell order
+
+    Params:
+        `buys` - buy orders, ordered from highest price to lowest
+        `sells` - sell orders, ordered from lowest price to highest
+
+    Only the crossed orders are read into arrays.
+    """
+    if not buys or not sells:
+        return
+
+    # The buys priced above the lowest sell, and sells priced below the highest buy
+    lowest_sell_price, highest_buy_price = sells[0].price, buys[0].price
+    crossed_buys = OrderColumns(takewhile(lambda o: o.price > lowest_sell_price, buys))
+    crossed_sells = OrderColumns(takewhile(lambda o: o.price < highest_buy_price, sells))
+    buy_count, sell_count = len(crossed_buys), len(crossed_sells)
+    if not buy_count or not sell_count:
+        return
+
+    buy_prices = numpy.array(crossed_buys.prices, dtype=float)
+    buy_amounts = numpy.array(crossed_buys.token_amounts, dtype=float)
+    sell_prices = numpy.array(crossed_sells.prices, dtype=float)
+    sell_amounts = numpy.array(crossed_sells.token_amounts, dtype=float)
+
+    # Most tokens the maximum exposure buys at each sell price (all of them if it's free)
+    max_exposure = float(cost_model.max_exposure * TOKEN_PRECISION)
+    with numpy.errstate(divide='ignore'):
+        affordable = numpy.where(sell_prices > 0, max_exposure / sell_prices, numpy.inf)
+    fee_proportion = cost_model.fee_numerator / cost_model.fee_denominator
+    fee_adjusted_sell_prices = sell_prices * (1 - fee_proportion)
+    txn_fee = float(cost_model.txn_fee)
+
+    rows_per_chunk = max(1, MAX_PAIRS_PER_CHUNK // sell_count)
+    for start in range(0, buy_count, rows_per_chunk):
+        stop = start + rows_per_chunk
+        available = numpy.minimum(buy_amounts[start:stop, None], sell_amounts[None, :])
+        tokens = numpy.minimum(available, affordable[None, :])
+        price_differences = buy_prices[start:stop, None] - fee_adjusted_sell_prices[None, :]
+        revenue = tokens * price_differences / float(TOKEN_PRECISION) - txn_fee
+        for i, j in zip(*numpy.nonzero(revenue > -margin)):
+            yield buys[start + i], sells[j]
+
+
+def sweeps_from_buys_and_sells(buys, sells, cost_model=DEFAULT_COST_MODEL):
+    """Same as `Sweep.sweeps_from_buys_and_sells`, screening pairs with NumPy when it's worth it"""
+    if numpy is None or len(buys) * len(sells) < MIN_VECTORIZED_PAIRS:
+        return Sweep.sweeps_from_buys_and_sells(buys, sells, cost_model=cost_model)
+
+    possible_sweeps = (
+        Sweep(b, s, cost_model=cost_model) for b, s in screen_pairs(buys, sells, cost_model=cost_model)
+    )
+    return [s for s in possible_sweeps if s.is_profitable]
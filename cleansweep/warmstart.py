@@ -0,0 +1,227 @@
+"""Save the latest candidate tokens and order books to disk, so a restart picks up where the last run left off
+
+The file is a log of records, which are only ever appended.  Each is a fixed size
+header, then a key (e.g. a token address), then a compact JSON payload:
+
+    magic (2 bytes) | kind (1) | saved at, wall clock seconds (8) | key length (2) | payload length (4)
+
+Loading memory maps the file and walks the headers, so only the latest record of
+each kind and key is decoded.  A record cut short by a crash is dropped.  Once the
+file grows to `WARM_START_COMPACT_RATIO` times the size of the latest records,
+it's rewritten with only those.
+
+Saving only queues the tokens or book.  `flush_in_background` encodes and writes
+what was queued on a thread, so the scan loop never waits on the disk.
+"""
+import asyncio
+import functools
+import json
+import mmap
+import os
+import struct
+import time
+
+import attr
+
+from cleansweep.constants import (
+    logger,
+    WARM_START_COMPACT_RATIO,
+    WARM_START_MAX_AGE_SECONDS,
+)
+from cleansweep.metrics import metrics
+from cleansweep.records import (
+    EthOrder,
+    TokenSnapshot,
+)
+
+RECORD_MAGIC = b'CS'
+# magic, kind, saved at, key length, payload length
+RECORD_HEADER = struct.Struct('<2sBdHI')
+# Kinds of record. There's one market record, and a book record per token
+MARKET_RECORD = 1
+BOOK_RECORD = 2
+# Files smaller than this are never compacted
+MIN_COMPACT_BYTES = 1 << 20
+
+
+def encode_record(kind, key, saved_at, payload):
+    """The bytes of a record, with `payload` as JSON"""
+    key = key.encode()
+    payload = json.dumps(payload, separators=(',', ':')).encode()
+    return RECORD_HEADER.pack(RECORD_MAGIC, kind, saved_at, len(key), len(payload)) + key + payload
+
+
+def scan_records(buffer):
+    """Yield `(kind, key, saved_at, offset, size)` of each whole record in `buffer`, stopping at a torn one"""
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(buffer):
+        magic, kind, saved_at, key_length, payload_length = RECORD_HEADER.unpack_from(buffer, offset)
+        size = RECORD_HEADER.size + key_length + payload_length
+        if magic != RECORD_MAGIC or offset + size > len(buffer):
+            return
+        key_start = offset + RECORD_HEADER.size
+        yield kind, buffer[key_start:key_start + key_length].decode(), saved_at, offset, size
+        offset += size
+
+
+def decode_payload(buffer, offset):
+    """The payload of the record at `offset` of `buffer`"""
+    _, _, _, key_length, payload_length = RECORD_HEADER.unpack_from(buffer, offset)
+    start = offset + RECORD_HEADER.size + key_length
+    return json.loads(buffer[start:start + payload_length].decode())
+
+
+def _market_payload(tokens):
+    return [[t.ticker, t.address, t.buy, t.sell] for t in tokens]
+
+
+def _order_payload(order):
+    return [
+        order.id, order.token_amount, order.eth_amount, order.price, order.updated,
+        order.token_get_address, order.token_give_address,
+    ]
+
+
+def _book_payload(buys, sells):
+    return [[_order_payload(o) for o in buys], [_order_payload(o) for o in sells]]
+
+
+@attr.s(frozen=True, slots=True)
+class SavedBook:
+    """A token's book as it was saved, with each side sorted like `OrderBook`'s"""
+    # Seconds since the book was saved
+    age = attr.ib()
+    buys = attr.ib()
+    sells = attr.ib()
+
+
+@attr.s(frozen=True, slots=True)
+class SavedState:
+    """What was saved of the last run.  Empty if nothing recent enough was"""
+    # Seconds since the candidate tokens were saved
+    market_age = attr.ib(default=None)
+    # The candidate `TokenSnapshot`s
+    tokens = attr.ib(default=())
+    # `SavedBook` of the candidates whose book was saved, by token address
+    books = attr.ib(factory=dict)
+
+
+class WarmStartStore:
+    """The warm start file at `path`.  `load` it once, before saving anything
+
+    Params:
+        `clock` - wall clock time, since ages have to be measured across restarts
+    """
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self._clock = clock
+        # (kind, key) -> (saved_at, offset, size) of the latest record of each
+        self._index = {}
+        # (kind, key) -> (saved_at, function returning the payload), waiting to be written
+        self._pending = {}
+        self._flushing = None
+
+    def load(self, max_age=WARM_START_MAX_AGE_SECONDS):
+        """Index the file, and return the `SavedState` of the market and books saved in the last `max_age` seconds"""
+        try:
+            file = open(self.path, 'r+b')
+        except FileNotFoundError:
+            return SavedState()
+
+        with file:
+            size = os.fstat(file.fileno()).st_size
+            if not size:
+                return SavedState()
+            end = 0
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                for kind, key, saved_at, offset, record_size in scan_records(buffer):
+                    self._index[kind, key] = (saved_at, offset, record_size)
+                    end = offset + record_size
+                state = self._decode(buffer, max_age)
+            if end < size:
+                logger.warning('Dropping a torn record of {} bytes from {}'.format(size - end, self.path))
+                file.truncate(end)
+        return state
+
+    def _decode(self, buffer, max_age):
+        now = self._clock()
+        market = self._index.get((MARKET_RECORD, ''))
+        if market is None or now - market[0] > max_age:
+            return SavedState()
+
+        tokens = [TokenSnapshot(*fields) for fields in decode_payload(buffer, market[1])]
+        books = {}
+        for token in tokens:
+            entry = self._index.get((BOOK_RECORD, token.address))
+            if entry is None or now - entry[0] > max_age:
+                continue
+            buys, sells = decode_payload(buffer, entry[1])
+            books[token.address] = SavedBook(
+                age=max(now - entry[0], 0),
+                buys=[EthOrder(*fields) for fields in buys],
+                sells=[EthOrder(*fields) for fields in sells],
+            )
+        return SavedState(market_age=max(now - market[0], 0), tokens=tokens, books=books)
+
+    def save_market(self, tokens):
+        """Queue the candidate `TokenSnapshot`s to be written, replacing the last ones"""
+        self._pending[MARKET_RECORD, ''] = (self._clock(), functools.partial(_market_payload, list(tokens)))
+
+    def save_book(self, book):
+        """Queue an `OrderBook`'s orders to be written, replacing the last ones saved for its token"""
+        # Each side is an immutable `OrderColumns`, so it can be encoded later on another thread
+        payload = functools.partial(_book_payload, book.buys, book.sells)
+        self._pending[BOOK_RECORD, book.token_address] = (self._clock(), payload)
+
+    def flush(self):
+        """Write everything queued since the last flush"""
+        pending, self._pending = self._pending, {}
+        self._write(pending)
+
+    def flush_in_background(self):
+        """Start writing everything queued since the last flush on a thread, unless a flush is still running
+
+        Returns the future of the running flush.
+        """
+        if self._flushing is None or self._flushing.done():
+            pending, self._pending = self._pending, {}
+            self._flushing = asyncio.get_event_loop().run_in_executor(None, self._write, pending)
+        return self._flushing
+
+    async def close(self):
+        """Wait for a running flush, then write whatever is left"""
+        if self._flushing is not None:
+            await self._flushing
+        self.flush()
+
+    def _write(self, pending):
+        if not pending:
+            return
+        try:
+            with metrics.time('warm_start_write_seconds'):
+                with open(self.path, 'ab') as file:
+                    offset = file.seek(0, os.SEEK_END)
+                    for (kind, key), (saved_at, payload) in pending.items():
+                        record = encode_record(kind, key, saved_at, payload())
+                        file.write(record)
+                        self._index[kind, key] = (saved_at, offset, len(record))
+                        offset += len(record)
+                live = sum(size for _, _, size in self._index.values())
+                if offset > max(MIN_COMPACT_BYTES, WARM_START_COMPACT_RATIO * live):
+                    self._compact()
+        except OSError as e:
+            logger.warning('Could not write the warm start file {}: {!r}'.format(self.path, e))
+
+    def _compact(self):
+        """Rewrite the file with only the latest record of each kind and key, dropping expired ones"""
+        now = self._clock()
+        index = {}
+        compacted_path = self.path + '.compacting'
+        with open(self.path, 'rb') as file, open(compacted_path, 'wb') as compacted:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                for key, (saved_at, offset, size) in self._index.items():
+                    if now - saved_at <= WARM_START_MAX_AGE_SECONDS:
+                        index[key] = (saved_at, compacted.tell(), size)
+                        compacted.write(buffer[offset:offset + size])
+        os.replace(compacted_path, self.path)
+        self._index = index
@@ -24,6 +24,7 @@ setup(
     ],
     extras_require={  # Optional
         'dev': ['ipython', 'ipdb'],
+        'fast': ['numpy'],
         'test': ['pytest'],
     },
     # Might need to include for specific markets
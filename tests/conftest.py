@@ -0,0 +1,51 @@
+import asyncio
+import itertools
+
+import pytest
+
+from cleansweep.constants import ETHER_TOKEN_ADDRESS
+from cleansweep.records import order_cache
+
+TOKEN_ADDRESS = '0x8f3470a7388c05ee4e7af3d01d8c722b0ff52374'
+
+
+class FakeClock:
+    """A clock for the `clock` argument of anything timed, which only moves when `now` is set"""
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def run(coroutine):
+    """Run `coroutine` to completion on the event loop"""
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+@pytest.fixture(autouse=True)
+def clear_order_cache():
+    """Every test's orders reuse the same ids, so don't let them find each other's in the cache"""
+    order_cache.clear()
+
+
+@pytest.fixture
+def api_order():
+    """Factory for orders shaped like the ones in `getMarket` and pushed `orders` events"""
+    ids = itertools.count()
+
+    def make_api_order(side, price, amount, token_address=TOKEN_ADDRESS, **extra):
+        is_buy = side == 'buy'
+        order = {
+            'id': extra.pop('id', 'order-{}'.format(next(ids))),
+            'ethAvailableVolume': str(amount),
+            'ethAvailableVolumeBase': str(amount * price),
+            'price': str(price),
+            'updated': extra.pop('updated', '2017-11-22T04:55:00.000Z'),
+            'tokenGet': token_address if is_buy else ETHER_TOKEN_ADDRESS,
+            'tokenGive': ETHER_TOKEN_ADDRESS if is_buy else token_address,
+        }
+        order.update(extra)
+        return order
+
+    return make_api_order
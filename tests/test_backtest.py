@@ -0,0 +1,45 @@
+from decimal import Decimal
+
+from cleansweep.backtest import (
+    BacktestResult,
+    backtest,
+    cost_model_grid,
+)
+from cleansweep.constants import MARKET_EVENT_NAME
+from cleansweep.recording import (
+    FrameRecorder,
+    replay,
+)
+from cleansweep.records import DEFAULT_COST_MODEL
+from cleansweep.simulator import (
+    SyntheticMarket,
+    socket_io_message,
+)
+
+
+def test_backtest_grid(tmpdir):
+    path = str(tmpdir.join('capture.gz'))
+    market = SyntheticMarket(tokens=5, orders_per_side=20, crossed_probability=1)
+    with FrameRecorder(path) as recorder:
+        for address in market.books:
+            recorder.record(socket_io_message(MARKET_EVENT_NAME, market.market(address)))
+
+    cost_models = cost_model_grid(
+        max_exposures=[Decimal('.5'), Decimal('5')],
+        gas_prices=[Decimal('.000000001'), Decimal('.001')],
+    )
+    assert cost_models[0] == DEFAULT_COST_MODEL
+
+    results = backtest([path, path], cost_models, workers=1)
+    assert [r.cost_model for r in results] == cost_models
+    assert results[0].books == 10
+    assert results[0].sweeps == 2 * replay(path)['sweeps'] > 0
+    # Costlier gas finds fewer sweeps, and more exposure earns more
+    assert results[1].sweeps < results[0].sweeps
+    assert results[2].revenue > results[0].revenue
+    assert backtest([path, path], cost_models, workers=2) == results
+
+
+def test_backtest_of_nothing_is_empty(tmpdir):
+    assert backtest([], [DEFAULT_COST_MODEL]) == [BacktestResult(DEFAULT_COST_MODEL)]
+    assert backtest([str(tmpdir.join('capture.gz'))], []) == []
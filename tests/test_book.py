@@ -0,0 +1,75 @@
+from cleansweep.book import (
+    OrderBook,
+    OrderBooks,
+)
+from cleansweep.records import order_cache
+
+from conftest import TOKEN_ADDRESS
+
+
+def test_order_book_is_patched_from_pushed_orders(api_order):
+    books = OrderBooks()
+    changed = []
+    books.listeners.append(changed.append)
+    book = books.seed(TOKEN_ADDRESS, {
+        'buys': [api_order('buy', 2, 10, id='b1')],
+        'sells': [api_order('sell', 1, 10, id='s1')],
+    })
+    assert not book.stale
+
+    books.on_orders({
+        'buys': [api_order('buy', 3, 5, id='b2')],
+        'sells': [api_order('sell', 1, 10, id='s1', deleted=True)],
+    })
+    assert [o.id for o in book.buys] == ['b2', 'b1']
+    assert not book.sells
+    assert changed == [book]
+
+    # Orders for untracked tokens are ignored, without being parsed into the cache
+    books.on_orders({
+        'buys': [api_order('buy', 3, 5, token_address='0xother', id='other-buy')],
+        'sells': [api_order('sell', 3, 5, token_address='0xother', id='other-sell')],
+    })
+    assert len(book) == 2
+    assert changed == [book]
+    assert 'other-buy' not in order_cache and 'other-sell' not in order_cache
+
+
+def test_trades_mark_book_stale(api_order):
+    books = OrderBooks()
+    book = books.seed(TOKEN_ADDRESS, {'buys': [], 'sells': []})
+    books.on_trades([{'tokenAddr': TOKEN_ADDRESS}])
+    assert book.stale
+
+
+def test_order_book_sides_are_columnar(api_order):
+    books = OrderBooks()
+    book = books.seed(TOKEN_ADDRESS, {
+        'buys': [api_order('buy', 2, 10, id='b1'), api_order('buy', 1, 5, id='b2')],
+        'sells': [],
+    })
+    assert book.buys.ids == ('b1', 'b2')
+    assert book.buys.prices == tuple(o.price for o in book.buys)
+    assert book.sells.ids == ()
+    assert not hasattr(book.buys[0], '__dict__')
+    # Stored with the side, not built again on every read
+    assert book.buys.token_amounts is book.buys.token_amounts
+
+    books.on_orders({'buys': [api_order('buy', 3, 1, id='b0')], 'sells': []})
+    assert book.buys.ids == ('b0', 'b1', 'b2')
+
+
+def test_unchanged_orders_are_reused_and_removed_ones_evicted(api_order):
+    buy, sell = api_order('buy', .0012, 100), api_order('sell', .001, 100)
+    book = OrderBook(TOKEN_ADDRESS)
+    book.seed({'buys': [buy], 'sells': [sell]})
+    first_buy, first_sell = book.buys[0], book.sells[0]
+
+    changed_sell = dict(sell, ethAvailableVolume='50', updated='2017-11-22T05:00:00.000Z')
+    book.seed({'buys': [buy], 'sells': [changed_sell]})
+    assert book.buys[0] is first_buy
+    assert book.sells[0] is not first_sell and book.sells[0].token_amount == 50 * 10 ** 18
+    assert order_cache.stale == 1
+
+    book.seed({'buys': [], 'sells': [changed_sell]})
+    assert buy['id'] not in order_cache
@@ -0,0 +1,70 @@
+import asyncio
+
+from cleansweep.cache import (
+    SingleFlightCache,
+    TTLCache,
+)
+
+from conftest import FakeClock
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=10, clock=FakeClock())
+    cache.set('a')
+    cache.set('b')
+    assert 'a' in cache
+    cache.set('c')
+    assert 'b' not in cache
+    assert 'a' in cache and 'c' in cache
+    assert cache.stats == {'size': 2, 'hits': 3, 'misses': 1, 'evictions': 1, 'expirations': 0}
+
+
+def test_ttl_cache_expires_entries():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=10, clock=clock)
+    cache.set('a', 1)
+    clock.now = 9
+    assert cache.get('a') == 1
+    clock.now = 10
+    assert cache.get('a') is None
+    assert len(cache) == 0
+    assert cache.expirations == 1
+
+
+def test_single_flight_cache_merges_concurrent_fetches():
+    clock = FakeClock()
+    cache = SingleFlightCache(maxsize=10, ttl=10, clock=clock)
+    fetches = []
+
+    async def fetch():
+        fetches.append(len(fetches))
+        await asyncio.sleep(.01)
+        return len(fetches)
+
+    async def scenario():
+        values = await asyncio.gather(*(cache.get('a', fetch) for _ in range(3)))
+        cached = await cache.get('a', fetch)
+        cache.invalidate('a')
+        return values, cached, await cache.get('a', fetch)
+
+    values, cached, refetched = asyncio.get_event_loop().run_until_complete(scenario())
+    assert values == [1, 1, 1]
+    assert cached == 1
+    assert refetched == 2
+    assert cache.stats['coalesced'] == 2
+    assert cache.stats['hits'] == 1
+
+
+def test_single_flight_cache_shares_errors_without_caching_them():
+    cache = SingleFlightCache(maxsize=10, ttl=10, clock=FakeClock())
+
+    async def fail():
+        await asyncio.sleep(.01)
+        raise ValueError('no market')
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get('a', fail) for _ in range(2)), return_exceptions=True)
+
+    errors = asyncio.get_event_loop().run_until_complete(scenario())
+    assert [type(e) for e in errors] == [ValueError, ValueError]
+    assert len(cache) == 0
@@ -1,4 +1,51 @@
-from cleansweep import get_sweeps_by_token
+import asyncio
+import json
 
-def test_cleansweep():
-    get_sweeps_by_token()
+from cleansweep import (
+    check_for_sweeps,
+    seen_sweeps,
+)
+from cleansweep.clients.etherdelta import EtherDeltaClient
+from cleansweep.records import (
+    Sweep,
+    TokenSnapshot,
+)
+from cleansweep.simulator import (
+    StandInServer,
+    SyntheticMarket,
+)
+
+from conftest import run
+
+
+def test_check_for_sweeps_reports_each_crossed_book(tmpdir, monkeypatch):
+    market = SyntheticMarket(tokens=3, orders_per_side=20, crossed_probability=1)
+    path = str(tmpdir.join('sweeps.jsonl'))
+    candidates = [t.address for t in TokenSnapshot.from_market(market.market()) if t.is_sweep_possible]
+    expected = {
+        address: max(s.revenue for s in sweeps)
+        for address, sweeps in ((a, Sweep.sweeps_from_orders(market.books[a])) for a in candidates)
+        if sweeps
+    }
+    assert expected
+    seen_sweeps.clear()
+
+    def reported():
+        with open(path) as f:
+            return [json.loads(line) for line in f]
+
+    async def scan_until_reported():
+        async with StandInServer(market) as server:
+            monkeypatch.setattr(EtherDeltaClient, 'URI', server.uri)
+            scan = asyncio.ensure_future(check_for_sweeps(output=path))
+            try:
+                for _ in range(100):
+                    await asyncio.sleep(.05)
+                    if len(reported()) >= len(expected):
+                        break
+            finally:
+                scan.cancel()
+                await asyncio.gather(scan, return_exceptions=True)
+
+    run(scan_until_reported())
+    assert {r['address']: r['revenue'] for r in reported()} == expected
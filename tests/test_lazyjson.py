@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+from cleansweep.clients.lazyjson import LazyObject
+from cleansweep.clients.socketio import split_frame
+
+
+def test_lazy_object_decodes_only_what_is_read():
+    market = LazyObject('{"returnTicker": {"ETH_X": {"bid": 0.1}}, "orders": {"buys": [1.5]}}', parse_float=str)
+    assert market['returnTicker'] == {'ETH_X': {'bid': '0.1'}}
+    assert list(market._members) == ['returnTicker']
+    assert 'trades' not in market
+    assert list(market._members) == ['returnTicker']
+    assert market['orders'] == {'buys': ['1.5']}
+    assert dict(market) == json.loads(market._text, parse_float=str)
+
+
+def test_lazy_object_emptiness():
+    assert not LazyObject(' { } ')
+    assert LazyObject('{"a": 1}')
+    with pytest.raises(KeyError):
+        LazyObject('{"a": {"b": 1}}')['b']
+
+
+@pytest.mark.parametrize('message, expected', [
+    ('["market",{"a":1}]', ('market', '{"a":1}')),
+    ('["orders"]', ('orders', '')),
+])
+def test_split_frame(message, expected):
+    assert split_frame(message) == expected
@@ -0,0 +1,33 @@
+from cleansweep.metrics import MetricsRegistry
+
+
+def test_histograms_and_counters():
+    registry = MetricsRegistry(prefix='test_')
+    histogram = registry.histogram('stage_seconds', 'Time in a stage', buckets=(.1, 1))
+    for value in (.05, .1, .5, 2):
+        histogram.observe(value)
+    registry.counter('drops').inc(3)
+    with registry.time('stage_seconds'):
+        pass
+
+    text = registry.to_prometheus_text()
+    assert 'test_drops_total 3\n' in text
+    assert '# HELP test_stage_seconds Time in a stage\n' in text
+    assert 'test_stage_seconds_bucket{le="0.1"} 3\n' in text
+    assert 'test_stage_seconds_bucket{le="1"} 4\n' in text
+    assert 'test_stage_seconds_bucket{le="+Inf"} 5\n' in text
+    assert 'test_stage_seconds_count 5\n' in text
+
+    assert registry.summary_line().startswith('stage_seconds=5x')
+    assert registry.summary_line() == ''
+    registry.counter('drops').inc()
+    assert registry.summary_line() == 'drops=1'
+
+
+def test_write_prometheus(tmpdir):
+    registry = MetricsRegistry()
+    registry.counter('drops').inc()
+    path = tmpdir.join('metrics.prom')
+    registry.write_prometheus(str(path))
+    assert path.read() == registry.to_prometheus_text()
+    assert tmpdir.listdir() == [path]
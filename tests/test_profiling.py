@@ -0,0 +1,45 @@
+import json
+import time
+
+from cleansweep.profiling import Profiler
+from cleansweep.records import EthOrder
+
+
+def test_profiler_writes_stacks_and_allocation_sites(tmpdir, api_order):
+    prefix = str(tmpdir.join('profile'))
+    api_orders = [api_order('buy', .001 + i / 10 ** 6, 100) for i in range(2000)]
+
+    with Profiler(prefix, interval=.001, snapshot_interval=0) as profiler:
+        deadline = time.monotonic() + .2
+        orders = []
+        while time.monotonic() < deadline:
+            orders.extend(EthOrder._parse_api_order(o) for o in api_orders)
+        top = profiler.end_cycle()
+
+    assert any(site.site.startswith('records.py:') and site.size_diff > 0 for site in top)
+    with open(prefix + '.allocations.jsonl') as allocations:
+        cycle, = [json.loads(line) for line in allocations]
+    assert cycle['cycle'] == 1
+    assert cycle['sites'][0]['site'] == top[0].site
+
+    with open(prefix + '.collapsed') as collapsed:
+        lines = collapsed.read().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 0
+    assert any('test_profiling.py:test_profiler_writes_stacks_and_allocation_sites' in line for line in lines)
+    assert orders
+
+
+def test_allocations_are_only_snapshotted_every_interval(tmpdir):
+    now = [0]
+    prefix = str(tmpdir.join('profile'))
+    with Profiler(prefix, snapshot_interval=60, clock=lambda: now[0]) as profiler:
+        assert profiler.end_cycle() is None
+        now[0] = 60
+        assert profiler.end_cycle() is not None
+        assert profiler.end_cycle() is None
+
+    with open(prefix + '.allocations.jsonl') as allocations:
+        cycle, = [json.loads(line) for line in allocations]
+    assert cycle['cycle'] == 2
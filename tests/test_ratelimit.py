@@ -0,0 +1,40 @@
+import asyncio
+
+from cleansweep.clients.ratelimit import SlidingWindowLimiter
+
+from conftest import FakeClock
+
+
+def test_no_window_holds_more_than_rate_requests():
+    clock = FakeClock()
+    limiter = SlidingWindowLimiter(rate=12, period=60, clock=clock)
+    sent = []
+    # Try to send every second for two periods
+    for second in range(120):
+        clock.now = second
+        while limiter.try_acquire():
+            sent.append(second)
+    assert all(sum(1 for t in sent if start <= t < start + 60) <= 12 for start in range(61))
+    assert len(sent) == 24
+
+
+def test_requests_are_allowed_again_a_period_after_they_were_made():
+    clock = FakeClock()
+    limiter = SlidingWindowLimiter(rate=12, period=60, clock=clock)
+    assert all(limiter.try_acquire() for _ in range(12))
+    assert not limiter.try_acquire()
+    clock.now = 59
+    assert limiter.available == 0
+    clock.now = 60
+    assert limiter.available == 12
+
+
+def test_acquire_waits():
+    limiter = SlidingWindowLimiter(rate=1, period=.01)
+
+    async def acquire_twice():
+        await limiter.acquire()
+        await limiter.acquire()
+
+    asyncio.get_event_loop().run_until_complete(acquire_twice())
+    assert limiter.waits == 1
@@ -0,0 +1,67 @@
+from cleansweep.clients.pool import EtherDeltaClientPool
+from cleansweep.clients.ratelimit import SlidingWindowLimiter
+from cleansweep.constants import RECORDING_FLUSH_SECONDS
+from cleansweep.recording import (
+    FrameRecorder,
+    read_frames,
+    replay,
+)
+from cleansweep.simulator import (
+    StandInServer,
+    SyntheticMarket,
+)
+
+from conftest import FakeClock, run
+
+
+def test_recorded_frames_replay(tmpdir):
+    path = str(tmpdir.join('capture.gz'))
+    market = SyntheticMarket(tokens=3, orders_per_side=10, crossed_probability=1)
+
+    async def record():
+        with FrameRecorder(path) as recorder:
+            async with StandInServer(market, noise_probability=1) as server:
+                async with EtherDeltaClientPool.connect(
+                    size=1, uri=server.uri, rate_limiter=SlidingWindowLimiter(1000, 1), recorder=recorder,
+                ) as pool:
+                    await pool.get_market()
+                    for address in market.books:
+                        await pool.get_orders_for_token(address)
+
+    run(record())
+    frames = [frame for _, frame in read_frames(path)]
+    # The socket.io handshake, then a noise event before each of the 4 responses
+    assert frames[:3] == ['0{"sid":"stand-in","pingInterval":25000,"pingTimeout":60000}', '40', '42["funds", {}]']
+    assert len(frames) == 10
+
+    stats = replay(path)
+    assert stats['frames'] == 10
+    assert stats['sweeps'] > 0
+    assert replay(path, speed=1000)['sweeps'] == stats['sweeps']
+
+
+def test_frames_are_readable_before_closing(tmpdir):
+    path = str(tmpdir.join('capture.gz'))
+    clock = FakeClock()
+    recorder = FrameRecorder(path, clock=clock)
+    recorder.record('a')
+    assert recorder._writing is None
+    clock.now += RECORDING_FLUSH_SECONDS
+    recorder.record('b')
+    recorder._writing.result()
+    # Never closed, as if the process had died
+    assert [frame for _, frame in read_frames(path)] == ['a', 'b']
+
+    recorder.record('c')
+    with FrameRecorder(path, clock=clock) as restarted:
+        restarted.record('d')
+    assert [frame for _, frame in read_frames(path)] == ['a', 'b', 'd']
+
+
+def test_frames_may_contain_anything(tmpdir):
+    path = str(tmpdir.join('capture.gz'))
+    frames = ['42["market", {"note": "one\ntwo"}]', 'tab\there', '', 'caf\u00e9\r\n', '3']
+    with FrameRecorder(path) as recorder:
+        for frame in frames:
+            recorder.record(frame)
+    assert [frame for _, frame in read_frames(path)] == frames
@@ -0,0 +1,143 @@
+from itertools import product
+import random
+
+import pytest
+
+from cleansweep import vectorized
+from cleansweep.constants import (
+    ETHER_TOKEN_ADDRESS,
+    MAX_EXPOSURE_WEI,
+    TOKEN_PRECISION,
+)
+from cleansweep.records import (
+    DEFAULT_COST_MODEL,
+    EthOrder,
+    Sweep,
+    SweepPlan,
+    to_fixed,
+)
+
+from conftest import TOKEN_ADDRESS
+
+
+def cartesian_sweeps(buys, sells):
+    """Every profitable buy/sell pair, by comparing every buy to every sell"""
+    possible_sweeps = (
+        Sweep(b, s) for (b, s) in product(buys, sells)
+        if b.price > sells[0].price and s.price < buys[0].price
+    )
+    return [s for s in possible_sweeps if s.is_profitable]
+
+
+def random_book(api_order, rng, size):
+    buys = sorted(
+        (api_order('buy', round(rng.uniform(.0009, .0012), 7), rng.choice([1, 50, 5000])) for _ in range(size)),
+        key=lambda o: -float(o['price']),
+    )
+    sells = sorted(
+        (api_order('sell', round(rng.uniform(.0008, .0011), 7), rng.choice([1, 50, 5000])) for _ in range(size)),
+        key=lambda o: float(o['price']),
+    )
+    return {'buys': buys, 'sells': sells}
+
+
+def test_sweeps_match_comparing_every_pair(api_order):
+    rng = random.Random(1)
+    for size in (0, 1, 5, 40):
+        for _ in range(10):
+            buys, sells = EthOrder.from_get_market_orders(random_book(api_order, rng, size))
+            expected = cartesian_sweeps(buys, sells) if buys and sells else []
+            assert Sweep.sweeps_from_buys_and_sells(buys, sells) == expected
+
+
+def test_no_sweeps_on_uncrossed_book(api_order):
+    orders = {
+        'buys': [api_order('buy', .001, 100)],
+        'sells': [api_order('sell', .002, 100)],
+    }
+    assert Sweep.sweeps_from_orders(orders) == []
+
+
+def test_orders_too_small_to_cover_fees_are_never_paired(api_order, monkeypatch):
+    buys, sells = EthOrder.from_get_market_orders({
+        'buys': [api_order('buy', round(.002 - i / 10 ** 6, 7), 10 ** 6) for i in range(300)],
+        'sells': [api_order('sell', round(.001 + i / 10 ** 6, 7), .000001) for i in range(300)],
+    })
+    pairs = []
+    monkeypatch.setattr(Sweep, 'is_profitable', property(pairs.append))
+    assert Sweep.sweeps_from_buys_and_sells(buys, sells) == []
+    assert pairs == []
+
+
+def test_sweep_rounded_down_to_no_revenue_is_not_profitable():
+    cost_model = DEFAULT_COST_MODEL
+    buy_price, sell_price = 11 * 10 ** 13, 10 * 10 ** 13
+    scale = TOKEN_PRECISION * cost_model.fee_denominator
+    scaled_difference = buy_price * cost_model.fee_denominator - sell_price * (
+        cost_model.fee_denominator - cost_model.fee_numerator
+    )
+    # Gross revenue just over the fee, but less than a wei over it
+    tokens = cost_model.txn_fee * scale // scaled_difference + 1
+    buy = EthOrder('buy', tokens, 0, buy_price, 'then', TOKEN_ADDRESS, ETHER_TOKEN_ADDRESS)
+    sell = EthOrder('sell', tokens, 0, sell_price, 'then', ETHER_TOKEN_ADDRESS, TOKEN_ADDRESS)
+    sweep = Sweep(buy, sell)
+    assert sweep.amount_of_tokens_to_buy == tokens
+    assert sweep._scaled_gross_revenue > cost_model.txn_fee * scale
+    assert sweep.revenue == 0
+    assert not sweep.is_profitable
+    assert Sweep.sweeps_from_buys_and_sells([buy], [sell]) == []
+
+
+def test_sweep_plan_of_one_pair_matches_sweep(api_order):
+    buys, sells = EthOrder.from_get_market_orders({
+        'buys': [api_order('buy', .0012, 100)],
+        'sells': [api_order('sell', .001, 100)],
+    })
+    plan = SweepPlan.from_buys_and_sells(buys, sells)
+    sweep = Sweep(buys[0], sells[0])
+    assert len(plan.fills) == 1
+    assert plan.revenue == sweep.revenue
+    assert plan.buy_total == sweep.buy_total
+
+
+def test_sweep_plan_fills_several_levels_within_exposure(api_order):
+    buys, sells = EthOrder.from_get_market_orders({
+        'buys': [api_order('buy', .0013, 100), api_order('buy', .0012, 300)],
+        'sells': [api_order('sell', .001, 200), api_order('sell', .0011, 1000)],
+    })
+    plan = SweepPlan.from_buys_and_sells(buys, sells)
+    best_sweep = max(Sweep.sweeps_from_buys_and_sells(buys, sells), key=lambda s: s.revenue)
+    assert len(plan.fills) == 3
+    assert plan.revenue > best_sweep.revenue
+    exposure = sum(f.amount_of_tokens_to_buy * f.sell.price for f in plan.fills)
+    assert exposure <= MAX_EXPOSURE_WEI * TOKEN_PRECISION
+
+
+def test_sweep_plan_fills_each_earn_their_fee(api_order):
+    rng = random.Random(3)
+    for size in (1, 5, 40):
+        for _ in range(20):
+            buys, sells = EthOrder.from_get_market_orders(random_book(api_order, rng, size))
+            plan = SweepPlan.from_buys_and_sells(buys, sells)
+            assert all(f.revenue > 0 for f in plan.fills)
+            exposure = sum(f.amount_of_tokens_to_buy * f.sell.price for f in plan.fills)
+            assert exposure <= MAX_EXPOSURE_WEI * TOKEN_PRECISION
+
+
+def test_vectorized_sweeps_match_exact_sweeps(api_order):
+    pytest.importorskip('numpy')
+    rng = random.Random(2)
+    buys, sells = EthOrder.from_get_market_orders(random_book(api_order, rng, 60))
+    assert vectorized.sweeps_from_buys_and_sells(buys, sells) == Sweep.sweeps_from_buys_and_sells(buys, sells)
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('0.0012', 12 * 10 ** 14),
+    ('12', 12 * 10 ** 18),
+    ('-0.5', -5 * 10 ** 17),
+    ('1e-05', 10 ** 13),
+    ('0.1234567890123456789', 123456789012345678),
+    (3, 3 * 10 ** 18),
+])
+def test_to_fixed(value, expected):
+    assert to_fixed(value, 18) == expected
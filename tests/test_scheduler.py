@@ -0,0 +1,92 @@
+from cleansweep.book import OrderBook
+from cleansweep.constants import (
+    MARKET_REFRESH_SECONDS,
+    MIN_TOKEN_REFRESH_SECONDS,
+    SWEEP_RESULT_TTL_SECONDS,
+    WEI_PER_ETHER,
+)
+from cleansweep.records import TokenSnapshot
+from cleansweep.scheduler import (
+    TokenScheduler,
+    book_fingerprint,
+)
+
+from conftest import FakeClock
+
+
+def token(address, buy, sell):
+    return TokenSnapshot(ticker=address, address=address, buy=buy, sell=sell)
+
+
+def test_scheduler_prefers_unfetched_then_valuable_tokens():
+    clock = FakeClock()
+    scheduler = TokenScheduler(clock=clock)
+    scheduler.update_candidates([token('a', 11, 10), token('b', 20, 10)])
+    assert {t.address for t in scheduler.next_batch(2)} == {'a', 'b'}
+
+    for address, revenue in (('a', 0), ('b', WEI_PER_ETHER)):
+        scheduler.record_refresh(address, book_fingerprint(OrderBook(address)), revenue)
+    assert scheduler.next_batch(2) == []
+    # The market is due again before either token's result expires
+    assert scheduler.seconds_until_due() == MARKET_REFRESH_SECONDS
+
+    clock.now = SWEEP_RESULT_TTL_SECONDS
+    assert [t.address for t in scheduler.next_batch(1)] == ['b']
+
+
+def test_scheduler_backs_off_unchanged_books():
+    clock = FakeClock()
+    scheduler = TokenScheduler(clock=clock)
+    scheduler.update_candidates([token('a', 11, 10)])
+    book = OrderBook('a')
+    for _ in range(4):
+        scheduler.record_refresh('a', book_fingerprint(book), 0)
+        clock.now += SWEEP_RESULT_TTL_SECONDS
+    # Each refresh after the first found the book unchanged, and doubled its interval
+    start = clock.now - SWEEP_RESULT_TTL_SECONDS
+    assert scheduler.next_batch(1) == []
+    clock.now = start + 8 * MIN_TOKEN_REFRESH_SECONDS
+    assert scheduler.next_batch(1) == [token('a', 11, 10)]
+
+
+def test_scheduler_refreshes_changed_tokens_and_reuses_results():
+    clock = FakeClock()
+    scheduler = TokenScheduler(clock=clock)
+    tokens = [token('a', 11, 10), token('b', 11, 10)]
+    assert scheduler.update_candidates(tokens) == tokens
+    for address in 'ab':
+        scheduler.record_refresh(address, book_fingerprint(OrderBook(address)), 0, result=[address])
+
+    clock.now = MIN_TOKEN_REFRESH_SECONDS
+    assert scheduler.update_candidates([token('a', 12, 10), token('b', 11, 10)]) == [token('a', 12, 10)]
+    assert scheduler.next_batch(2) == [token('a', 12, 10)]
+
+    # The unchanged book's result is reused until it expires
+    cached = scheduler.cached_result('b', book_fingerprint(OrderBook('b')))
+    assert cached == ['b']
+    scheduler.record_refresh('b', book_fingerprint(OrderBook('b')), 0, result=cached, reused=True)
+    clock.now = SWEEP_RESULT_TTL_SECONDS
+    assert scheduler.cached_result('b', book_fingerprint(OrderBook('b'))) is None
+
+
+def test_scheduler_restarts_the_expiry_of_new_results():
+    clock = FakeClock()
+    scheduler = TokenScheduler(clock=clock)
+    scheduler.update_candidates([token('a', 11, 10)])
+    fingerprint = book_fingerprint(OrderBook('a'))
+    scheduler.record_refresh('a', fingerprint, 0, result=('sweeps',))
+
+    # Worked out again, an equal result is still new, and expires later
+    clock.now = SWEEP_RESULT_TTL_SECONDS - 1
+    scheduler.record_refresh('a', fingerprint, 0, result=('sweeps',))
+    clock.now = SWEEP_RESULT_TTL_SECONDS
+    assert scheduler.cached_result('a', fingerprint) == ('sweeps',)
+
+
+def test_fingerprint_changes_with_available_volume(api_order):
+    book = OrderBook('a')
+    book.seed({'buys': [api_order('buy', .0012, 1000, id='b')], 'sells': [api_order('sell', .001, 100, id='s')]})
+    fingerprint = book_fingerprint(book)
+    # Partly filled, without a new `updated`
+    book.seed({'buys': [api_order('buy', .0012, 1, id='b')], 'sells': [api_order('sell', .001, 100, id='s')]})
+    assert book_fingerprint(book) != fingerprint
@@ -0,0 +1,64 @@
+import pytest
+
+from cleansweep.clients import etherdelta
+from cleansweep.clients.etherdelta import (
+    EmptyResponseError,
+    EtherDeltaClient,
+)
+from cleansweep.clients.ratelimit import SlidingWindowLimiter
+from cleansweep.constants import MAX_EMPTY_MARKET_RETRIES
+from cleansweep.session import SupervisedSession
+from cleansweep.simulator import (
+    StandInServer,
+    SyntheticMarket,
+)
+
+from conftest import run
+
+
+async def no_sleep(seconds):
+    pass
+
+
+def test_session_reconnects_keeping_books():
+    market = SyntheticMarket(tokens=1, orders_per_side=5)
+    address, = market.books
+    calls = []
+
+    async def scan(pool):
+        calls.append(pool)
+        if len(calls) == 1:
+            book = await pool.get_order_book(address)
+            assert not book.stale
+            await pool.clients[0].close()
+            await pool.get_market()
+        return pool.order_books[address]
+
+    async def supervise():
+        async with StandInServer(market) as server:
+            session = SupervisedSession(
+                size=1, uri=server.uri, rate_limiter=SlidingWindowLimiter(1000, 1), sleep=no_sleep,
+            )
+            return session, await session.run(scan)
+
+    session, book = run(supervise())
+    assert session.connections == len(calls) == 2
+    # The book was kept, but may have missed pushed updates while reconnecting
+    assert book is session.order_books[address]
+    assert book.stale
+
+
+def test_empty_responses_are_retried_a_limited_number_of_times(monkeypatch):
+    monkeypatch.setattr(etherdelta, 'EMPTY_MARKET_RETRY_SECONDS', 0)
+    market = SyntheticMarket(tokens=1, orders_per_side=5)
+
+    async def get_market():
+        async with StandInServer(market, empty_probability=1) as server:
+            async with EtherDeltaClient.connect(uri=server.uri, rate_limiter=SlidingWindowLimiter(1000, 1)) as client:
+                try:
+                    await client.get_market()
+                finally:
+                    assert server.requests == MAX_EMPTY_MARKET_RETRIES + 1
+
+    with pytest.raises(EmptyResponseError):
+        run(get_market())
@@ -0,0 +1,46 @@
+import asyncio
+import json
+
+from cleansweep import sweeps_from_book
+from cleansweep.book import OrderBook
+from cleansweep.clients.etherdelta import market_token_address
+from cleansweep.constants import SHARDED_TOP_SWEEPS
+from cleansweep.scheduler import book_fingerprint
+from cleansweep.sharding import (
+    ShardedEvaluator,
+    shard_for,
+)
+from cleansweep.simulator import SyntheticMarket
+
+
+def test_sharded_evaluation_matches_local_evaluation():
+    market = SyntheticMarket(tokens=4, orders_per_side=30, crossed_probability=1)
+    texts = {address: json.dumps(market.market(address)) for address in market.books}
+
+    async def evaluate():
+        async with ShardedEvaluator(2) as evaluator:
+            return await asyncio.gather(*(evaluator.evaluate(a, text) for a, text in texts.items()))
+
+    results = asyncio.get_event_loop().run_until_complete(evaluate())
+    assert {shard_for(address, 2) for address in texts} == {0, 1}
+    for result in results:
+        book = OrderBook(result.token_address)
+        book.seed(market.books[result.token_address])
+        sweeps, plan = sweeps_from_book(book)
+        assert result.fingerprint == book_fingerprint(book)
+        assert result.best_revenue == max([s.revenue for s in sweeps] + [plan.revenue])
+        # Only the best sweeps come back, and they're the same as if they had been found here
+        best_sweeps = sorted(sweeps, key=lambda s: s.revenue, reverse=True)[:SHARDED_TOP_SWEEPS]
+        assert [s.revenue for s in result.sweeps] == [s.revenue for s in best_sweeps]
+        assert {s.fingerprint for s in result.sweeps} <= {s.fingerprint for s in sweeps}
+        assert result.plan == plan
+        assert result.best_revenue > 0
+
+
+def test_market_token_address_is_read_from_the_text(api_order):
+    market = SyntheticMarket(tokens=1, orders_per_side=3)
+    address, = market.books
+    assert market_token_address(json.dumps(market.market(address))) == address
+    assert market_token_address(json.dumps(market.market())) is None
+    only_sells = {'orders': {'buys': [], 'sells': [api_order('sell', .001, 1, token_address='0x1')]}}
+    assert market_token_address(json.dumps(only_sells, indent=1)) == '0x1'
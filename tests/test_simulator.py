@@ -0,0 +1,98 @@
+import asyncio
+import json
+
+from cleansweep.clients.etherdelta import EtherDeltaClient
+from cleansweep.clients.pool import EtherDeltaClientPool
+from cleansweep.clients.ratelimit import SlidingWindowLimiter
+from cleansweep.records import TokenSnapshot
+from cleansweep.simulator import (
+    StandInServer,
+    SyntheticMarket,
+    measure_pipeline,
+)
+
+from conftest import run
+
+
+def test_same_seed_makes_same_market():
+    first, second = SyntheticMarket(tokens=3, orders_per_side=5), SyntheticMarket(tokens=3, orders_per_side=5)
+    assert first.books == second.books
+    assert first.random_update() == second.random_update()
+
+
+def test_client_against_stand_in_server():
+    market = SyntheticMarket(tokens=5, orders_per_side=10)
+
+    async def fetch_everything():
+        async with StandInServer(market, empty_probability=.3, noise_probability=.5) as server:
+            async with EtherDeltaClient.connect(uri=server.uri, rate_limiter=SlidingWindowLimiter(1000, 1)) as client:
+                tokens = TokenSnapshot.from_market(await client.get_market())
+                orders = [await client.get_orders_for_token(t.address) for t in tokens]
+                texts = [await client.get_market_text(t.address) for t in tokens]
+                return tokens, orders, texts
+
+    tokens, orders, texts = run(fetch_everything())
+    assert len(tokens) == 5
+    assert orders == [market.books[t.address] for t in tokens]
+    assert [json.loads(text)['orders'] for text in texts] == orders
+
+
+def test_books_follow_pushed_updates():
+    market = SyntheticMarket(tokens=1, orders_per_side=5)
+    address, = market.books
+
+    async def track_book():
+        async with StandInServer(market, push_rate=200) as server:
+            async with EtherDeltaClient.connect(uri=server.uri, rate_limiter=SlidingWindowLimiter(1000, 1)) as client:
+                book = await client.get_order_book(address)
+                await client.listen(.2)
+                # Stop pushing, then handle whatever was still in flight
+                server.push_rate = 0
+                await client.listen(.1)
+                requests = server.requests
+                # Pushed updates keep it current, so it isn't fetched again
+                assert await client.get_order_book(address) is book
+                assert server.requests == requests
+                return book
+
+    book = run(track_book())
+    # Replacement orders keep their price, so ties may be in any order
+    assert {o.id for o in book.buys} == {o['id'] for o in market.books[address]['buys']}
+    assert [o.price for o in book.buys] == sorted((o.price for o in book.buys), reverse=True)
+
+
+def test_measure_pipeline():
+    market = SyntheticMarket(tokens=10, orders_per_side=20, crossed_probability=1)
+
+    async def measure():
+        async with StandInServer(market) as server:
+            return await measure_pipeline(server, connections=2)
+
+    results = run(measure())
+    assert results['tokens'] == 10
+    assert results['sweeps'] > 0
+
+
+def test_pool_sends_identical_requests_once():
+    market = SyntheticMarket(tokens=1, orders_per_side=5)
+    address, = market.books
+
+    async def fetch_at_once():
+        async with StandInServer(market) as server:
+            async with EtherDeltaClientPool.connect(
+                size=3, uri=server.uri, rate_limiter=SlidingWindowLimiter(1000, 1), ping_interval=None,
+            ) as pool:
+                orders = await asyncio.gather(
+                    *(pool.get_orders_for_token(address) for _ in range(3)),
+                    pool.get_market(),
+                    pool.get_token_summaries(),
+                )
+                requests = server.requests
+                pool.invalidate_market(address)
+                await pool.get_orders_for_token(address)
+                return orders, requests, server.requests
+
+    orders, requests, requests_after_invalidating = run(fetch_at_once())
+    assert orders[:3] == [market.books[address]] * 3
+    assert requests == 2
+    assert requests_after_invalidating == 3
@@ -0,0 +1,121 @@
+import asyncio
+import json
+
+from cleansweep.records import (
+    EthOrder,
+    Sweep,
+    TokenSnapshot,
+)
+from cleansweep.sinks import (
+    BLOCK,
+    DROP_NEWEST,
+    DROP_OLDEST,
+    FileTransport,
+    JSONLinesSink,
+    UnixSocketTransport,
+    sweep_record,
+)
+
+from conftest import run
+
+
+class ListTransport:
+    """Keeps what's written, and can be held up to act like a slow reader"""
+    def __init__(self):
+        self.lines = []
+        self.unblocked = asyncio.Event()
+        self.unblocked.set()
+
+    async def write(self, data):
+        await self.unblocked.wait()
+        self.lines.extend(json.loads(line) for line in data.splitlines())
+
+    async def close(self):
+        pass
+
+
+def test_drop_policies_keep_the_queue_bounded():
+    oldest = JSONLinesSink(ListTransport(), maxsize=2, policy=DROP_OLDEST)
+    newest = JSONLinesSink(ListTransport(), maxsize=2, policy=DROP_NEWEST)
+    for sink in (oldest, newest):
+        assert [sink.put(i) for i in range(4)] == [True, True, False, False]
+        assert len(sink) == 2
+        assert sink.dropped == 2
+    assert list(oldest._queue) == [2, 3]
+    assert list(newest._queue) == [0, 1]
+
+
+def test_block_policy_holds_back_drain_until_written():
+    transport = ListTransport()
+    transport.unblocked.clear()
+    sink = JSONLinesSink(transport, maxsize=2, policy=BLOCK, batch_size=1)
+
+    async def scenario():
+        async with sink:
+            for i in range(3):
+                assert sink.put(i)
+            drain = asyncio.ensure_future(sink.drain())
+            await asyncio.sleep(.01)
+            assert not drain.done()
+            transport.unblocked.set()
+            await asyncio.wait_for(drain, 1)
+
+    run(scenario())
+    assert transport.lines == [0, 1, 2]
+    assert sink.dropped == 0
+
+
+def test_block_policy_drops_records_past_the_overflow():
+    sink = JSONLinesSink(ListTransport(), maxsize=2, policy=BLOCK, overflow=1)
+    # Nothing awaits `drain` in between, e.g. records put by listeners
+    assert [sink.put(i) for i in range(5)] == [True, True, True, False, False]
+    assert list(sink._queue) == [0, 1, 2]
+    assert sink.overflowed == sink.dropped == 2
+
+
+def test_sweep_records_written_as_json_lines(tmpdir, api_order):
+    buys, sells = EthOrder.from_get_market_orders({
+        'buys': [api_order('buy', .0012, 100)],
+        'sells': [api_order('sell', .001, 100)],
+    })
+    sweep = Sweep(buys[0], sells[0])
+    token = TokenSnapshot(ticker='TKN', address=buys[0].token_address, buy=buys[0].price, sell=sells[0].price)
+    path = str(tmpdir.join('sweeps.jsonl'))
+
+    async def scenario():
+        async with JSONLinesSink(FileTransport(path)) as sink:
+            sink.put(sweep_record(token, sweep))
+
+    run(scenario())
+    with open(path) as lines:
+        record, = [json.loads(line) for line in lines]
+    assert record['ticker'] == 'TKN'
+    assert record['revenue'] == sweep.revenue
+    assert record['num_tokens'] == sweep.amount_of_tokens_to_buy
+    assert (record['buy_id'], record['sell_id']) == (buys[0].id, sells[0].id)
+
+
+def test_unix_socket_transport(tmpdir):
+    path = str(tmpdir.join('sweeps.sock'))
+    received = []
+
+    async def scenario():
+        done = asyncio.Event()
+
+        async def handle(reader, writer):
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                received.append(json.loads(line))
+            done.set()
+
+        server = await asyncio.start_unix_server(handle, path)
+        async with JSONLinesSink(UnixSocketTransport(path)) as sink:
+            sink.put({'a': 1})
+            sink.put({'b': 2})
+        await asyncio.wait_for(done.wait(), 1)
+        server.close()
+
+    run(scenario())
+    assert received == [{'a': 1}, {'b': 2}]
@@ -0,0 +1,111 @@
+import os
+
+from cleansweep import (
+    print_maximum_sweep,
+    restore_state,
+    seen_sweeps,
+    sweeps_from_book,
+)
+from cleansweep.book import OrderBooks
+from cleansweep.records import TokenSnapshot
+from cleansweep.scheduler import TokenScheduler
+from cleansweep.sinks import JSONLinesSink
+from cleansweep import warmstart
+from cleansweep.warmstart import WarmStartStore
+
+from conftest import TOKEN_ADDRESS, FakeClock
+
+
+def seeded_book(api_order):
+    books = OrderBooks()
+    return books.seed(TOKEN_ADDRESS, {
+        'buys': [api_order('buy', .0012, 100), api_order('buy', .0011, 50)],
+        'sells': [api_order('sell', .001, 100)],
+    })
+
+
+def test_saved_market_and_books_load_after_restart(tmpdir, api_order):
+    path = str(tmpdir.join('state'))
+    clock = FakeClock(now=1000.0)
+    token = TokenSnapshot(ticker='TKN', address=TOKEN_ADDRESS, buy=1200000000000000, sell=None)
+    book = seeded_book(api_order)
+
+    store = WarmStartStore(path, clock=clock)
+    assert store.load() == warmstart.SavedState()
+    store.save_market([token])
+    store.save_book(book)
+    store.flush()
+
+    clock.now += 5
+    saved = WarmStartStore(path, clock=clock).load()
+    assert saved.market_age == 5
+    assert saved.tokens == [token]
+    saved_book = saved.books[TOKEN_ADDRESS]
+    assert saved_book.age == 5
+    assert saved_book.buys == list(book.buys)
+    assert saved_book.sells == list(book.sells)
+
+
+def test_old_state_and_torn_records_are_dropped(tmpdir, api_order):
+    path = str(tmpdir.join('state'))
+    clock = FakeClock(now=1000.0)
+    token = TokenSnapshot(ticker='TKN', address=TOKEN_ADDRESS, buy=2, sell=1)
+    store = WarmStartStore(path, clock=clock)
+    store.load()
+    store.save_market([token])
+    store.flush()
+    size = os.path.getsize(path)
+    # A crash part way through appending the next record
+    with open(path, 'ab') as file:
+        file.write(warmstart.encode_record(warmstart.BOOK_RECORD, TOKEN_ADDRESS, clock.now, [[], []])[:-3])
+
+    assert WarmStartStore(path, clock=clock).load().tokens == [token]
+    assert os.path.getsize(path) == size
+
+    clock.now += warmstart.WARM_START_MAX_AGE_SECONDS + 1
+    assert WarmStartStore(path, clock=clock).load() == warmstart.SavedState()
+
+
+def test_file_is_compacted_to_the_latest_records(tmpdir, monkeypatch):
+    monkeypatch.setattr(warmstart, 'MIN_COMPACT_BYTES', 0)
+    path = str(tmpdir.join('state'))
+    store = WarmStartStore(path, clock=FakeClock(now=1000.0))
+    store.load()
+    for buy in range(10):
+        store.save_market([TokenSnapshot(ticker='TKN', address=TOKEN_ADDRESS, buy=buy, sell=1)])
+        store.flush()
+
+    record_size = len(warmstart.encode_record(warmstart.MARKET_RECORD, '', 0, [['TKN', TOKEN_ADDRESS, 9, 1]]))
+    assert os.path.getsize(path) <= warmstart.WARM_START_COMPACT_RATIO * record_size
+    assert WarmStartStore(path, clock=FakeClock(now=1000.0)).load().tokens[0].buy == 9
+
+
+def test_restored_books_are_due_oldest_first(api_order):
+    seen_sweeps.clear()
+    books = OrderBooks()
+    book = seeded_book(api_order)
+    fresh = TokenSnapshot(ticker='TKN', address=TOKEN_ADDRESS, buy=book.buys[0].price, sell=book.sells[0].price)
+    missing = TokenSnapshot(ticker='NEW', address='0x1', buy=2, sell=1)
+    saved = warmstart.SavedState(
+        market_age=5,
+        tokens=[fresh, missing],
+        books={TOKEN_ADDRESS: warmstart.SavedBook(age=5, buys=list(book.buys), sells=list(book.sells))},
+    )
+    scheduler = TokenScheduler(clock=FakeClock(now=1000.0))
+    sink = JSONLinesSink(transport=None)
+
+    tokens_by_address = restore_state(saved, scheduler, books, sink)
+    assert set(tokens_by_address) == {TOKEN_ADDRESS, '0x1'}
+    assert books[TOKEN_ADDRESS].stale
+    assert len(books[TOKEN_ADDRESS]) == 3
+    # The sweep in the saved book is reported without fetching anything, marked as stale
+    record, = sink._queue
+    assert record['address'] == TOKEN_ADDRESS
+    assert record['stale'] and record['age'] == 5
+    # and again once the book is fetched
+    sweeps, plan = sweeps_from_book(books[TOKEN_ADDRESS])
+    print_maximum_sweep(fresh, sweeps, plan=plan, sink=sink)
+    assert not sink._queue[-1]['stale']
+    assert sink._queue[-1]['buy_id'] == record['buy_id']
+    assert not scheduler.is_market_due
+    assert scheduler.next_batch(2) == [missing]